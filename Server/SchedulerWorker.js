@@ -0,0 +1,145 @@
+import { createRequire } from 'module';
+const require = createRequire(import.meta.url);
+const {spawn} = require('child_process');
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+
+// Long-running create_schedule.py process. Requests are written to its STDIN as newline-delimited JSON and responses
+// are matched back to their requests by ID, so they can arrive in any order.
+export class SchedulerWorker
+{
+    // If the worker keeps dying, it is restarted after restartDelayMs, doubling with every failure up to
+    // maxRestartDelayMs, and given up on after maxRestarts failures in a row. A worker that ran for stableMs counts as
+    // healthy again.
+    constructor(pythonPath = '../venv/Scripts/python.exe', scriptPath = '../scheduler/create_schedule.py',
+                catalogPath = '../catalog_parser/catalog.bin', processes = 4, maxRequests = 1000, maxRssMb = 512,
+                maxRestarts = 5, restartDelayMs = 500, maxRestartDelayMs = 30000, stableMs = 60000)
+    {
+        this.pythonPath = pythonPath;
+        this.catalogPath = path.resolve(catalogPath);
+        this.catalogRef = null;
+        this.args = [scriptPath, '--worker', '--catalog', catalogPath, '--processes', '' + processes,
+            '--max-requests', '' + maxRequests, '--max-rss-mb', '' + maxRssMb];
+        this.nextId = 0;
+        this.pending = new Map();
+        this.process = null;
+        this.maxRestarts = maxRestarts;
+        this.restartDelayMs = restartDelayMs;
+        this.maxRestartDelayMs = maxRestartDelayMs;
+        this.stableMs = stableMs;
+        this.failures = 0;
+    }
+
+    start()
+    {
+        // Without a hash there is nothing to send with the requests. Keep the previous one if there is one, the catalog
+        // may only be in the middle of being rewritten.
+        if (!this.refreshCatalog() && this.catalogRef === null) {
+            this.failures++;
+            this.restartLater();
+            return;
+        }
+        const startTime = Date.now();
+        const process = spawn(this.pythonPath, this.args);
+        this.process = process;
+
+        const lines = readline.createInterface({input: this.process.stdout});
+        lines.on('line', (line) => {
+            let response;
+            try {
+                response = JSON.parse(line);
+            }
+            catch (error) {
+                console.log("Invalid response from scheduler : " + line);
+                return;
+            }
+            const callback = this.pending.get(response.id);
+            if (callback !== undefined) {
+                this.pending.delete(response.id);
+                callback(response);
+            }
+        });
+
+        this.process.stderr.on('data', (data) => {
+            console.log("Scheduler : " + data.toString());
+        });
+
+        // Spawning failed (Ex. wrong Python path). 'close' follows, which restarts it.
+        this.process.on('error', (error) => {
+            console.log("Failed to start scheduler worker : " + error.message);
+        });
+
+        // Fail everything in flight and restart if the worker dies
+        this.process.on('close', (code) => {
+            console.log(`scheduler worker exited with code ${code}`);
+            this.failRequests(`Scheduler exited with code ${code}`);
+            if (this.process !== process) {
+                return;
+            }
+            this.process = null;
+
+            // Back off if the worker dies right after starting (Ex. import error or missing catalog)
+            this.failures = Date.now() - startTime >= this.stableMs ? 1 : this.failures + 1;
+            this.restartLater();
+        });
+    }
+
+    // Start the worker again after the backoff delay of the current number of failures in a row
+    restartLater()
+    {
+        if (this.failures > this.maxRestarts) {
+            console.log(`scheduler worker failed ${this.failures} times in a row, not restarting it`);
+            return;
+        }
+        const delay = Math.min(this.restartDelayMs * 2 ** (this.failures - 1), this.maxRestartDelayMs);
+        setTimeout(() => this.start(), delay);
+    }
+
+    failRequests(error)
+    {
+        this.pending.forEach((callback, id) => {
+            callback({'id': id, 'error': error});
+        });
+        this.pending.clear();
+    }
+
+    // Hash the catalog file again. Call this after the catalog was regenerated: requests reference the catalog by its
+    // hash, so the scheduler loads the new version on the next request. Returns false and keeps the previous hash if
+    // the file can't be read.
+    refreshCatalog()
+    {
+        let content;
+        try {
+            content = fs.readFileSync(this.catalogPath);
+        }
+        catch (error) {
+            console.log("Failed to read the scheduler catalog : " + error.message);
+            return false;
+        }
+        const hash = crypto.createHash('sha256').update(content).digest('hex');
+        this.catalogRef = {'path': this.catalogPath, 'hash': hash};
+        return true;
+    }
+
+    // Calls callback with the response object: {id, schedule, optimal, deadline_reached} or {id, error}. If deadlineMs
+    // is given, the scheduler returns the best schedule it found within that many milliseconds.
+    schedule(requiredCourses, completedCourses, maxCoursesPerQuarter, callback, deadlineMs = null)
+    {
+        const id = this.nextId++;
+        if (this.process === null) {
+            callback({'id': id, 'error': 'Scheduler is not running'});
+            return;
+        }
+        this.pending.set(id, callback);
+        this.process.stdin.write(JSON.stringify({
+            'id': id,
+            'catalog_ref': this.catalogRef,
+            'required_courses': requiredCourses,
+            'completed_courses': completedCourses,
+            'max_courses_per_quarter': maxCoursesPerQuarter,
+            'deadline_ms': deadlineMs
+        }) + '\n');
+    }
+}
@@ -1,11 +1,11 @@
 import Express from "express";
 import {CourseCatalog} from './CourseCatalog.js';
 import {MongoDbClient} from './MongoDbClient.js';
+import {SchedulerWorker} from './SchedulerWorker.js';
 import fs from 'fs';
 
 import { createRequire } from 'module';
 const require = createRequire(import.meta.url);
-const {spawn} = require('child_process');
 
 const url = require('url');
 
@@ -46,33 +46,13 @@ class Routes {
 
         res.setHeader('Content-Type', 'application/json');
 
-        // Create new python process
-        const python = spawn('../venv/Scripts/python.exe', ['../scheduler/create_schedule.py']);
-
-        const all_courses = catalog.GetRawData();
-
-        const payload = {
-            'catalog': all_courses,
-            'required_courses': requiredCourses,
-            'completed_courses': [],
-            'max_courses_per_quarter': 4
-        }
-
-        // Write data to STDIN
-        python.stdin.write(JSON.stringify(payload));
-        python.stdin.end();
-
-        // Read data from STDOUT
-        let dataToSend;
-        python.stdout.on('data', (data) => {
-            dataToSend = data.toString();
-        });
-
-        // Send response when process has finished
-        python.on('close', (code) => {
-            console.log(`child process close all stdio with code ${code}`);
-            res.end(dataToSend);
-        });
+        schedulerWorker.schedule(requiredCourses, [], 4, (response) => {
+            if (response.error !== undefined) {
+                res.end(response.error);
+                return;
+            }
+            res.end(JSON.stringify(response.schedule));
+        }, SCHEDULE_DEADLINE_MS);
 
     }
 }
@@ -92,6 +72,13 @@ function resetDbFromFile(catalog, filePath = "./../catalog_parser/catalog.json")
 let mongoDbClient = new MongoDbClient();
 let catalog = new CourseCatalog(mongoDbClient);
 
+// Time the scheduler may spend looking for a shorter schedule before it answers
+const SCHEDULE_DEADLINE_MS = 2000;
+
+// Python scheduler process. It loads the catalog once and serves all schedule requests.
+let schedulerWorker = new SchedulerWorker();
+schedulerWorker.start();
+
 mongoDbClient.connect().then((resetDb = false) => {
     if (resetDb == true) {
         resetDbFromFile(catalog);
@@ -1,12 +1,20 @@
-import requests
+import collections
+import hashlib
+import itertools
+import os
 import re
 import logging
-from typing import List, Dict, Union
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, List, Dict, Iterator, Optional, Tuple, Union
 from pathlib import Path
 import json
+import sys
 
 from bs4 import BeautifulSoup
+from lxml import etree
 
+from downloader import Downloader
 from tree_parser import TreeParser
 
 # Set up logging
@@ -22,12 +30,38 @@ class CatalogParser:
     http://catalogue.uci.edu/about/about.pdf
     """
 
-    def __init__(self):
-        self._cache_dir = Path('..', 'cache', 'catalog')
+    def __init__(self, root_url: str = 'http://catalogue.uci.edu/allcourses/', cache_dir=Path('..', 'cache', 'catalog'),
+                 max_workers: int = 8, requests_per_second: Optional[float] = 10, retries: int = 3, backoff: float = 0.5,
+                 timeout: float = 30):
+        """
+        :param root_url: URL of the A-Z index of all departments.
+        :param cache_dir: Where downloaded catalog pages are kept.
+        :param max_workers: Most department pages downloaded at once.
+        :param requests_per_second: Most requests sent to the catalog site per second. None for no limit.
+        :param retries: Number of times a failed download is retried.
+        :param backoff: Seconds to wait before the first retry. The wait doubles with every retry.
+        :param timeout: Timeout of every request in seconds.
+        """
+        self._root_url = root_url
+        self._cache_dir = Path(cache_dir)
+        self._downloader_options = {
+            'max_workers': max_workers,
+            'requests_per_second': requests_per_second,
+            'retries': retries,
+            'backoff': backoff,
+            'timeout': timeout,
+        }
+
+        # Paragraph counts of the last get_courses
+        self.paragraph_classifier: Optional[ParagraphClassifier] = None
 
-    def get_courses(self) -> List[Dict[str, str]]:
+    def get_courses(self, refresh: bool = False, workers: Optional[int] = 1) -> List[Dict[str, str]]:
         """
         Get a list of all courses.
+        :param refresh: Check the catalog site for changes. Only the department pages that changed since they were
+        cached are downloaded again. Otherwise pages are only downloaded if they are not in the cache.
+        :param workers: Number of processes that parse the department pages. None for one per core. The courses are
+        the same for any number of workers.
         :return: A list of dictionaries containing course information. Each dictionary has the following format:
         {
             'department_code': str. Department code. (Ex. "COMPSCI")
@@ -59,148 +93,48 @@ class CatalogParser:
         }
         """
 
-        # Check if the catalog exists in the cache
-        catalog_cache_path = (self._cache_dir / 'department_catalogs').with_suffix('.json')
-        if catalog_cache_path.exists():
-            with open(catalog_cache_path, 'r') as file:
-                departments = json.load(file)
-        else:
-            departments = self._download_department_catalogs()
-            with open(catalog_cache_path, 'w') as file:
-                json.dump(departments, file)
-
-        # Gather catalog HTML pages
-        html_catalogs = [d['catalog_html'] for d in departments]
-
+        departments = self._sync_department_catalogs(refresh)
         department_map = {d['code']: d['name'] for d in departments}
-
-        # First pass: Parse basic course information
-        courses = []
-        for catalog_html in html_catalogs:
-
-            # Clean content
-            catalog_html = catalog_html.replace('&#160;', ' ')  # Non-breaking space
-
-            soup = BeautifulSoup(catalog_html, 'lxml')
-            courses_div = soup.find('div', attrs={'class': 'courses'})
-            course_blocks = courses_div.find_all('div', attrs={'class': 'courseblock'})
-
-            for block in course_blocks:
-                paragraphs = block.find_all('p')
-
-                # Parse department code, course number, and course title
-                title_paragraph_text = paragraphs[0].text
-                match = re.match(re.compile(r'^(.+?) (\S+?)\.  (.+?)\.  (.+)?$'), title_paragraph_text)
-                if not match:
-                    logging.warning(f'Failed to parse course title paragraph: {title_paragraph_text}')
-                    continue
-                department_code = match.group(1)
-                course_number = match.group(2)
-                course_title = match.group(3)
-                units_string = match.group(4)
-
-                course = {
-                    'department_code': department_code,
-                    'department_name': department_map[department_code],
-                    'number': course_number,
-                    'title': course_title
-                }
-
-                # Parse units
-                if units_string is not None:
-                    self._parse_units_string(course, units_string)
-                else:
-                    logging.warning(f'No units found in title paragraph: "{title_paragraph_text}"')
-
-                # Description
-                course['description'] = paragraphs[1].text
-
-                # Save remaining paragraphs (they will be parsed on the second pass)
-                p = []
-                for paragraph in paragraphs[2:]:
-                    lines = paragraph.text.splitlines()
-                    p.extend(lines)
-                course['_paragraphs'] = p
-
-                courses.append(course)
-
-        valid_courses = {d['code']: [c['number'] for c in courses if c['department_code'] == d['code']] for d in departments}
-
-        # Second pass: Parse extra paragraphs (prerequisites, restrictions, etc.)
-        for course in courses:
-            for paragraph in course['_paragraphs']:
-
-                # Prerequisites
-                match = re.match(r'^Prerequisite:\s*(.+)$', paragraph)
-                if match:
-                    self._parse_prerequisite_string(course, match.group(1), valid_courses=valid_courses)
-                    continue
-
-                # Corequisite
-                match = re.match(r'^Corequisite: (.+)$', paragraph)
-                if match:
-                    self._parse_corequisite_string(course, match.group(1), valid_courses=valid_courses)
-                    continue
-
-                # Prerequisite OR Corequisite
-                match = re.match(r'^Prerequisite or corequisite: (.+)$', paragraph)
-                if match:
-                    self._parse_prerequisite_or_corequisite_string(course, match.group(1), valid_courses=valid_courses)
-                    continue
-
-                # Restrictions
-                match = re.match(r'^Restriction:\s*(.+)$', paragraph)  # TODO: Parse?
-                if match:
-                    course['restriction'] = match.group(1)
-                    continue
-
-                # Same
-                match = re.match(r'^Same as (.+)\.$', paragraph)
-                if match:
-                    self._parse_same_as_string(course, match.group(1))  # TODO: Validate course codes?
-                    continue
-
-                # Concurrent
-                match = re.match(r'^Concurrent with (.+)\.$', paragraph)
-                if match:
-                    course['concurrent'] = match.group(1)  # TODO: Validate course codes and parse multiple
-                    continue
-
-                # Repeatability
-                match = re.match(r'^Repeatability:\s*(.+)$', paragraph)  # TODO: parse number?
-                if match:
-                    course['repeatability'] = match.group(1)
-                    continue
-
-                # Overlaps
-                match = re.match(r'^Overlaps with (.+)\.$', paragraph)  # TODO: validate course codes and parse
-                if match:
-                    course['overlap'] = match.group(1)
-                    continue
-
-                # Grading Option
-                match = re.match(r'^Grading Option: (.+)$', paragraph)  # TODO: Parse?
-                if match:
-                    course['grading_option'] = match.group(1)
-                    continue
-
-                # Design units
-                match = re.match(r'^\(Design units: ((?:\d+\.\d+|\.\d+|\d+)(?:\s*-\s*(?:\d+\.\d+|\.\d+|\d+))?)\)', paragraph)
-                if match:
-                    course['design_units'] = match.group(1)
-                    continue
-
-                # GE Category
-                match = re.match(r'^\((.+)\)\.?$', paragraph)
-                if match:
-                    try:
-                        self._parse_ge_category_string(course, match.group(1))
-                        continue
-                    except Exception as e:
-                        logger.warning(f'Failed to parse potential GE category for {course["department_code"]} {course["number"]}: {e}')
-
-                logger.warning(f'Unrecognized paragraph for course {course["department_code"]} {course["number"]}: "{paragraph}"')
-            del course['_paragraphs']
+        department_paths = [self._department_html_path(d['code']) for d in departments]
+        workers = workers or os.cpu_count()
+
+        start_time = time.perf_counter()
+        self.paragraph_classifier = ParagraphClassifier()
+        if workers == 1:
+            # First pass: Parse basic course information
+            courses = []
+            for path in department_paths:
+                courses.extend(self._parse_department_catalog(path, department_map))
+
+            valid_courses = get_valid_courses(departments, courses)
+
+            # Second pass: Parse extra paragraphs (prerequisites, restrictions, etc.)
+            for course in courses:
+                self._parse_course_paragraphs(course, valid_courses, self.paragraph_classifier)
+        else:
+            # Every department is parsed in its own task and the results are joined in index order, so the output is
+            # the same as the serial run
+            with ProcessPoolExecutor(workers) as executor:
+                courses = []
+                for department_courses in executor.map(self._parse_department_catalog, department_paths,
+                                                       itertools.repeat(department_map)):
+                    courses.extend(department_courses)
+
+            # valid_courses is sent to every worker once instead of with every chunk
+            valid_courses = get_valid_courses(departments, courses)
+            chunk_size = max(1, len(courses) // (workers * 4))
+            chunks = [courses[i:i + chunk_size] for i in range(0, len(courses), chunk_size)]
+            with ProcessPoolExecutor(workers, initializer=_set_worker_valid_courses,
+                                     initargs=(valid_courses,)) as executor:
+                courses = []
+                for chunk, hits, unrecognized in executor.map(_parse_course_chunk_in_worker, chunks):
+                    courses.extend(chunk)
+                    self.paragraph_classifier.merge(hits, unrecognized)
+
+        logger.info(f'Parsed {len(courses)} courses in {time.perf_counter() - start_time:.2f} s with {workers} '
+                    f'worker(s) on {os.cpu_count()} core(s)')
+        logger.info('Paragraphs: ' + ', '.join(f'{n} {name}' for name, n in self.paragraph_classifier.hits.items()) +
+                    f', {len(self.paragraph_classifier.unrecognized)} unrecognized')
 
         # names = [course['department_code'] + ' ' + course['number'] for course in courses]
         # print(names)
@@ -216,36 +150,245 @@ class CatalogParser:
 
         return courses
 
-    def _download_department_catalogs(self):
-        # Create directory
-        self._cache_dir.mkdir(parents=True, exist_ok=True)
+    @staticmethod
+    def _parse_department_catalog(path: Path, department_map: Dict[str, str]) -> List[dict]:
+        """
+        First pass over the cached page of one department.
+        :param path: Cached page of the department (see _department_html_path).
+        :param department_map: Department code -> department name.
+        :return: The courses of the department, with the paragraphs that still have to be parsed in '_paragraphs'.
+        """
+        courses = []
+        for paragraphs in CatalogParser._iter_course_blocks(path):
+
+            # Parse department code, course number, and course title
+            title_paragraph_text = paragraphs[0]
+            match = re.match(re.compile(r'^(.+?) (\S+?)\.  (.+?)\.  (.+)?$'), title_paragraph_text)
+            if not match:
+                logging.warning(f'Failed to parse course title paragraph: {title_paragraph_text}')
+                continue
+            department_code = match.group(1)
+            course_number = match.group(2)
+            course_title = match.group(3)
+            units_string = match.group(4)
+
+            course = {
+                'department_code': department_code,
+                'department_name': department_map[department_code],
+                'number': course_number,
+                'title': course_title
+            }
+
+            # Parse units
+            if units_string is not None:
+                CatalogParser._parse_units_string(course, units_string)
+            else:
+                logging.warning(f'No units found in title paragraph: "{title_paragraph_text}"')
+
+            # Description
+            course['description'] = paragraphs[1]
+
+            # Save remaining paragraphs (they will be parsed on the second pass)
+            p = []
+            for paragraph in paragraphs[2:]:
+                lines = paragraph.splitlines()
+                p.extend(lines)
+            course['_paragraphs'] = p
+
+            courses.append(course)
 
-        root_url = 'http://catalogue.uci.edu/allcourses/'
-        response = requests.get(root_url)
+        return courses
 
-        soup = BeautifulSoup(response.content, 'lxml')
-        a_to_z_index = soup.find('div', attrs={'id': 'atozindex'})
-        department_urls = a_to_z_index.find_all('a', href=re.compile(r'/allcourses/.+/'))
+    @staticmethod
+    def _iter_course_blocks(source: Union[Path, BinaryIO]) -> Iterator[List[str]]:
+        """
+        Stream the course blocks (div.courses > div.courseblock) out of a department page. Every block is dropped from
+        the tree as soon as it has been read.
+        :param source: Path or binary file of a UTF-8 page. It is read in chunks, never as a whole.
+        :return: The text of the paragraphs of every block, with non-breaking spaces replaced by spaces.
+        """
+        events = etree.iterparse(str(source) if isinstance(source, Path) else source, events=('end',), tag='div',
+                                 html=True, encoding='utf-8')
+        for _, element in events:
+            if 'courseblock' not in element.get('class', '').split() or not any(
+                    'courses' in x.get('class', '').split() for x in element.iterancestors('div')):
+                continue
 
-        departments = []
-        for url in department_urls:
-            match = re.match(re.compile(r'^(.+) \((.+)\)$'), url.text)
+            yield [''.join(p.itertext()).replace('\xa0', ' ') for p in element.iter('p')]
 
-            department_name = match.group(1)
-            department_code = match.group(2)
+            # Free the block and everything parsed before it
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
-            logger.info(f'Downloading catalog for department: {department_code}')
+    @staticmethod
+    def _parse_course_paragraphs(course: dict, valid_courses: Dict[str, List[str]],
+                                 classifier: 'ParagraphClassifier') -> dict:
+        """
+        Second pass over one course: parse its extra paragraphs (prerequisites, restrictions, etc.)
+        :param valid_courses: Department code -> numbers of all courses in the catalog.
+        :param classifier: Sorts the paragraphs into kinds and keeps count of them.
+        :return: The course.
+        """
+        for paragraph in course['_paragraphs']:
+            classifier.parse(course, paragraph, valid_courses)
+        del course['_paragraphs']
+        return course
 
-            response = requests.get(root_url + url['href'].split('/')[2])
-            catalog_html = response.text
+    def _department_path(self, department_code: str) -> Path:
+        # Department codes have spaces, '&' and '/' (Ex. "I&C SCI", "CRM/LAW")
+        return self._cache_dir / 'departments' / (re.sub(r'[^A-Za-z0-9]+', '_', department_code) + '.json')
 
-            logger.info(f'Downloaded {len(response.content)} bytes.')
+    def _department_html_path(self, department_code: str) -> Path:
+        # The page itself is kept as the bytes that were downloaded, so it can be parsed straight from the file
+        return self._department_path(department_code).with_suffix('.html')
 
-            departments.append({
-                'catalog_html': catalog_html,
-                'name': department_name,
-                'code': department_code
-            })
+    def _load_department_entry(self, department_code: str) -> Optional[dict]:
+        """
+        :return: The cache entry of a department: {'code', 'name', 'url', 'etag', 'last_modified', 'sha256'}, or None
+        if it is not in the cache. The page is in the file at _department_html_path.
+        """
+        path = self._department_path(department_code)
+        if not path.exists() or not self._department_html_path(department_code).exists():
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def _write_department_entry(self, entry: dict, content: bytes):
+        # The page is written first, so an entry is only in the cache once its page is
+        self._write_bytes(self._department_html_path(entry['code']), content)
+        self._write_json(self._department_path(entry['code']), {**entry, 'sha256': hashlib.sha256(content).hexdigest()})
+
+    @staticmethod
+    def _write_bytes(path: Path, content: bytes):
+        # Write to a temporary file first, so an interrupted run never leaves half a file behind
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix('.tmp')
+        with open(temporary_path, 'wb') as file:
+            file.write(content)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _write_json(path: Path, value):
+        CatalogParser._write_bytes(path, json.dumps(value).encode())
+
+    @staticmethod
+    def _conditional_headers(entry: Optional[dict]) -> Dict[str, str]:
+        headers = {}
+        if entry is not None and entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _migrate_legacy_cache(self):
+        # Older versions kept the pages inside the JSON entries of the departments
+        for path in sorted((self._cache_dir / 'departments').glob('*.json')):
+            with open(path, 'r') as file:
+                entry = json.load(file)
+            if 'catalog_html' in entry:
+                catalog_html = entry.pop('catalog_html')
+                self._write_department_entry(entry, catalog_html.encode())
+
+        # Even older versions kept every department in a single file
+        legacy_path = self._cache_dir / 'department_catalogs.json'
+        if not legacy_path.exists() or (self._cache_dir / 'index.json').exists():
+            return
+        logger.info(f'Splitting {legacy_path} into one file per department')
+        with open(legacy_path, 'r') as file:
+            departments = json.load(file)
+        for d in departments:
+            self._write_department_entry({
+                'code': d['code'],
+                'name': d['name'],
+                'url': None,
+                'etag': None,
+                'last_modified': None,
+            }, d['catalog_html'].encode())
+        self._write_json(self._cache_dir / 'index.json', {
+            'etag': None,
+            'last_modified': None,
+            'departments': [{'code': d['code'], 'name': d['name'], 'url': None} for d in departments],
+        })
+        legacy_path.unlink()
+
+    def _sync_department_catalogs(self, refresh: bool = False) -> List[dict]:
+        """
+        Make sure the page of every department is in the cache (one file per department, see _load_department_entry).
+        With refresh, the index and every page are requested again with the ETag and Last-Modified of the cached copy,
+        so the site only sends the pages that changed.
+        :return: The departments in index order: {'code', 'name', 'url'}.
+        """
+        self._migrate_legacy_cache()
+        index_path = self._cache_dir / 'index.json'
+        index = None
+        if index_path.exists():
+            with open(index_path, 'r') as file:
+                index = json.load(file)
+
+        if index is not None and not refresh and \
+                all(self._load_department_entry(d['code']) is not None for d in index['departments']):
+            return index['departments']
+
+        with Downloader(**self._downloader_options) as downloader:
+            response = downloader.get(self._root_url, headers=self._conditional_headers(index) if refresh else None)
+            if response.status_code == 304:
+                departments = index['departments']
+            else:
+                response.raise_for_status()
+                soup = BeautifulSoup(response.content, 'lxml')
+                a_to_z_index = soup.find('div', attrs={'id': 'atozindex'})
+                departments = []
+                for url in a_to_z_index.find_all('a', href=re.compile(r'/allcourses/.+/')):
+                    match = re.match(re.compile(r'^(.+) \((.+)\)$'), url.text)
+                    departments.append({
+                        'code': match.group(2),
+                        'name': match.group(1),
+                        'url': self._root_url + url['href'].split('/')[2]
+                    })
+                index = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'departments': departments,
+                }
+
+            def sync(department):
+                entry = self._load_department_entry(department['code'])
+                if entry is not None and not refresh:
+                    return 'cached'
+
+                logger.info(f'Downloading catalog for department: {department["code"]}')
+                response = downloader.get(department['url'], headers=self._conditional_headers(entry))
+                if response.status_code == 304:
+                    return 'not modified'
+                response.raise_for_status()
+                content = response.content
+                if (response.encoding or 'utf-8').lower() not in ('utf-8', 'utf8'):
+                    content = response.text.encode()  # Cached pages are parsed as UTF-8
+                logger.info(f'Downloaded {len(response.content)} bytes.')
+
+                content_hash = hashlib.sha256(content).hexdigest()
+                status = 'changed' if entry is None or entry['sha256'] != content_hash else 'unchanged'
+                self._write_department_entry({
+                    **department,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }, content)
+                return status
+
+            # Departments stay in index order however the downloads finish
+            statuses = downloader.map(sync, departments)
+
+        self._write_json(index_path, index)
+        counts = collections.Counter(statuses)
+        logger.info('Department catalogs: ' + ', '.join(f'{n} {status}' for status, n in sorted(counts.items())))
+
+        # Departments that are no longer in the index
+        paths = set(self._department_path(d['code']) for d in departments)
+        for path in (self._cache_dir / 'departments').glob('*.json'):
+            if path not in paths:
+                path.unlink()
+                path.with_suffix('.html').unlink(missing_ok=True)
 
         return departments
 
@@ -380,6 +523,120 @@ class CatalogParser:
             course['prerequisite_or_corequisite_notes'] = notes
 
 
+def get_valid_courses(departments: List[dict], courses: List[dict]) -> Dict[str, List[str]]:
+    """
+    :return: Department code -> numbers of the courses of that department, in catalog order.
+    """
+    valid_courses = {d['code']: [] for d in departments}
+    for course in courses:
+        if course['department_code'] in valid_courses:
+            valid_courses[course['department_code']].append(course['number'])
+    return valid_courses
+
+
+# valid_courses of the worker processes of the second pass
+_worker_valid_courses = None
+
+
+def _set_worker_valid_courses(valid_courses: Dict[str, List[str]]):
+    global _worker_valid_courses
+    _worker_valid_courses = valid_courses
+
+
+def _parse_course_chunk_in_worker(courses: List[dict]) -> Tuple[List[dict], Dict[str, int], List[Tuple[str, str]]]:
+    classifier = ParagraphClassifier()
+    for course in courses:
+        CatalogParser._parse_course_paragraphs(course, _worker_valid_courses, classifier)
+    return courses, classifier.hits, classifier.unrecognized
+
+
+def _set_field(field: str) -> Callable:
+    def handler(course, value, valid_courses):
+        course[field] = value
+    return handler
+
+
+# Kinds of extra paragraphs of a course: (name, pattern, handler(course, value, valid_courses)). Every pattern has
+# exactly one group, the value passed to the handler. The first pattern that matches a paragraph wins.
+PARAGRAPH_RULES = [
+    ('prerequisite', r'Prerequisite:\s*(.+)$',
+     lambda course, value, valid_courses: CatalogParser._parse_prerequisite_string(course, value, valid_courses)),
+    ('corequisite', r'Corequisite: (.+)$',
+     lambda course, value, valid_courses: CatalogParser._parse_corequisite_string(course, value, valid_courses)),
+    ('prerequisite_or_corequisite', r'Prerequisite or corequisite: (.+)$',
+     lambda course, value, valid_courses: CatalogParser._parse_prerequisite_or_corequisite_string(
+         course, value, valid_courses)),
+    ('restriction', r'Restriction:\s*(.+)$', _set_field('restriction')),  # TODO: Parse?
+    ('same_as', r'Same as (.+)\.$',
+     lambda course, value, valid_courses: CatalogParser._parse_same_as_string(course, value)),  # TODO: Validate?
+    ('concurrent', r'Concurrent with (.+)\.$', _set_field('concurrent')),  # TODO: Validate and parse multiple
+    ('repeatability', r'Repeatability:\s*(.+)$', _set_field('repeatability')),  # TODO: parse number?
+    ('overlap', r'Overlaps with (.+)\.$', _set_field('overlap')),  # TODO: validate course codes and parse
+    ('grading_option', r'Grading Option: (.+)$', _set_field('grading_option')),  # TODO: Parse?
+    ('design_units', r'\(Design units: ((?:\d+\.\d+|\.\d+|\d+)(?:\s*-\s*(?:\d+\.\d+|\.\d+|\d+))?)\)',
+     _set_field('design_units')),
+    ('ge_category', r'\((.+)\)\.?$',
+     lambda course, value, valid_courses: CatalogParser._parse_ge_category_string(course, value)),
+]
+
+
+class ParagraphClassifier:
+    """
+    Parses the extra paragraphs of courses with a table of rules (see PARAGRAPH_RULES). All patterns are joined into one
+    regex, so every paragraph takes a single match.
+    """
+
+    def __init__(self, rules: Optional[List[Tuple[str, str, Callable]]] = None):
+        rules = PARAGRAPH_RULES if rules is None else rules
+        self._regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern, _ in rules))
+        self._handlers = {name: handler for name, _, handler in rules}
+
+        # The value of a rule is the group right after the group of the rule
+        self._value_groups = {}
+        for name, pattern, _ in rules:
+            if re.compile(pattern).groups != 1:
+                raise ValueError(f'Pattern of paragraph rule "{name}" must have exactly one group: {pattern}')
+            self._value_groups[name] = self._regex.groupindex[name] + 1
+
+        self.hits = {name: 0 for name, _, _ in rules}  # Rule name -> number of paragraphs parsed with it
+        self.unrecognized = []  # (course ID, paragraph)
+
+    def classify(self, paragraph: str) -> Optional[Tuple[str, str]]:
+        """
+        :return: The name of the rule that matches the paragraph and the value, or None if no rule matches.
+        """
+        match = self._regex.match(paragraph)
+        if not match:
+            return None
+        return match.lastgroup, match.group(self._value_groups[match.lastgroup])
+
+    def parse(self, course: dict, paragraph: str, valid_courses: Dict[str, List[str]]):
+        """
+        Add the information in a paragraph to a course.
+        """
+        course_id = f'{course["department_code"]} {course["number"]}'
+        rule = self.classify(paragraph)
+        if rule is not None:
+            name, value = rule
+            try:
+                self._handlers[name](course, value, valid_courses)
+                self.hits[name] += 1
+                return
+            except Exception as e:
+                logger.warning(f'Failed to parse potential {name} paragraph for {course_id}: {e}')
+
+        logger.warning(f'Unrecognized paragraph for course {course_id}: "{paragraph}"')
+        self.unrecognized.append((course_id, paragraph))
+
+    def merge(self, hits: Dict[str, int], unrecognized: List[Tuple[str, str]]):
+        """
+        Add the counts of another classifier (Ex. from a worker process).
+        """
+        for name, n in hits.items():
+            self.hits[name] += n
+        self.unrecognized.extend(unrecognized)
+
+
 def parse_prerequisite_courses(string: str, valid_courses=None):
     """
     Parse a list of tokens to a tree of prerequisites.
@@ -529,12 +786,23 @@ def split_sentences(string):
 
 if __name__ == '__main__':
     parser = CatalogParser()
-    courses = parser.get_courses()
+    courses = parser.get_courses(refresh='--refresh' in sys.argv[1:], workers=None)
 
     # Save to JSON
     with open('catalog.json', 'w') as file:
         json.dump(courses, file, indent=4)
 
+    # Save the compact catalog that scheduler workers load
+    sys.path.append(str(Path(__file__).resolve().parent.parent / 'scheduler'))
+    from binary_catalog import write_binary_catalog
+    write_binary_catalog(courses, 'catalog.bin')
+
+    # Save prerequisite closures next to the catalog. Workers only use them with the catalog files they were built from.
+    from closure_index import ClosureIndex, get_file_hash
+    closure_index = ClosureIndex.build(courses)
+    closure_index.catalog_hashes = [get_file_hash('catalog.json'), get_file_hash('catalog.bin')]
+    closure_index.save('catalog_closure.json')
+
     for c in courses:
         if 'prerequisite_or_corequisite' in c:
             print(c['prerequisite_or_corequisite'])
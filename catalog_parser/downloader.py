@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Responses that are worth retrying. Anything else is returned as is.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Spaces out the requests to each host so that at most requests_per_second of them start every second.
+    """
+
+    def __init__(self, requests_per_second: Optional[float]):
+        self._interval = 0 if not requests_per_second else 1 / requests_per_second
+        self._next_time = {}  # host -> earliest time of its next request
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        if self._interval == 0:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time.get(host, now))
+            self._next_time[host] = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Downloader:
+    """
+    Downloads pages over one pooled requests.Session, a few at a time, with per-host rate limiting and retries.
+    """
+
+    def __init__(self, max_workers: int = 8, requests_per_second: Optional[float] = 10, retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 30):
+        """
+        :param max_workers: Most requests in flight at once.
+        :param requests_per_second: Most requests started per second and host. None for no limit.
+        :param retries: Number of times a request is retried after a connection error, a timeout or a 429/5xx response.
+        :param backoff: Seconds to wait before the first retry. The wait doubles with every retry.
+        :param timeout: Connect and read timeout of every request in seconds.
+        """
+        self._max_workers = max_workers
+        self._rate_limiter = RateLimiter(requests_per_second)
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+
+        # Keep a connection open for every worker
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        GET a page, retrying with exponential backoff.
+        :return: The response. Responses with an error status are returned once the retries run out.
+        :raises requests.RequestException: If the last try fails to connect or times out.
+        """
+        for attempt in range(self._retries + 1):
+            self._rate_limiter.wait(url)
+            try:
+                response = self._session.get(url, headers=headers, timeout=self._timeout)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self._retries:
+                    return response
+                logger.warning(f'Got status {response.status_code} for {url}, retrying')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self._retries:
+                    raise
+                logger.warning(f'Failed to download {url} ({e}), retrying')
+            time.sleep(self._backoff * 2 ** attempt)
+
+    def map(self, function: Callable, items: List) -> List:
+        """
+        Call a function (that downloads something with get) on every item with up to max_workers threads.
+        :return: The results in the order of the items.
+        """
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            return list(executor.map(function, items))
@@ -0,0 +1,264 @@
+import hashlib
+import http.server
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+from catalog_parser import CatalogParser, ParagraphClassifier, PARAGRAPH_RULES
+from downloader import Downloader, RateLimiter
+
+DEPARTMENTS = [
+    ('compsci', 'Computer Science', 'COMPSCI'),
+    ('i_c_sci', 'Information and Computer Science', 'I&C SCI'),
+    ('math', 'Mathematics', 'MATH'),
+]
+
+INDEX_HTML = '<html><body><div id="atozindex"><ul>' + ''.join(
+    f'<li><a href="/allcourses/{path}/">{name} ({code})</a></li>' for path, name, code in DEPARTMENTS
+) + '</ul></div></body></html>'
+
+
+def course_block(code, number, title, units, description, *paragraphs):
+    return (
+        '<div class="courseblock">'
+        f'<p class="courseblocktitle"><strong>{code}&#160;{number}.&#160; {title}.&#160; {units}.</strong></p>'
+        f'<p class="courseblockdesc">{description}</p>'
+        + ''.join(f'<p>{x}</p>' for x in paragraphs)
+        + '</div>'
+    )
+
+
+DEPARTMENT_HTML = {
+    'compsci': [
+        course_block('COMPSCI', '111', 'Digital Image Processing', '4 Units', 'Images.',
+                     'Prerequisite: (I&amp;C SCI 46 or MATH 2A) and I&amp;C SCI 6D.',
+                     'Restriction: Computer Science majors only.'),
+        course_block('COMPSCI', '199', 'Individual Study', '2-4 Units', 'Study.', 'Repeatability: May be repeated for credit.'),
+    ],
+    'i_c_sci': [
+        course_block('I&amp;C SCI', '6D', 'Discrete Mathematics', '4 Units', 'Logic.', 'Corequisite: MATH 2A.',
+                     '(II and Vb).'),
+        course_block('I&amp;C SCI', '46', 'Data Structures', '4 Units', 'Lists.', 'Prerequisite: I&amp;C SCI 45C.',
+                     'Same as CSE 46.', 'Grading Option: Letter Grade with P/NP.'),
+    ],
+    'math': [
+        course_block('MATH', '2A', 'Calculus', '4 Units', 'Limits.', 'Overlaps with MATH 5A.'),
+    ],
+}
+
+
+def department_page(path):
+    blocks = ''.join(DEPARTMENT_HTML[path])
+    return f'<html><body><div id="textcontainer"><div class="courses">{blocks}</div></div></body></html>'
+
+
+class StubCatalogServer:
+    """
+    Serves an A-Z index and department pages on localhost, like catalogue.uci.edu.
+    """
+
+    def __init__(self):
+        self.pages = {'/allcourses/': INDEX_HTML}
+        for path, _, _ in DEPARTMENTS:
+            self.pages[f'/allcourses/{path}'] = department_page(path)
+        self.failures = {}  # path -> number of 503 responses to send before the page
+        self.delays = {}  # path -> seconds to wait before responding
+        self.requests = []  # Paths of all requests
+        self.sent = []  # Paths of all requests answered with a page, not 304 Not Modified
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                time.sleep(server.delays.get(self.path, 0))
+                if server.failures.get(self.path, 0) > 0:
+                    server.failures[self.path] -= 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if self.path not in server.pages:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = server.pages[self.path].encode()
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                server.sent.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.root_url = f'http://127.0.0.1:{self._server.server_address[1]}/allcourses/'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestCatalogParser(unittest.TestCase):
+
+    def test_get_courses(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            parser = CatalogParser(server.root_url, directory, requests_per_second=None)
+            courses = parser.get_courses()
+
+            self.assertEqual(['COMPSCI 111', 'COMPSCI 199', 'I&C SCI 6D', 'I&C SCI 46', 'MATH 2A'],
+                             [f'{c["department_code"]} {c["number"]}' for c in courses])
+            self.assertEqual({
+                'department_code': 'COMPSCI',
+                'department_name': 'Computer Science',
+                'number': '111',
+                'title': 'Digital Image Processing',
+                'units': '4',
+                'description': 'Images.',
+                'prerequisite_courses': ['and', [['or', ['I&C SCI 46', 'MATH 2A']], 'I&C SCI 6D']],
+                'restriction': 'Computer Science majors only.',
+            }, courses[0])
+            self.assertEqual('2-4', courses[1]['units'])
+            self.assertEqual('MATH 2A', courses[2]['corequisite_courses'])
+            self.assertEqual('II and Vb', courses[2]['ge_category'])
+            self.assertEqual(['CSE 46'], courses[3]['equivalent'])
+            self.assertEqual('MATH 5A', courses[4]['overlap'])
+
+            # The second run only reads the cache
+            request_count = len(server.requests)
+            self.assertEqual(courses, CatalogParser(server.root_url, directory).get_courses())
+            self.assertEqual(request_count, len(server.requests))
+
+    def test_paragraph_classifier(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            server.pages['/allcourses/math'] = server.pages['/allcourses/math'].replace(
+                '<p>Overlaps with MATH 5A.</p>', '<p>Overlaps with MATH 5A.</p><p>Formerly MATH 1A.</p>')
+            parser = CatalogParser(server.root_url, directory, requests_per_second=None)
+            parser.get_courses()
+            self.assertEqual(2, parser.paragraph_classifier.hits['prerequisite'])
+            self.assertEqual(1, parser.paragraph_classifier.hits['ge_category'])
+            self.assertEqual(0, parser.paragraph_classifier.hits['design_units'])
+            self.assertEqual([('MATH 2A', 'Formerly MATH 1A.')], parser.paragraph_classifier.unrecognized)
+
+            # The counts of the workers are added up
+            parser.get_courses(workers=2)
+            self.assertEqual(2, parser.paragraph_classifier.hits['prerequisite'])
+            self.assertEqual([('MATH 2A', 'Formerly MATH 1A.')], parser.paragraph_classifier.unrecognized)
+
+        classifier = ParagraphClassifier()
+        self.assertEqual(('prerequisite_or_corequisite', 'MATH 2B.'),
+                         classifier.classify('Prerequisite or corequisite: MATH 2B.'))
+        self.assertEqual(('design_units', '2-4'), classifier.classify('(Design units: 2-4)'))
+        self.assertEqual(('ge_category', 'II and Vb'), classifier.classify('(II and Vb).'))
+        self.assertIsNone(classifier.classify('Same as CSE 46'))
+
+        # New kinds of paragraphs are new rules
+        classifier = ParagraphClassifier(PARAGRAPH_RULES + [
+            ('formerly', r'Formerly (.+)\.$', lambda course, value, valid_courses: course.update(formerly=value))
+        ])
+        course = {'department_code': 'MATH', 'number': '2A'}
+        classifier.parse(course, 'Formerly MATH 1A.', {})
+        self.assertEqual('MATH 1A', course['formerly'])
+        self.assertEqual(1, classifier.hits['formerly'])
+        with self.assertRaises(ValueError):
+            ParagraphClassifier([('units', r'(\d+) (units?)', None)])
+
+    def test_parallel_parsing(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            parser = CatalogParser(server.root_url, directory, requests_per_second=None)
+            courses = parser.get_courses()
+            self.assertEqual(json.dumps(courses), json.dumps(parser.get_courses(workers=2)))
+
+    def test_download_order(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            # The first department finishes last and the second one fails twice, but the order is kept
+            server.delays['/allcourses/compsci'] = 0.2
+            server.failures['/allcourses/i_c_sci'] = 2
+            parser = CatalogParser(server.root_url, directory, max_workers=3, requests_per_second=None, backoff=0.01)
+            departments = parser._sync_department_catalogs()
+
+            self.assertEqual(['COMPSCI', 'I&C SCI', 'MATH'], [x['code'] for x in departments])
+            self.assertEqual(3, server.requests.count('/allcourses/i_c_sci'))
+            self.assertIsNotNone(parser._load_department_entry('I&C SCI'))
+            self.assertIn(b'Data Structures', parser._department_html_path('I&C SCI').read_bytes())
+
+    def test_cache_migration(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            parser = CatalogParser(server.root_url, directory, requests_per_second=None)
+            courses = parser.get_courses()
+
+            # Entries of older versions have the page inside the JSON
+            path = parser._department_path('MATH')
+            html_path = parser._department_html_path('MATH')
+            with open(path) as file:
+                entry = json.load(file)
+            entry['catalog_html'] = html_path.read_bytes().decode()
+            parser._write_json(path, entry)
+            html_path.unlink()
+
+            server.requests.clear()
+            self.assertEqual(json.dumps(courses), json.dumps(parser.get_courses()))
+            self.assertEqual([], server.requests)
+            self.assertNotIn('catalog_html', parser._load_department_entry('MATH'))
+            self.assertTrue(html_path.exists())
+
+    def test_refresh(self):
+        with StubCatalogServer() as server, tempfile.TemporaryDirectory() as directory:
+            parser = CatalogParser(server.root_url, directory, requests_per_second=None)
+            parser.get_courses()
+            self.assertEqual(4, len(server.sent))
+
+            # Only the department that changed is sent again
+            server.sent.clear()
+            math_blocks = DEPARTMENT_HTML['math'] + [
+                course_block('MATH', '2B', 'Calculus', '4 Units', 'Integrals.', 'Prerequisite: MATH 2A.')
+            ]
+            server.pages['/allcourses/math'] = department_page('math').replace(
+                ''.join(DEPARTMENT_HTML['math']), ''.join(math_blocks))
+            courses = parser.get_courses(refresh=True)
+            self.assertEqual(['/allcourses/math'], server.sent)
+            self.assertEqual('MATH 2A', courses[-1]['prerequisite_courses'])
+
+            # A department that is no longer in the index is removed from the cache
+            server.pages['/allcourses/'] = INDEX_HTML.replace(
+                '<li><a href="/allcourses/compsci/">Computer Science (COMPSCI)</a></li>', '')
+            courses = parser.get_courses(refresh=True)
+            self.assertNotIn('COMPSCI', [c['department_code'] for c in courses])
+            self.assertIsNone(parser._load_department_entry('COMPSCI'))
+
+    def test_downloader(self):
+        with StubCatalogServer() as server:
+            url = server.root_url + 'math'
+            server.failures['/allcourses/math'] = 5
+            with Downloader(retries=2, backoff=0.01, requests_per_second=None) as downloader:
+                self.assertEqual(503, downloader.get(url).status_code)
+                self.assertEqual(200, downloader.get(url).status_code)
+                self.assertEqual(404, downloader.get(server.root_url + 'missing').status_code)
+                self.assertEqual([1, 4, 9], downloader.map(lambda x: x * x, [1, 2, 3]))
+
+        # Five requests to the same host at 20 per second take at least 0.2 seconds
+        rate_limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait('http://example.com/a')
+        rate_limiter.wait('http://example.org/a')
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,467 @@
+"""
+Scheduler benchmarks. Run from the scheduler directory:
+
+    python benchmark.py
+
+The benchmark suite times create_graph, create_schedule and create_schedule_from_dag on required course sets of
+growing size drawn from real departments and on sets of the courses with the most 'or' combinations. Save a baseline
+on a quiet machine and check later runs against it on the same machine:
+
+    python benchmark.py --suite --save-baseline baseline.json
+    python benchmark.py --suite --check baseline.json
+
+The baseline that CI checks against is committed as benchmark_baseline.json, which --check uses when it is given no
+path. Its thresholds only hold on the machine they were measured on, so regenerate it on the CI runner (with
+--save-baseline benchmark_baseline.json) and commit it whenever the runner changes:
+
+    python benchmark.py --suite --check
+
+Add --synthetic COURSES to run the suite on a synthetic catalog (see synthetic_catalog.py) instead.
+
+--check exits with status 1 if a latency percentile or the peak memory of any case goes above the thresholds stored in
+the baseline, or if a case of the suite is missing from the baseline or the other way around. After adding or renaming
+cases, add --update-baseline to write the new cases to the baseline instead of failing on them:
+
+    python benchmark.py --suite --check --update-baseline
+
+Check that create_schedule.py still starts quickly, with the default budget or another one in milliseconds:
+
+    python benchmark.py --startup-budget-ms
+    python benchmark.py --startup-budget-ms 50
+
+This imports create_schedule in fresh interpreters with -X importtime and exits with status 1 if the import takes
+longer than the budget or loads any of STARTUP_EXCLUDED_MODULES.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import scheduler
+
+CATALOG_PATH = '../catalog_parser/catalog.json'
+
+# Inputs used by test_scheduler_complex
+COMPLEX_INPUTS = [
+    ['COMPSCI 111', 'COMPSCI 112'],
+    ['COMPSCI 111', 'COMPSCI 112', 'I&C SCI 33'],
+]
+
+
+class LinearCourseRepo:
+    """
+    Course repository that looks up courses with a linear scan over the catalog list. This is how create_graph looked up
+    courses before CourseIndex existed.
+    """
+
+    def __init__(self, course_repo):
+        self._courses = course_repo
+
+    def get(self, course_id):
+        return scheduler.get_course(course_id, self._courses)
+
+
+def load_course_repo(path=CATALOG_PATH):
+    with open(path) as file:
+        return json.load(file)
+
+
+def time_it(function, repeat=5):
+    """
+    Call a function several times.
+    :return: The best wall time in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_create_graph(course_repo):
+    linear_repo = LinearCourseRepo(course_repo)
+
+    start = time.perf_counter()
+    course_index = scheduler.CourseIndex(course_repo)
+    index_time = time.perf_counter() - start
+    print(f'Build CourseIndex ({len(course_index)} courses): {index_time * 1000:.2f} ms')
+
+    for required in COMPLEX_INPUTS:
+        before = time_it(lambda: scheduler.create_graph(linear_repo, required))
+        after = time_it(lambda: scheduler.create_graph(course_index, required))
+        print(f'create_graph {required}: before {before * 1000:.2f} ms, after {after * 1000:.2f} ms ({before / after:.0f}x)')
+
+
+def measure_memory(function):
+    """
+    Call a function and measure how much memory its return value holds on to.
+    :return: (return value, bytes)
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def benchmark_graph_engine(course_repo):
+    """
+    Compare CompactGraph with networkx.DiGraph on a graph of the full catalog.
+    """
+    import networkx as nx
+
+    course_index = scheduler.CourseIndex(course_repo)
+    all_courses = [f'{c["department_code"]} {c["number"]}' for c in course_repo]
+    graph = scheduler.create_graph(course_index, all_courses)
+    edges = list(graph.typed_edges())
+    nodes = graph.nodes()
+
+    def build_compact():
+        g = scheduler.CompactGraph()
+        for node in nodes:
+            g.add_node(node)
+        for src, dst, t in edges:
+            g.add_edge(src, dst, t=t)
+        next(g.successors(nodes[0]), None)  # Build the index
+        return g
+
+    def build_networkx():
+        g = nx.DiGraph()
+        g.add_nodes_from(nodes)
+        for src, dst, t in edges:
+            g.add_edge(src, dst, t=t)
+        return g
+
+    compact_graph, compact_memory = measure_memory(build_compact)
+    nx_graph, nx_memory = measure_memory(build_networkx)
+    print(f'Full catalog graph: {len(nodes)} nodes, {len(edges)} edges')
+    print(f'Memory: CompactGraph {compact_memory / 1024:.0f} KiB, networkx {nx_memory / 1024:.0f} KiB')
+    print(f'Build: CompactGraph {time_it(build_compact) * 1000:.1f} ms, networkx {time_it(build_networkx) * 1000:.1f} ms')
+    print(f'create_graph (full catalog): {time_it(lambda: scheduler.create_graph(course_index, all_courses)) * 1000:.1f} ms')
+
+    def iterate_compact():
+        for node in nodes:
+            for _ in compact_graph.successors(node, t='a'):
+                pass
+
+    def iterate_networkx():
+        for node in nodes:
+            for _, _, data in nx_graph.edges(node, data=True):
+                if data.get('t') == 'a':
+                    pass
+
+    print(f'Prerequisite successors of every node: CompactGraph {time_it(iterate_compact) * 1000:.1f} ms, '
+          f'networkx {time_it(iterate_networkx) * 1000:.1f} ms')
+
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+SUITE_DEPARTMENTS = ['COMPSCI', 'I&C SCI', 'MATH']
+SUITE_SIZES = [1, 2, 4, 8, 16]
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(values, p):
+    """
+    :return: The p-th percentile of a list of values (nearest rank).
+    """
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def measure(function, repeat):
+    """
+    Call a function several times and once more with tracemalloc running.
+    :return: A dictionary of latency percentiles in milliseconds and the peak memory in KiB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {f'p{p}_ms': percentile(times, p) for p in PERCENTILES}
+    result['peak_kib'] = peak / 1024
+    return result
+
+
+def _can_schedule(course_index, required, time_limit=1.0):
+    """
+    :return: True if the required courses can be scheduled and the solver finds the best course set within the time
+    limit (in seconds).
+    """
+    try:
+        graph = scheduler.create_graph(course_index, required)
+        solver = scheduler.AndOrSolver(graph)
+        course_set = solver.solve(required, time.perf_counter() + time_limit)
+        if solver.timed_out:
+            return False
+        scheduler.schedule_course_set(graph, course_set)
+        return True
+    except (ValueError, KeyError, RecursionError):
+        return False  # Cycles and corequisite groups that don't fit in a quarter
+
+
+def get_suite_cases(course_index, departments=SUITE_DEPARTMENTS, sizes=SUITE_SIZES, seed=0):
+    """
+    Pick the required course sets of the suite. Sets are drawn at random with a fixed seed, so the cases only change
+    when the catalog does. Sets that can't be scheduled, or take the solver more than a second, are skipped.
+    :return: A dictionary mapping case names ('COMPSCI/8', 'or-heavy/4', ...) to lists of course IDs.
+    """
+    rng = random.Random(seed)
+    course_ids = sorted(f'{c["department_code"]} {c["number"]}' for c in course_index)
+    cases = {}
+
+    for department in departments:
+        # Courses without prerequisites are not interesting to schedule
+        pool = [x for x in course_ids if x.rsplit(' ', 1)[0] == department and 'prerequisite_courses' in course_index.get(x)]
+        for size in sizes:
+            for _ in range(20):
+                required = rng.sample(pool, min(size, len(pool)))
+                if _can_schedule(course_index, required):
+                    cases[f'{department}/{size}'] = required
+                    break
+
+    # The courses with the most ways to satisfy their requirements
+    graph = scheduler.create_graph(course_index, course_ids)
+    combinations = scheduler.count_combinations(graph, course_ids)
+    or_heavy = []
+    for course_id in sorted(course_ids, key=lambda x: (-combinations[x], x)):
+        if len(or_heavy) == max(sizes):
+            break
+        if _can_schedule(course_index, [course_id]):
+            or_heavy.append(course_id)
+    for size in sizes:
+        if _can_schedule(course_index, or_heavy[:size]):
+            cases[f'or-heavy/{size}'] = or_heavy[:size]
+
+    return cases
+
+
+def run_suite(course_index, cases, repeat=20):
+    """
+    :return: A dictionary mapping case names to dictionaries mapping function names to measurements (see measure).
+    """
+    results = {}
+    for name, required in cases.items():
+        graph = scheduler.create_graph(course_index, required)
+        dag = scheduler.get_course_set_dag(graph, scheduler.AndOrSolver(graph).solve(required))
+        results[name] = {
+            'create_graph': measure(lambda: scheduler.create_graph(course_index, required), repeat),
+            'create_schedule': measure(lambda: scheduler.create_schedule(course_index, required), repeat),
+            'create_schedule_from_dag': measure(lambda: scheduler.create_schedule_from_dag(dag), repeat),
+        }
+
+        print(f'{name} ({graph.number_of_nodes()} nodes):')
+        for function, x in results[name].items():
+            print(f'    {function}: ' + ', '.join(f'p{p} {x[f"p{p}_ms"]:.2f} ms' for p in PERCENTILES) + f', peak {x["peak_kib"]:.0f} KiB')
+    return results
+
+
+def make_baseline(cases, results, tolerance=0.5, slack_ms=1.0):
+    """
+    :param tolerance: Allowed relative increase over the measured values.
+    :param slack_ms: Allowed absolute increase of latencies, so that sub-millisecond timings don't fail on noise.
+    :return: A baseline that stores the cases, the results and the thresholds derived from them.
+    """
+    thresholds = {}
+    for name, functions in results.items():
+        thresholds[name] = {}
+        for function, x in functions.items():
+            thresholds[name][function] = {
+                key: value * (1 + tolerance) + (slack_ms if key.endswith('_ms') else 0) for key, value in x.items()
+            }
+    return {'version': BASELINE_VERSION, 'cases': cases, 'results': results, 'thresholds': thresholds}
+
+
+def get_missing(baseline, results):
+    """
+    :return: A list of messages, one for every measurement that has no threshold in the baseline and every threshold
+             that has no measurement in the results, so that added or renamed cases don't go unchecked.
+    """
+    missing = []
+    thresholds = baseline['thresholds']
+    for name, functions in results.items():
+        for function, x in functions.items():
+            for key in x:
+                if key not in thresholds.get(name, {}).get(function, {}):
+                    missing.append(f'{name} {function} {key}: missing from the baseline')
+    for name, functions in thresholds.items():
+        for function, limits in functions.items():
+            for key in limits:
+                if key not in results.get(name, {}).get(function, {}):
+                    missing.append(f'{name} {function} {key}: missing from the results')
+    return missing
+
+
+def check_baseline(baseline, results, allow_missing=False):
+    """
+    :param allow_missing: Don't fail on measurements or thresholds that are missing (see get_missing).
+    :return: A list of messages, one for every measurement that is above its threshold or missing.
+    """
+    failures = []
+    for name, functions in baseline['thresholds'].items():
+        for function, limits in functions.items():
+            for key, limit in limits.items():
+                value = results.get(name, {}).get(function, {}).get(key)
+                if value is not None and value > limit:
+                    failures.append(f'{name} {function} {key}: {value:.2f} > {limit:.2f}')
+    if not allow_missing:
+        failures.extend(get_missing(baseline, results))
+    return failures
+
+
+def update_baseline(baseline, cases, results, tolerance=0.5):
+    """
+    Replace the cases, results and thresholds of a baseline with the ones of this run, keeping the thresholds of the
+    measurements that the baseline already had.
+    """
+    updated = make_baseline(cases, results, tolerance)
+    for name, functions in updated['thresholds'].items():
+        for function, limits in functions.items():
+            for key in limits:
+                limit = baseline['thresholds'].get(name, {}).get(function, {}).get(key)
+                if limit is not None:
+                    limits[key] = limit
+    return updated
+
+
+STARTUP_MODULE = 'create_schedule'
+STARTUP_BUDGET_MS = 50
+# Only needed for show_graph, tests, benchmarks or worker mode
+STARTUP_EXCLUDED_MODULES = ['networkx', 'matplotlib', 'multiprocessing', 'socketserver', 'argparse', 'binary_catalog']
+
+
+def get_import_times(module=STARTUP_MODULE):
+    """
+    Import a module in a fresh interpreter with -X importtime, from the scheduler directory.
+    :return: A dictionary mapping the name of every module it imported to its cumulative import time in milliseconds.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS, repeat=5, module=STARTUP_MODULE):
+    """
+    :param repeat: Number of interpreters to start. The fastest import is compared to the budget.
+    :return: A list of messages, one for every way the import of the module is over budget.
+    """
+    runs = [get_import_times(module) for _ in range(repeat)]
+    best = min(x[module] for x in runs)
+    print(f'import {module}: {best:.1f} ms (budget {budget_ms:.0f} ms)')
+
+    failures = []
+    if best > budget_ms:
+        failures.append(f'import {module}: {best:.1f} ms > {budget_ms:.0f} ms')
+    for name in STARTUP_EXCLUDED_MODULES:
+        if name in runs[0]:
+            failures.append(f'import {module} loads {name}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scheduler benchmarks.')
+    parser.add_argument('--suite', action='store_true', help='Run the benchmark suite.')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per case and function in the suite.')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Save the suite results as a baseline.')
+    parser.add_argument(
+        '--check', metavar='PATH', nargs='?', const=DEFAULT_BASELINE,
+        help='Fail if the suite results exceed the thresholds of a baseline (default: benchmark_baseline.json).'
+    )
+    parser.add_argument(
+        '--update-baseline', action='store_true',
+        help='With --check, write cases missing from the baseline to it instead of failing on them.'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed relative slowdown for --save-baseline.')
+    parser.add_argument('--synthetic', type=int, metavar='COURSES', help='Use a synthetic catalog of this many courses.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic catalog.')
+    parser.add_argument(
+        '--startup-budget-ms', type=float, nargs='?', const=STARTUP_BUDGET_MS, metavar='MS',
+        help=f'Fail if importing {STARTUP_MODULE} takes longer than this (default {STARTUP_BUDGET_MS} ms).'
+    )
+    args = parser.parse_args(argv)
+
+    if args.startup_budget_ms is not None:
+        failures = check_startup(args.startup_budget_ms)
+        for failure in failures:
+            print(f'REGRESSION {failure}')
+        return 1 if len(failures) > 0 else 0
+
+    # Load the catalog once for everything
+    departments = SUITE_DEPARTMENTS
+    if args.synthetic is not None:
+        import synthetic_catalog
+        course_repo = synthetic_catalog.generate_catalog(args.synthetic, seed=args.seed)
+        departments = [synthetic_catalog.generate_department_code(i) for i in range(len(SUITE_DEPARTMENTS))]
+    else:
+        course_repo = load_course_repo()
+
+    if not (args.suite or args.save_baseline or args.check):
+        benchmark_create_graph(course_repo)
+        benchmark_graph_engine(course_repo)
+        return 0
+
+    course_index = scheduler.CourseIndex(course_repo)
+    if args.check is not None:
+        with open(args.check) as file:
+            baseline = json.load(file)
+        if baseline['version'] != BASELINE_VERSION:
+            raise ValueError(f'Unsupported baseline version: {baseline["version"]}')
+        # Run the same cases as the baseline, even if the catalog changed how they would be picked. Cases that were
+        # added to or removed from the suite since show up as missing.
+        cases = {x: baseline['cases'].get(x, y) for x, y in get_suite_cases(course_index, departments).items()}
+    else:
+        cases = get_suite_cases(course_index, departments)
+
+    results = run_suite(course_index, cases, args.repeat)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(make_baseline(cases, results, args.tolerance), file, indent=2)
+        print(f'Saved baseline to {args.save_baseline}')
+
+    if args.check is not None:
+        failures = check_baseline(baseline, results, allow_missing=args.update_baseline)
+        for failure in failures:
+            print(f'REGRESSION {failure}')
+        if len(failures) > 0:
+            return 1
+        print('No regressions')
+
+        missing = get_missing(baseline, results)
+        if args.update_baseline and len(missing) > 0:
+            for message in missing:
+                print(f'UPDATED {message}')
+            with open(args.check, 'w') as file:
+                json.dump(update_baseline(baseline, cases, results, args.tolerance), file, indent=2)
+            print(f'Updated baseline {args.check}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
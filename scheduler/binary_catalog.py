@@ -0,0 +1,286 @@
+"""
+A compact binary catalog for the scheduler.
+
+The JSON catalog has every field of every course, but the scheduler only needs course IDs, prerequisite and
+corequisite trees and cross-listings. This file format keeps only those, as flat arrays of 32-bit integers that are
+read straight from a memory map. Opening a catalog only maps the file, and courses are decoded the first time they are
+looked up, so worker processes start quickly and share the same read-only pages.
+
+Layout (little-endian):
+    header: magic, version, number of strings, number of courses, length of the data array
+    string offsets: (number of strings + 1) uint32. Strings are course IDs, sorted, so they can be binary searched.
+    course of string: int32 per string. Index of the course with that ID or -1.
+    group of string: int32 per string. Offset in the data array of its group of cross-listed IDs or -1.
+    courses: 3 int32 per course, in catalog order: ID string, prerequisite tree offset, corequisite tree offset (-1
+    if the course has none).
+    data: int32 array. A tree is a string index (>= 0) or an operator (-1 'or', -2 'and') followed by the number of
+    children and the children. A group is its size followed by string indices.
+    strings: UTF-8.
+
+Build it next to the catalog from the scheduler directory:
+
+    python binary_catalog.py ../catalog_parser/catalog.json ../catalog_parser/catalog.bin
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Optional, Set, List
+
+from scheduler import CourseIndex
+
+MAGIC = b'SCHEDCAT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIII')
+OPERATORS = {'or': -1, 'and': -2}
+OPERATOR_NAMES = {v: k for k, v in OPERATORS.items()}
+TREE_KEYS = ['prerequisite_courses', 'corequisite_courses']
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_binary_catalog(course_repo: List[dict], path):
+    """
+    Write the parts of a catalog (the output of CatalogParser.get_courses) that the scheduler needs to a binary file.
+    """
+    course_index = CourseIndex(course_repo)
+    courses = list(course_index)
+
+    def get_ids(tree):
+        if isinstance(tree, str):
+            return [tree]
+        return [x for child in tree[1] for x in get_ids(child)]
+
+    strings = set()
+    for course in courses:
+        strings.add(f'{course["department_code"]} {course["number"]}')
+        strings.update(course.get('equivalent', []))
+        for key in TREE_KEYS:
+            if key in course:
+                strings.update(get_ids(course[key]))
+    strings = sorted(strings)
+    string_index = {x: i for i, x in enumerate(strings)}
+
+    data = array('i')
+
+    def write_tree(tree):
+        if isinstance(tree, str):
+            data.append(string_index[tree])
+        else:
+            data.append(OPERATORS[tree[0]])
+            data.append(len(tree[1]))
+            for child in tree[1]:
+                write_tree(child)
+
+    course_of_string = array('i', [-1] * len(strings))
+    course_table = array('i')
+    for i, course in enumerate(courses):
+        course_id = f'{course["department_code"]} {course["number"]}'
+        if ' ' in course['number'] or course_id.rsplit(' ', 1)[0] != course['department_code']:
+            raise ValueError(f'Course number with a space: {course_id}')
+        course_of_string[string_index[course_id]] = i
+        course_table.append(string_index[course_id])
+        for key in TREE_KEYS:
+            if key in course:
+                course_table.append(len(data))
+                write_tree(course[key])
+            else:
+                course_table.append(-1)
+
+    # Cross-listed groups, each written once
+    group_of_string = array('i', [-1] * len(strings))
+    for course_id in strings:
+        equivalents = course_index.equivalents(course_id)
+        if len(equivalents) == 0 or group_of_string[string_index[course_id]] != -1:
+            continue
+        group = sorted(equivalents | {course_id})
+        offset = len(data)
+        data.append(len(group))
+        for x in group:
+            data.append(string_index[x])
+            group_of_string[string_index[x]] = offset
+
+    blob = bytearray()
+    string_offsets = array('I', [0])
+    for x in strings:
+        blob.extend(x.encode())
+        string_offsets.append(len(blob))
+
+    # Processes may have the old file mapped. Truncating it under them crashes them (SIGBUS), so the new file is
+    # written next to it and swapped in. Open maps keep the old file until they are closed.
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(strings), len(courses), len(data)))
+        for values in [string_offsets, course_of_string, group_of_string, course_table, data]:
+            file.write(_to_little_endian(values))
+        file.write(blob)
+    os.replace(temporary_path, path)
+
+
+class BinaryCatalog(CourseIndex):
+    """
+    A CourseIndex backed by a file written by write_binary_catalog. Courses only have the fields the scheduler uses:
+    'department_code', 'number', 'prerequisite_courses' and 'corequisite_courses'.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, string_count, course_count, data_length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'Not a binary catalog: {path}')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported binary catalog version: {version}')
+
+        position = HEADER.size
+        view = memoryview(self._mmap)
+
+        def section(typecode, count):
+            nonlocal position
+            values = view[position:position + 4 * count].cast(typecode)
+            position += 4 * count
+            if sys.byteorder != 'little':
+                values = array(typecode, values)
+                values.byteswap()
+            return values
+
+        self._string_offsets = section('I', string_count + 1)
+        self._course_of_string = section('i', string_count)
+        self._group_of_string = section('i', string_count)
+        self._course_table = section('i', 3 * course_count)
+        self._data = section('i', data_length)
+        self._strings_start = position
+        self._string_count = string_count
+        self._course_count = course_count
+        self._courses = {}  # Decoded courses by course index
+
+    # Pickle the path instead of the memory map, so worker processes map the same file
+    def __getstate__(self):
+        return {'path': self._path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def close(self):
+        for name in ['_string_offsets', '_course_of_string', '_group_of_string', '_course_table', '_data']:
+            values = getattr(self, name)
+            if isinstance(values, memoryview):
+                values.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def content_hash(self) -> str:
+        """
+        :return: The SHA-256 of the file, as a hex string.
+        """
+        return hashlib.sha256(self._mmap).hexdigest()
+
+    def _string(self, i: int) -> str:
+        start = self._strings_start + self._string_offsets[i]
+        end = self._strings_start + self._string_offsets[i + 1]
+        return self._mmap[start:end].decode()
+
+    def _find_string(self, value: str) -> int:
+        """
+        :return: The index of a string or -1.
+        """
+        strings = _StringList(self)
+        i = bisect.bisect_left(strings, value)
+        if i < self._string_count and strings[i] == value:
+            return i
+        return -1
+
+    def _decode_tree(self, offset: int):
+        data = self._data
+
+        def decode(i):
+            x = data[i]
+            if x >= 0:
+                return self._string(x), i + 1
+            children = []
+            count = data[i + 1]
+            i += 2
+            for _ in range(count):
+                child, i = decode(i)
+                children.append(child)
+            return [OPERATOR_NAMES[x], children], i
+
+        return decode(offset)[0]
+
+    def _course(self, index: int) -> dict:
+        course = self._courses.get(index)
+        if course is not None:
+            return course
+
+        id_string, prerequisites, corequisites = self._course_table[3 * index:3 * index + 3]
+        department_code, number = self._string(id_string).rsplit(' ', 1)
+        course = {'department_code': department_code, 'number': number}
+        for key, offset in zip(TREE_KEYS, [prerequisites, corequisites]):
+            if offset != -1:
+                course[key] = self._decode_tree(offset)
+        self._courses[index] = course
+        return course
+
+    def __len__(self):
+        return self._course_count
+
+    def __iter__(self):
+        return (self._course(i) for i in range(self._course_count))
+
+    def get(self, course_id: str) -> Optional[dict]:
+        i = self._find_string(course_id)
+        if i == -1:
+            i = self._find_string(self.normalize_id(course_id))
+        if i == -1 or self._course_of_string[i] == -1:
+            return None
+        return self._course(self._course_of_string[i])
+
+    def equivalents(self, course_id: str) -> Set[str]:
+        course_id = self.normalize_id(course_id)
+        i = self._find_string(course_id)
+        if i == -1 or self._group_of_string[i] == -1:
+            return set()
+        offset = self._group_of_string[i]
+        members = self._data[offset + 1:offset + 1 + self._data[offset]]
+        return {self._string(x) for x in members} - {course_id}
+
+
+class _StringList:
+    """
+    The sorted strings of a BinaryCatalog as a sequence, for bisect.
+    """
+
+    def __init__(self, catalog: BinaryCatalog):
+        self._catalog = catalog
+
+    def __len__(self):
+        return self._catalog._string_count
+
+    def __getitem__(self, i):
+        return self._catalog._string(i)
+
+
+if __name__ == '__main__':
+    catalog_path = sys.argv[1] if len(sys.argv) > 1 else '../catalog_parser/catalog.json'
+    output_path = sys.argv[2] if len(sys.argv) > 2 else '../catalog_parser/catalog.bin'
+
+    with open(catalog_path) as file:
+        write_binary_catalog(json.load(file), output_path)
+    print(f'Saved binary catalog to {output_path}')
@@ -0,0 +1,267 @@
+"""
+Transitive prerequisite closures for the whole catalog.
+
+For every course this stores the forward closure (every course it may require, following all prerequisite and
+corequisite branches) and the reverse closure (every course it unlocks). Closures are integer bitsets indexed by course
+ordinal, so "is A upstream of B" and "how many courses does X unlock" are constant time.
+
+Most closures are tiny, so the file stores the forward closures as lists of ordinals and the reverse closures are
+derived from them when the index is loaded.
+
+The file also lists the SHA-256 of the catalog files it was built from. The scheduler workers load it next to their
+catalog (see create_schedule.load_closure_index) and only use it for those versions of the catalog.
+
+Build it next to the catalog from the scheduler directory:
+
+    python closure_index.py ../catalog_parser/catalog.json ../catalog_parser/catalog_closure.json
+"""
+import hashlib
+import json
+import sys
+from typing import List, Set, Iterable
+
+FORMAT_VERSION = 1
+
+
+def get_requirement_ids(tree) -> List[str]:
+    """
+    Get all course IDs in a prerequisite tree (see CatalogParser.get_courses) in the order they appear.
+    """
+    if isinstance(tree, str):
+        return [tree]
+    ids = []
+    for child in tree[1]:
+        ids.extend(get_requirement_ids(child))
+    return ids
+
+
+def get_requirement_edges(course) -> List[str]:
+    """
+    Get the IDs of all courses that a course may directly require. These are the courses create_graph follows.
+    """
+    ids = []
+    for key in ['prerequisite_courses', 'corequisite_courses']:
+        if key in course:
+            ids.extend(get_requirement_ids(course[key]))
+    return ids
+
+
+def _strongly_connected_components(adjacency: List[List[int]]) -> List[List[int]]:
+    """
+    Tarjan's algorithm without recursion.
+    :return: The components in reverse topological order (a component comes after every component it points to).
+    """
+    index = [-1] * len(adjacency)
+    low = [0] * len(adjacency)
+    on_stack = [False] * len(adjacency)
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(len(adjacency)):
+        if index[root] != -1:
+            continue
+
+        work = [(root, 0)]
+        while len(work) > 0:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+
+            recurse = False
+            while i < len(adjacency[node]):
+                child = adjacency[node][i]
+                i += 1
+                if index[child] == -1:
+                    work.append((node, i))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                if on_stack[child]:
+                    low[node] = min(low[node], index[child])
+            if recurse:
+                continue
+
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    n = stack.pop()
+                    on_stack[n] = False
+                    component.append(n)
+                    if n == node:
+                        break
+                components.append(component)
+
+            if len(work) > 0:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+    return components
+
+
+def _transitive_closures(adjacency: List[List[int]]) -> List[int]:
+    """
+    :return: For every node, a bitset of all nodes reachable from it through one or more edges.
+    """
+    closures = [0] * len(adjacency)
+    for component in _strongly_connected_components(adjacency):
+        closure = 0
+        members = 0
+        for node in component:
+            members |= 1 << node
+            for child in adjacency[node]:
+                closure |= closures[child] | (1 << child)
+
+        # Members of a cycle reach each other. Edges within the component only show up in the closure bits above if
+        # the component is a cycle, so a lone node does not reach itself unless it has a self loop.
+        if len(component) > 1:
+            closure |= members
+        for node in component:
+            closures[node] = closure
+
+    return closures
+
+
+def _to_ordinals(bitset: int) -> List[int]:
+    ordinals = []
+    while bitset:
+        low_bit = bitset & -bitset
+        ordinals.append(low_bit.bit_length() - 1)
+        bitset ^= low_bit
+    return ordinals
+
+
+def get_file_hash(path) -> str:
+    """
+    :return: The SHA-256 of the contents of a file, as a hex string.
+    """
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class ClosureIndex:
+
+    def __init__(self, course_ids: List[str], forward: List[int], catalog_hashes: Iterable[str] = ()):
+        """
+        :param course_ids: Course IDs in ordinal order.
+        :param forward: Forward closure bitset of every course.
+        :param catalog_hashes: SHA-256 of the catalog files the closures were built from.
+        """
+        self._course_ids = course_ids
+        self._ordinals = {x: i for i, x in enumerate(course_ids)}
+        self._forward = forward
+        self._reverse = None  # Built on first use, most requests only need the forward closures
+        self.catalog_hashes = list(catalog_hashes)
+
+    def _get_reverse(self) -> List[int]:
+        if self._reverse is None:
+            # Transpose the forward closures
+            reverse = [0] * len(self._course_ids)
+            for i, bitset in enumerate(self._forward):
+                for j in _to_ordinals(bitset):
+                    reverse[j] |= 1 << i
+            self._reverse = reverse
+        return self._reverse
+
+    @classmethod
+    def build(cls, course_repo: Iterable[dict]) -> 'ClosureIndex':
+        """
+        Build the closures from a list of courses (the output of CatalogParser.get_courses) or a CourseIndex. Course
+        ordinals are assigned in sorted course ID order, so the result only depends on the catalog contents.
+        """
+        edges = {}
+        for course in course_repo:
+            course_id = f'{course["department_code"]} {course["number"]}'
+            if course_id not in edges:
+                edges[course_id] = get_requirement_edges(course)
+
+        # Courses that are required but not in the catalog still show up in the graph
+        course_ids = set(edges)
+        for children in edges.values():
+            course_ids.update(children)
+        course_ids = sorted(course_ids)
+
+        ordinals = {x: i for i, x in enumerate(course_ids)}
+        adjacency = [[] for _ in course_ids]
+        for course_id, children in edges.items():
+            for child in dict.fromkeys(children):
+                adjacency[ordinals[course_id]].append(ordinals[child])
+
+        return cls(course_ids, _transitive_closures(adjacency))
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({
+                'version': FORMAT_VERSION,
+                'catalog_hashes': self.catalog_hashes,
+                'courses': self._course_ids,
+                'forward': [_to_ordinals(x) for x in self._forward]
+            }, file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path) -> 'ClosureIndex':
+        with open(path) as file:
+            data = json.load(file)
+        if data['version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported closure index version: {data["version"]}')
+        return cls(data['courses'], [sum(1 << i for i in x) for x in data['forward']], data.get('catalog_hashes', []))
+
+    def __len__(self):
+        return len(self._course_ids)
+
+    def __contains__(self, course_id):
+        return course_id in self._ordinals
+
+    def _to_ids(self, bitset: int) -> Set[str]:
+        return {self._course_ids[i] for i in _to_ordinals(bitset)}
+
+    def requires(self, course_id: str) -> Set[str]:
+        """
+        :return: The IDs of all courses that a course may require, directly or indirectly.
+        """
+        return self._to_ids(self._forward[self._ordinals[course_id]])
+
+    def unlocks(self, course_id: str) -> Set[str]:
+        """
+        :return: The IDs of all courses that require a course, directly or indirectly.
+        """
+        return self._to_ids(self._get_reverse()[self._ordinals[course_id]])
+
+    def unlock_count(self, course_id: str) -> int:
+        return self._get_reverse()[self._ordinals[course_id]].bit_count()
+
+    def is_upstream(self, a: str, b: str) -> bool:
+        """
+        :return: True if course a may be required (directly or indirectly) to take course b.
+        """
+        if a not in self._ordinals or b not in self._ordinals:
+            return False
+        return (self._forward[self._ordinals[b]] >> self._ordinals[a]) & 1 == 1
+
+    def closure_of(self, course_ids: List[str]) -> List[str]:
+        """
+        :return: The given courses and every course they may require, in ordinal order. Unknown courses are kept.
+        """
+        bitset = 0
+        unknown = []
+        for course_id in course_ids:
+            if course_id in self._ordinals:
+                ordinal = self._ordinals[course_id]
+                bitset |= self._forward[ordinal] | (1 << ordinal)
+            else:
+                unknown.append(course_id)
+        return sorted(self._to_ids(bitset)) + unknown
+
+
+if __name__ == '__main__':
+    catalog_path = sys.argv[1] if len(sys.argv) > 1 else '../catalog_parser/catalog.json'
+    output_path = sys.argv[2] if len(sys.argv) > 2 else '../catalog_parser/catalog_closure.json'
+
+    with open(catalog_path) as file:
+        closure_index = ClosureIndex.build(json.load(file))
+    closure_index.catalog_hashes = [get_file_hash(catalog_path)]
+    closure_index.save(output_path)
+    print(f'Saved closures for {len(closure_index)} courses to {output_path}')
@@ -0,0 +1,321 @@
+"""
+A small directed graph for the scheduler.
+
+Nodes are interned to integers. Edges are kept in insertion order in flat arrays (source, destination and edge type, a
+single byte) and a CSR index (per node offsets into an array of edge numbers) is built from them for successor and
+predecessor iteration. Removing a node only clears bits in the node and edge tombstone bitmaps, so the index stays
+valid. Adding edges invalidates the index, which is rebuilt the next time it is needed.
+
+The public methods take and return node names and follow the networkx.DiGraph methods of the same name, so code and
+tests written against networkx keep working. networkx itself is only needed for to_networkx().
+"""
+import sys
+from array import array
+from typing import Iterator, List, Optional
+
+# Edge type codes. Edge types are strings in the rest of the scheduler: 'a' (prerequisite) or 'b' (corequisite).
+EDGE_TYPES = [None, 'a', 'b']
+EDGE_TYPE_CODES = {t: i for i, t in enumerate(EDGE_TYPES)}
+
+
+class NodeNotFound(KeyError):
+    pass
+
+
+def _edge_key(source: int, target: int) -> int:
+    # A single int is smaller and faster to hash than a tuple
+    return (source << 32) | target
+
+
+class CompactGraph:
+
+    def __init__(self):
+        self._names = []
+        self._ids = {}
+        self._node_alive = bytearray()
+
+        self._sources = array('i')
+        self._targets = array('i')
+        self._types = bytearray()
+        self._edge_alive = bytearray()
+        self._edge_ids = {}  # _edge_key(source, target) -> edge number
+
+        self._live_nodes = 0
+        self._live_edges = 0
+
+        # CSR index, built on demand
+        self._out_offsets = None
+        self._out_edges = None
+        self._in_offsets = None
+        self._in_edges = None
+
+    @classmethod
+    def from_networkx(cls, nx_graph) -> 'CompactGraph':
+        """
+        Copy a networkx.DiGraph (or anything with nodes() and edges(data=True)). The edge type is read from the 't'
+        edge attribute.
+        """
+        graph = cls()
+        for node in nx_graph.nodes():
+            graph.add_node(node)
+        for src, dst, data in nx_graph.edges(data=True):
+            graph.add_edge(src, dst, t=data.get('t'))
+        return graph
+
+    def to_networkx(self):
+        import networkx as nx
+        nx_graph = nx.DiGraph()
+        nx_graph.add_nodes_from(self.nodes())
+        for src, dst, t in self.typed_edges():
+            if t is None:
+                nx_graph.add_edge(src, dst)
+            else:
+                nx_graph.add_edge(src, dst, t=t)
+        return nx_graph
+
+    # Building
+
+    def _intern(self, node) -> int:
+        i = self._ids.get(node)
+        if i is None:
+            i = len(self._names)
+            self._ids[node] = i
+            self._names.append(node)
+            self._node_alive.append(1)
+            self._live_nodes += 1
+            self._grow_index()
+        elif not self._node_alive[i]:
+            self._node_alive[i] = 1
+            self._live_nodes += 1
+        return i
+
+    def _grow_index(self):
+        # A new node has no edges, so the index only needs one more offset
+        if self._out_offsets is not None:
+            self._out_offsets.append(self._out_offsets[-1])
+            self._in_offsets.append(self._in_offsets[-1])
+
+    def add_node(self, node):
+        self._intern(node)
+
+    def add_edge(self, src, dst, t: Optional[str] = None):
+        """
+        Add an edge. If the edge already exists, its type is replaced.
+        """
+        s = self._ids.get(src)
+        if s is None or not self._node_alive[s]:
+            s = self._intern(src)
+        d = self._ids.get(dst)
+        if d is None or not self._node_alive[d]:
+            d = self._intern(dst)
+        key = (s << 32) | d
+        e = self._edge_ids.get(key)
+        if e is not None:
+            self._types[e] = EDGE_TYPE_CODES[t]
+            if not self._edge_alive[e]:
+                self._edge_alive[e] = 1
+                self._live_edges += 1
+            return
+
+        self._edge_ids[key] = len(self._sources)
+        self._sources.append(s)
+        self._targets.append(d)
+        self._types.append(EDGE_TYPE_CODES[t])
+        self._edge_alive.append(1)
+        self._live_edges += 1
+        self._out_offsets = None
+
+    def _build_index(self):
+        n = len(self._names)
+
+        def build(keys):
+            # Counting sort of the edge numbers by key. It is stable, so edges keep their insertion order.
+            offsets = array('i', bytes(4 * (n + 1)))
+            for k in keys:
+                offsets[k + 1] += 1
+            for i in range(n):
+                offsets[i + 1] += offsets[i]
+            position = array('i', offsets)
+            edges = array('i', bytes(4 * len(keys)))
+            for e, k in enumerate(keys):
+                edges[position[k]] = e
+                position[k] += 1
+            return offsets, edges
+
+        self._out_offsets, self._out_edges = build(self._sources)
+        self._in_offsets, self._in_edges = build(self._targets)
+
+    def _index(self):
+        if self._out_offsets is None:
+            self._build_index()
+
+    # Queries
+
+    def _id(self, node) -> int:
+        i = self._ids.get(node)
+        if i is None or not self._node_alive[i]:
+            raise NodeNotFound(f'The node {node} is not in the graph.')
+        return i
+
+    def __contains__(self, node) -> bool:
+        i = self._ids.get(node)
+        return i is not None and self._node_alive[i] == 1
+
+    def __iter__(self) -> Iterator:
+        return iter(self.nodes())
+
+    def __len__(self) -> int:
+        return self._live_nodes
+
+    def number_of_nodes(self) -> int:
+        return self._live_nodes
+
+    def number_of_edges(self) -> int:
+        return self._live_edges
+
+    def nodes(self) -> List:
+        """
+        :return: The nodes in the order they were added.
+        """
+        alive = self._node_alive
+        return [name for i, name in enumerate(self._names) if alive[i]]
+
+    def _out(self, i, t):
+        self._index()
+        code = None if t is None else EDGE_TYPE_CODES[t]
+        targets, types, alive = self._targets, self._types, self._edge_alive
+        for k in range(self._out_offsets[i], self._out_offsets[i + 1]):
+            e = self._out_edges[k]
+            if alive[e] and (code is None or types[e] == code):
+                yield e, targets[e]
+
+    def _in(self, i, t):
+        self._index()
+        code = None if t is None else EDGE_TYPE_CODES[t]
+        sources, types, alive = self._sources, self._types, self._edge_alive
+        for k in range(self._in_offsets[i], self._in_offsets[i + 1]):
+            e = self._in_edges[k]
+            if alive[e] and (code is None or types[e] == code):
+                yield e, sources[e]
+
+    def successors(self, node, t: Optional[str] = None) -> Iterator:
+        """
+        :param node:
+        :param t: Only follow edges of this type.
+        :return: The successors of a node, in the order their edges were added.
+        """
+        names = self._names
+        return (names[d] for _, d in self._out(self._id(node), t))
+
+    def predecessors(self, node, t: Optional[str] = None) -> Iterator:
+        names = self._names
+        return (names[s] for _, s in self._in(self._id(node), t))
+
+    def in_degree(self, node, t: Optional[str] = None) -> int:
+        return sum(1 for _ in self._in(self._id(node), t))
+
+    def out_degree(self, node, t: Optional[str] = None) -> int:
+        return sum(1 for _ in self._out(self._id(node), t))
+
+    def _edge(self, src, dst) -> Optional[int]:
+        if src not in self or dst not in self:
+            return None
+        return self._edge_ids.get(_edge_key(self._ids[src], self._ids[dst]))
+
+    def edge_type(self, src, dst) -> Optional[str]:
+        e = self._edge(src, dst)
+        if e is None or not self._edge_alive[e]:
+            raise KeyError(f'The edge {src}-{dst} is not in the graph.')
+        return EDGE_TYPES[self._types[e]]
+
+    def typed_edges(self, node=None) -> Iterator:
+        """
+        :param node: Only return the outgoing edges of this node.
+        :return: (source, target, edge type) tuples in insertion order.
+        """
+        names = self._names
+        if node is not None:
+            i = self._id(node)
+            return ((names[i], names[d], EDGE_TYPES[self._types[e]]) for e, d in self._out(i, None))
+        alive = self._edge_alive
+        return (
+            (names[self._sources[e]], names[self._targets[e]], EDGE_TYPES[self._types[e]])
+            for e in range(len(self._sources)) if alive[e]
+        )
+
+    def edges(self, node=None, data=False) -> Iterator:
+        """
+        Same as networkx.DiGraph.edges. With data=True the edge type is returned as {'t': edge type}.
+        """
+        for src, dst, t in self.typed_edges(node):
+            if data:
+                yield src, dst, ({} if t is None else {'t': t})
+            else:
+                yield src, dst
+
+    # Modifying
+
+    def remove_node(self, node):
+        i = self._id(node)
+        self._node_alive[i] = 0
+        self._live_nodes -= 1
+        for e, _ in list(self._out(i, None)) + list(self._in(i, None)):
+            if self._edge_alive[e]:
+                self._edge_alive[e] = 0
+                self._live_edges -= 1
+
+    def remove_edge(self, src, dst):
+        e = self._edge(src, dst)
+        if e is None or not self._edge_alive[e]:
+            raise KeyError(f'The edge {src}-{dst} is not in the graph.')
+        self._edge_alive[e] = 0
+        self._live_edges -= 1
+
+    # Copying
+
+    def subgraph(self, nodes) -> 'CompactGraph':
+        """
+        :return: A new graph with only the given nodes and the edges between them. Nodes and edges keep their order.
+        """
+        keep = bytearray(len(self._names))
+        for node in nodes:
+            if node in self:
+                keep[self._ids[node]] = 1
+
+        graph = CompactGraph()
+        for i, name in enumerate(self._names):
+            if keep[i]:
+                graph.add_node(name)
+        for e in range(len(self._sources)):
+            s, d = self._sources[e], self._targets[e]
+            if self._edge_alive[e] and keep[s] and keep[d]:
+                graph.add_edge(self._names[s], self._names[d], t=EDGE_TYPES[self._types[e]])
+        return graph
+
+    def copy(self) -> 'CompactGraph':
+        return self.subgraph(self.nodes())
+
+    def reverse(self) -> 'CompactGraph':
+        """
+        :return: A new graph with every edge reversed.
+        """
+        graph = CompactGraph()
+        for node in self.nodes():
+            graph.add_node(node)
+        for src, dst, t in self.typed_edges():
+            graph.add_edge(dst, src, t=t)
+        return graph
+
+    def memory_size(self) -> int:
+        """
+        :return: Approximate number of bytes used by the graph structure, not counting the node names themselves.
+        """
+        size = sum(sys.getsizeof(x) for x in [
+            self._names, self._ids, self._node_alive, self._sources, self._targets, self._types, self._edge_alive,
+            self._edge_ids
+        ])
+        size += sum(sys.getsizeof(k) for k in self._edge_ids)
+        for x in [self._out_offsets, self._out_edges, self._in_offsets, self._in_edges]:
+            if x is not None:
+                size += sys.getsizeof(x)
+        return size
@@ -1,35 +1,720 @@
-import sys
+"""
+Create a schedule for a list of required courses.
+
+One-shot mode (default): read a single JSON payload from STDIN and print the schedule to STDOUT.
+    {
+        'catalog': A list of courses (the output of CatalogParser.get_courses).
+        'catalog_ref': {'path': str, 'hash': str}. Instead of 'catalog': the path of a catalog file (JSON or binary) and
+        the SHA-256 of its contents. The file is only used if its contents have that hash. Loaded catalogs are cached
+        by hash, so a new version is only loaded when the hash changes.
+        'required_courses': A list of course IDs.
+        'completed_courses': A list of course IDs.
+        'max_courses_per_quarter': int.
+        'deadline_ms': Optional[float]. Spend up to this long looking for the schedule with the fewest quarters.
+        'metrics': Optional[bool]. Add the timing of each phase and the size of the graph under '_metrics'. Not
+        supported for batch payloads.
+    }
+The output maps quarter names to course IDs ({'q1': [...], ...}). It also has '_optimal': True if the schedule is known
+to have the fewest quarters possible, and '_deadline_reached': True if the search for a shorter schedule ran out of
+time, so the schedule is only the best one found before the deadline.
+
+Batch payloads schedule many students in one call. 'requests' is a list of payloads without 'catalog', and the output
+is a list of schedules in the same order. A request that can't be scheduled gets {'error': str} in its place:
+    {
+        'catalog': ...,
+        'requests': [{'required_courses': [...], ...}, ...],
+        'processes': Optional[int]. Spread the requests over this many processes.
+    }
+
+Worker mode (--worker): load the catalog (JSON, or a binary catalog ending with '.bin') once and serve
+newline-delimited JSON requests over STDIN/STDOUT, or over a Unix socket with --socket. Each request is a payload like
+the one above with an 'id' and without 'catalog'. Requests with a 'catalog_ref' use that catalog instead of the one
+the worker was started with. Each response is written on its own line as soon as it is ready, so responses can arrive
+out of order:
+    {'id': ..., 'schedule': {'q1': [...], ...}, 'optimal': bool, 'deadline_reached': bool}
+    {'id': ..., 'schedules': [{'q1': [...], ...}, {'error': str}, ...]}  (Batch requests)
+    {'id': ..., 'error': str}
+
+Responses to requests with a 'catalog_ref' are cached by the worker (see ScheduleCache), so requests that only differ
+in the order or spacing of their course IDs are computed once. {'id': ..., 'stats': true} returns the hit and miss
+counters of the cache:
+    {'id': ..., 'stats': {'hits': int, 'misses': int, 'coalesced': int, 'entries': int, 'bytes': int}}
+
+Set SCHEDULER_PROFILE to 'cprofile' or 'tracemalloc' to dump a profile or memory snapshot of every request into
+SCHEDULER_PROFILE_DIR (default: the working directory). Open them with pstats or tracemalloc.Snapshot.load.
+"""
+import collections
+import itertools
 import json
-import traceback
+import os
+import sys
+import threading
+from typing import Optional
 
 import scheduler
 
+# One-shot runs are short, so modules that are only needed for binary catalogs, worker mode or errors (multiprocessing,
+# socketserver, argparse, ...) are imported where they are used. See benchmark.py --startup-budget-ms.
 
-def main():
-    std_input = sys.stdin.read()
-    input_json = json.loads(std_input)
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'catalog_parser', 'catalog.json')
 
-    course_catalog = input_json['catalog']
-    required_courses = input_json['required_courses']
-    completed_courses = input_json['completed_courses']
-    max_courses_per_quarter = input_json['max_courses_per_quarter']
+PROFILE = os.environ.get('SCHEDULER_PROFILE')
+PROFILE_DIR = os.environ.get('SCHEDULER_PROFILE_DIR', '.')
+_profile_counter = itertools.count()
 
-    schedule = scheduler.create_schedule(
-        course_catalog,
-        required_courses,
-        max_courses_per_quarter=max_courses_per_quarter,
-        completed_courses=completed_courses
+
+def load_course_index(path):
+    """
+    :param path: Path to a catalog JSON file, or a binary catalog (see binary_catalog.py) if it ends with '.bin'.
+    :return: A CourseIndex.
+    """
+    if str(path).endswith('.bin'):
+        import binary_catalog
+        return binary_catalog.BinaryCatalog(path)
+    with open(path) as file:
+        return scheduler.CourseIndex(json.load(file))
+
+
+def get_closure_path(catalog_path) -> str:
+    """
+    :return: Where the ClosureIndex of a catalog is kept: catalog.json and catalog.bin share catalog_closure.json.
+    """
+    directory, name = os.path.split(str(catalog_path))
+    return os.path.join(directory, os.path.splitext(name)[0] + '_closure.json')
+
+
+def load_closure_index(catalog_path, catalog_hash: str):
+    """
+    Load the ClosureIndex next to a catalog (see get_closure_path).
+    :param catalog_path:
+    :param catalog_hash: The SHA-256 of the catalog file.
+    :return: The ClosureIndex, or None if there is none or it was built from another version of the catalog.
+    """
+    path = get_closure_path(catalog_path)
+    if not os.path.exists(path):
+        return None
+    from closure_index import ClosureIndex
+    closure_index = ClosureIndex.load(path)
+    if catalog_hash not in closure_index.catalog_hashes:
+        return None
+    return closure_index
+
+
+class CatalogCache:
+    """
+    Loaded catalogs, with their closure index if there is one, keyed by the SHA-256 of their file contents. The least
+    recently used catalog is dropped once there are more than max_size.
+    """
+
+    def __init__(self, max_size: int = 2):
+        self._max_size = max_size
+        self._catalogs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path, expected_hash=None):
+        """
+        Load a catalog file, or get it from the cache.
+        :param path: Path to a catalog JSON file or binary catalog.
+        :param expected_hash: If given and already in the cache, the file is not read at all. Otherwise the contents of
+        the file must have this hash.
+        :return: (The hash of the catalog, a CourseIndex, a ClosureIndex or None)
+        """
+        with self._lock:
+            if expected_hash in self._catalogs:
+                self._catalogs.move_to_end(expected_hash)
+                return (expected_hash, *self._catalogs[expected_hash])
+
+        # Hash the same bytes that are loaded, so the file can't change in between
+        if str(path).endswith('.bin'):
+            import binary_catalog
+            course_index = binary_catalog.BinaryCatalog(path)
+            content_hash = course_index.content_hash()
+        else:
+            import hashlib
+            with open(path, 'rb') as file:
+                content = file.read()
+            content_hash = hashlib.sha256(content).hexdigest()
+            course_index = None
+
+        if expected_hash is not None and content_hash != expected_hash:
+            if course_index is not None:
+                course_index.close()
+            raise ValueError(f'The catalog {path} has hash {content_hash}, expected {expected_hash}')
+
+        if course_index is None:
+            course_index = scheduler.CourseIndex(json.loads(content))
+        closure_index = load_closure_index(path, content_hash)
+
+        with self._lock:
+            self._catalogs[content_hash] = (course_index, closure_index)
+            self._catalogs.move_to_end(content_hash)
+            while len(self._catalogs) > self._max_size:
+                self._catalogs.popitem(last=False)
+        return content_hash, course_index, closure_index
+
+    def get(self, catalog_ref):
+        """
+        :param catalog_ref: {'path': str, 'hash': str}
+        :return: (A CourseIndex, a ClosureIndex or None)
+        """
+        return self.load(catalog_ref['path'], catalog_ref['hash'])[1:]
+
+
+_catalog_cache = CatalogCache()
+
+
+def get_request_catalog(request, default=None):
+    """
+    :return: The catalog of a request: the one in its 'catalog_ref' or 'catalog', or the default.
+    """
+    if 'catalog_ref' in request:
+        return _catalog_cache.get(request['catalog_ref'])[0]
+    if 'catalog' in request:
+        return request['catalog']
+    return default
+
+
+def get_request_closure_index(request, default=None):
+    """
+    :return: The ClosureIndex of the catalog of a request (see get_request_catalog), or None if it has none. Inline
+    catalogs never have one.
+    """
+    if 'catalog_ref' in request:
+        return _catalog_cache.get(request['catalog_ref'])[1]
+    if 'catalog' in request:
+        return None
+    return default
+
+
+def get_schedule_key(request):
+    """
+    :return: The key of a request in a ScheduleCache: (catalog hash, sorted required courses, sorted completed courses,
+    max courses per quarter, whether it has a deadline), with course IDs normalized. None if the response can't be
+    cached: the catalog has no hash (no 'catalog_ref'), or it is a batch or metrics request. The length of the deadline
+    is not part of the key: schedules of searches that reached their deadline aren't cached, and the others are the
+    answer for any deadline.
+    """
+    if 'catalog_ref' not in request or 'requests' in request or request.get('metrics'):
+        return None
+
+    def normalize(course_ids):
+        return tuple(sorted({scheduler.CourseIndex.normalize_id(x) for x in course_ids}))
+
+    return (
+        request['catalog_ref']['hash'],
+        normalize(request['required_courses']),
+        normalize(request.get('completed_courses', [])),
+        request.get('max_courses_per_quarter', 4),
+        request.get('deadline_ms') is not None  # Only requests with a deadline search for the fewest quarters
     )
 
+
+class ScheduleCache:
+    """
+    Responses to schedule requests keyed by get_schedule_key. The least recently used responses are dropped once there
+    are more than max_entries, or once their JSON takes more than max_bytes. Identical requests that arrive while the
+    first one is still being computed wait for its response instead of computing it again, even if their deadlines
+    differ.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._responses = collections.OrderedDict()  # key -> (response, size)
+        self._bytes = 0
+        self._waiting = {}  # key -> callbacks of the requests waiting for the response
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Requests that waited for an identical request
+
+    def submit(self, key, callback, compute):
+        """
+        Get a response from the cache, or compute it.
+        :param key: See get_schedule_key.
+        :param callback: Called with the response, possibly from another thread.
+        :param compute: Called with a callback for the response if it is not in the cache or already being computed.
+        """
+        with self._lock:
+            if key in self._responses:
+                self.hits += 1
+                self._responses.move_to_end(key)
+                response = self._responses[key][0]
+            elif key in self._waiting:
+                self.coalesced += 1
+                self._waiting[key].append(callback)
+                return
+            else:
+                self.misses += 1
+                self._waiting[key] = [callback]
+                response = None
+
+        if response is not None:
+            callback(response)
+        else:
+            compute(lambda x: self._finish(key, x))
+
+    def _finish(self, key, response):
+        with self._lock:
+            callbacks = self._waiting.pop(key)
+            # Errors can be temporary (Ex. the catalog file is being replaced), and a search that ran out of time may
+            # find a better schedule with more time, so neither is kept
+            if 'error' not in response and not response.get('deadline_reached'):
+                self._add(key, response)
+        for callback in callbacks:
+            callback(response)
+
+    def _add(self, key, response):
+        size = len(json.dumps(response))
+        if size > self._max_bytes:
+            return
+        self._responses[key] = (response, size)
+        self._bytes += size
+        while len(self._responses) > self._max_entries or self._bytes > self._max_bytes:
+            _, (_, size) = self._responses.popitem(last=False)
+            self._bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._responses),
+                'bytes': self._bytes,
+            }
+
+
+def format_schedule(schedule):
+    """
+    :return: A dictionary mapping quarter names ('q1', 'q2', ...) to lists of course IDs.
+    """
     schedule_json = {}
     for i, x in enumerate(schedule):
         schedule_json[f'q{i+1}'] = x
+    return schedule_json
+
+
+def handle_request(course_index, request, allow_processes=True, info=None, metrics=None, closure_index=None):
+    """
+    Create a schedule for a single request, or schedules for a batch request.
+    :param course_index: A CourseIndex.
+    :param request: A request payload.
+    :param allow_processes: If False, the 'processes' option of batch requests is ignored.
+    :param info: Passed on to create_schedule for single requests.
+    :param metrics: Passed on to create_schedule for single requests.
+    :param closure_index: Optional ClosureIndex of the catalog.
+    :return: A formatted schedule (see format_schedule), or a list of them for batch requests with {'error': str} for
+    the requests that failed.
+    """
+    if 'requests' in request:
+        schedules = scheduler.create_schedules_batch(
+            course_index,
+            request['requests'],
+            processes=request.get('processes') if allow_processes else None,
+            closure_index=closure_index
+        )
+        return [x if isinstance(x, dict) else format_schedule(x) for x in schedules]
+
+    schedule = scheduler.create_schedule(
+        course_index,
+        request['required_courses'],
+        max_courses_per_quarter=request.get('max_courses_per_quarter', 4),
+        completed_courses=request.get('completed_courses', []),
+        closure_index=closure_index,
+        deadline_ms=request.get('deadline_ms'),
+        info=info,
+        metrics=metrics
+    )
+
+    return format_schedule(schedule)
+
+
+def get_rss_bytes():
+    """
+    :return: The resident set size of the current process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Not Linux. The peak RSS is the closest we can get.
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def profile_call(function, *args, **kwargs):
+    """
+    Call a function. If SCHEDULER_PROFILE is set, profile the call and dump the result into SCHEDULER_PROFILE_DIR.
+    """
+    if PROFILE is None:
+        return function(*args, **kwargs)
+
+    path = os.path.join(PROFILE_DIR, f'schedule-{os.getpid()}-{next(_profile_counter)}')
+    if PROFILE == 'cprofile':
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            profile.dump_stats(path + '.prof')
+    elif PROFILE == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            tracemalloc.take_snapshot().dump(path + '.tracemalloc')
+            tracemalloc.stop()
+    raise ValueError(f'Unknown SCHEDULER_PROFILE: {PROFILE}')
+
+
+def _respond(request, course_index, allow_processes=True, closure_index=None):
+    try:
+        closure_index = get_request_closure_index(request, closure_index)
+        course_index = get_request_catalog(request, course_index)
+        if 'requests' in request:
+            schedules = profile_call(handle_request, course_index, request, allow_processes, closure_index=closure_index)
+            return {'id': request.get('id'), 'schedules': schedules}
+        info = {}
+        metrics = {} if request.get('metrics') else None
+        schedule = profile_call(handle_request, course_index, request, allow_processes, info, metrics, closure_index)
+        response = {
+            'id': request.get('id'), 'schedule': schedule, 'optimal': info['optimal'],
+            'deadline_reached': info['deadline_reached']
+        }
+        if metrics is not None:
+            response['_metrics'] = metrics
+        return response
+    except Exception:
+        import traceback
+        return {'id': request.get('id'), 'error': traceback.format_exc()}
+
+
+def _worker_main(worker_id, catalog_path, tasks, results, max_requests, max_rss_bytes):
+    # Requests that reference the same version of the catalog use this one
+    _, course_index, closure_index = _catalog_cache.load(catalog_path)
+
+    handled = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, request = task
+        results.put(('taken', worker_id, task_id))
+        # Worker processes are daemons, which can't start processes of their own
+        results.put(('done', worker_id, task_id, _respond(request, course_index, False, closure_index)))
+
+        # Recycle this worker if it is getting old or fat. Nothing else is taken from the task queue, so no requests
+        # are lost.
+        handled += 1
+        if (max_requests is not None and handled >= max_requests) or \
+                (max_rss_bytes is not None and get_rss_bytes() > max_rss_bytes):
+            break
+
+    results.put(('exit', worker_id, None))
+
+
+class WorkerPool:
+    """
+    A pool of scheduler processes. Each process loads the catalog once and then serves requests until it is recycled.
+    """
+
+    def __init__(self, catalog_path, processes: int = 1, max_requests=None, max_rss_mb=None, cache: Optional[ScheduleCache] = None):
+        """
+        :param catalog_path: Path to the catalog JSON file.
+        :param processes: Number of worker processes. If 0, requests are handled in the calling thread.
+        :param max_requests: Recycle a worker after it has handled this many requests.
+        :param max_rss_mb: Recycle a worker once its resident set size goes above this many megabytes.
+        :param cache: Reuse the responses to requests that have the same key (see get_schedule_key).
+        """
+        self._catalog_path = catalog_path
+        self._processes = processes
+        self._max_requests = max_requests
+        self._max_rss_bytes = None if max_rss_mb is None else max_rss_mb * 1024 * 1024
+        self.cache = cache
+
+        self._lock = threading.Lock()
+        self._callbacks = {}  # task ID -> (request, callback)
+        self._taken = {}  # worker ID -> task ID
+        self._next_task_id = 0
+        self._closed = False
+
+        if processes == 0:
+            _, self._course_index, self._closure_index = _catalog_cache.load(catalog_path)
+            return
+
+        import multiprocessing
+        self._tasks = multiprocessing.Queue()
+        # Writes to a SimpleQueue go straight to the pipe, not through a feeder thread, so everything a worker sent is
+        # readable once it has exited
+        self._results = multiprocessing.SimpleQueue()
+        self._workers = {}
+        self._next_worker_id = 0
+        for _ in range(processes):
+            self._start_worker()
+
+        self._result_thread = threading.Thread(target=self._handle_results, daemon=True)
+        self._result_thread.start()
+
+    def _start_worker(self):
+        import multiprocessing
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        process = multiprocessing.Process(
+            target=_worker_main,
+            args=(worker_id, self._catalog_path, self._tasks, self._results, self._max_requests, self._max_rss_bytes),
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = process
+
+    def submit(self, request, callback):
+        """
+        Schedule a request. The callback is called with the response once it is ready, possibly from another thread.
+        """
+        if request.get('stats'):
+            callback({'id': request.get('id'), 'stats': {} if self.cache is None else self.cache.stats()})
+            return
+
+        key = None if self.cache is None else get_schedule_key(request)
+        if key is None:
+            self._submit(request, callback)
+            return
+
+        # Compute the normalized request, so that the cached response only depends on the key
+        normalized = dict(request, required_courses=list(key[1]), completed_courses=list(key[2]))
+        self.cache.submit(
+            key,
+            lambda response: callback({'id': request.get('id'), **response}),
+            lambda done: self._submit(normalized, lambda response: done({k: v for k, v in response.items() if k != 'id'}))
+        )
+
+    def _submit(self, request, callback):
+        if self._processes == 0:
+            callback(_respond(request, self._course_index, closure_index=self._closure_index))
+            return
+
+        with self._lock:
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            self._callbacks[task_id] = (request, callback)
+        self._tasks.put((task_id, request))
+
+    def _finish(self, task_id, response):
+        with self._lock:
+            _, callback = self._callbacks.pop(task_id)
+        callback(response)
+
+    def _handle_results(self):
+        from multiprocessing.connection import wait
+        while True:
+            # Wake up for results and for workers that exit, so a crash is noticed under load too
+            sentinels = [process.sentinel for process in self._workers.values()]
+            wait([self._results._reader] + sentinels, timeout=1)
+            dead = [worker_id for worker_id, process in self._workers.items() if not process.is_alive()]
+
+            # Read everything, including the last messages of the dead workers, before deciding which ones crashed
+            while not self._results.empty():
+                if self._handle_message(self._results.get()):
+                    return
+            for worker_id in dead:
+                if worker_id in self._workers and self._fail_worker(worker_id):
+                    return
+
+            if self._closed and len(self._workers) == 0:
+                return
+
+    def _handle_message(self, message) -> bool:
+        """
+        :return: True if the pool is closed and all workers are done.
+        """
+        kind, worker_id, task_id = message[:3]
+        if kind == 'taken':
+            self._taken[worker_id] = task_id
+        elif kind == 'done':
+            self._taken.pop(worker_id, None)
+            self._finish(task_id, message[3])
+        elif kind == 'exit':
+            self._workers.pop(worker_id).join()
+            return self._replace_worker()
+        return False
+
+    def _fail_worker(self, worker_id) -> bool:
+        """
+        A worker exited without saying so: it crashed. Fail the request it was working on and replace it.
+        :return: True if the pool is closed and all workers are done.
+        """
+        process = self._workers.pop(worker_id)
+        process.join()
+        task_id = self._taken.pop(worker_id, None)
+        if task_id is not None:
+            request, _ = self._callbacks[task_id]
+            self._finish(task_id, {'id': request.get('id'), 'error': f'Worker exited with code {process.exitcode}'})
+        return self._replace_worker()
+
+    def _replace_worker(self):
+        """
+        Start a new worker after one has exited.
+        :return: True if the pool is closed and all workers are done.
+        """
+        # close() counts the workers to stop, so it must not run while one is being started
+        with self._lock:
+            if not self._closed:
+                self._start_worker()
+            elif len(self._callbacks) > 0:
+                # Closing, but there are still requests left
+                self._start_worker()
+                self._tasks.put(None)
+            return self._closed and len(self._workers) == 0
+
+    def close(self):
+        """
+        Wait for all submitted requests to finish and stop the worker processes.
+        """
+        if self._processes == 0:
+            return
+        with self._lock:
+            self._closed = True
+            for _ in range(len(self._workers)):
+                self._tasks.put(None)
+        self._result_thread.join()
+
+
+def _parse_request_line(line):
+    try:
+        return json.loads(line), None
+    except json.JSONDecodeError as e:
+        return None, {'id': None, 'error': f'Invalid JSON: {e}'}
+
+
+def serve_stdio(pool: WorkerPool, input_file=sys.stdin, output_file=sys.stdout):
+    output_lock = threading.Lock()
+
+    def write_response(response):
+        with output_lock:
+            output_file.write(json.dumps(response) + '\n')
+            output_file.flush()
+
+    for line in input_file:
+        if len(line.strip()) == 0:
+            continue
+        request, error = _parse_request_line(line)
+        if error is not None:
+            write_response(error)
+            continue
+        pool.submit(request, write_response)
+
+    pool.close()
+
+
+def serve_unix_socket(pool: WorkerPool, path):
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            output_lock = threading.Lock()
+            pending = threading.Semaphore(0)
+            submitted = 0
+
+            def write_response(response):
+                try:
+                    with output_lock:
+                        self.wfile.write((json.dumps(response) + '\n').encode())
+                        self.wfile.flush()
+                except OSError:
+                    pass  # Client went away
+                pending.release()
+
+            for line in self.rfile:
+                if len(line.strip()) == 0:
+                    continue
+                request, error = _parse_request_line(line)
+                if error is not None:
+                    submitted += 1
+                    write_response(error)
+                    continue
+                submitted += 1
+                pool.submit(request, write_response)
+
+            # Don't close the connection before all responses were written
+            for _ in range(submitted):
+                pending.acquire()
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        finally:
+            pool.close()
+            os.remove(path)
+
+
+def main():
+    std_input = sys.stdin.read()
+    input_json = json.loads(std_input)
+
+    course_catalog = get_request_catalog(input_json)
+    if course_catalog is None:
+        raise ValueError('The payload needs a catalog or catalog_ref')
+
+    info = {} if 'requests' not in input_json else None
+    metrics = {} if input_json.get('metrics') and 'requests' not in input_json else None
+    schedule_json = profile_call(handle_request, course_catalog, input_json, info=info, metrics=metrics,
+                                 closure_index=get_request_closure_index(input_json))
+    if info is not None:
+        schedule_json['_optimal'] = info['optimal']
+        schedule_json['_deadline_reached'] = info['deadline_reached']
+    if metrics is not None:
+        schedule_json['_metrics'] = metrics
 
     print(json.dumps(schedule_json))
 
 
+def worker_main(argv=None):
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description='Serve schedule requests from a long-running process.')
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG_PATH, help='Path to the catalog JSON file or binary catalog.')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of STDIN/STDOUT.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes. 0 to serve requests in this process.')
+    parser.add_argument('--max-requests', type=int, help='Recycle a worker process after this many requests.')
+    parser.add_argument('--max-rss-mb', type=int, help='Recycle a worker process once it uses more memory than this.')
+    parser.add_argument('--cache-entries', type=int, default=1024, help='Number of responses to cache. 0 to disable the cache.')
+    parser.add_argument('--cache-mb', type=int, default=64, help='Most memory used by the JSON of the cached responses.')
+    args = parser.parse_args(argv)
+
+    # Shut down cleanly (and remove the socket) when the server stops us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    cache = ScheduleCache(args.cache_entries, args.cache_mb * 1024 * 1024) if args.cache_entries > 0 else None
+    pool = WorkerPool(
+        args.catalog,
+        processes=args.processes,
+        max_requests=args.max_requests,
+        max_rss_mb=args.max_rss_mb,
+        cache=cache
+    )
+    if args.socket is not None:
+        serve_unix_socket(pool, args.socket)
+    else:
+        serve_stdio(pool)
+
+
 if __name__ == '__main__':
-    try:
-        main()
-    except Exception as e:
-        traceback.print_exc(file=sys.stdout)
+    if '--worker' in sys.argv[1:]:
+        worker_main()
+    else:
+        try:
+            main()
+        except Exception as e:
+            import traceback
+            traceback.print_exc(file=sys.stdout)
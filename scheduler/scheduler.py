@@ -1,10 +1,11 @@
 import collections
+import copy
+import heapq
 import itertools
-import queue
-from typing import Optional, List
+import time
+from typing import Optional, List, Set, Iterator, Tuple, Union
 
-import networkx as nx
-import networkx.exception
+from compact_graph import CompactGraph
 
 
 class Node:
@@ -26,42 +27,122 @@ class Node:
         return self.value == other.value
 
 
-def succ_with_atr(graph: nx.DiGraph, node, attr: {}):
-    children = []
-    for src, dst, data in graph.edges(node, data=True):
-        if len(attr) == 0:
-            children.append(dst)
-        for k, v in attr.items():
-            if k in data and data[k] == v:
-                children.append(dst)
-    return children
+class CourseIndex:
+    """
+    Constant time course lookup for a list of courses (the output of CatalogParser.get_courses). Build it once and pass
+    it to create_graph / create_schedule instead of the raw list.
 
+    Courses are keyed by course ID ("DEPT NUMBER", Ex. "COMPSCI 161"). Cross-listed course IDs (the 'equivalent' list of
+    a course) are grouped together so they can be resolved to a course in the catalog.
+    """
 
-def pred_with_atr(graph, node, attr):
-    parents = []
-    for src, dst, data in graph.in_edges(node, data=True):
-        if len(attr) == 0:
-            parents.append(dst)
-        for k, v in attr.items():
-            if k in data and data[k] == v:
-                parents.append(src)
-    return parents
+    def __init__(self, course_repo: List[dict]):
+        self._courses = {}
+        for course in course_repo:
+            # Keep the first course with a given ID, same as a linear scan would
+            self._courses.setdefault(f'{course["department_code"]} {course["number"]}', course)
+
+        # Group cross-listed courses. Cross-listings are not always symmetric in the catalog, so merge groups with a
+        # union-find.
+        parent = {}
+
+        def find(x):
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for course_id, course in self._courses.items():
+            for equivalent in course.get('equivalent', []):
+                parent[find(equivalent)] = find(course_id)
+
+        groups = collections.defaultdict(set)
+        for course_id in parent:
+            groups[find(course_id)].add(course_id)
+
+        self._equivalents = {}
+        for group in groups.values():
+            group = frozenset(group)
+            for course_id in group:
+                self._equivalents[course_id] = group
+
+    def __len__(self):
+        return len(self._courses)
+
+    def __iter__(self):
+        return iter(self._courses.values())
+
+    def __contains__(self, course_id):
+        return self.get(course_id) is not None
+
+    @staticmethod
+    def normalize_id(course_id: str) -> str:
+        return ' '.join(course_id.split())
+
+    def get(self, course_id: str) -> Optional[dict]:
+        """
+        Get a course by its exact course ID.
+        :param course_id: Course ID (Ex. "COMPSCI 161")
+        :return: The course or None if it does not exist in the catalog.
+        """
+        course = self._courses.get(course_id)
+        if course is None:
+            course = self._courses.get(self.normalize_id(course_id))
+        return course
+
+    def equivalents(self, course_id: str) -> Set[str]:
+        """
+        Get the IDs of all courses that are cross-listed with a course, not including the course itself.
+        :param course_id: Course ID (Ex. "COMPSCI 161")
+        :return: A set of course IDs. Some of them may not exist in the catalog.
+        """
+        course_id = self.normalize_id(course_id)
+        return set(self._equivalents.get(course_id, ())) - {course_id}
+
+    def resolve(self, course_id: str) -> Optional[dict]:
+        """
+        Get a course by its course ID, or by the ID of a course that is cross-listed with it.
+        :param course_id: Course ID (Ex. "COMPSCI 161")
+        :return: The course or None if neither the course nor any of its equivalents exist in the catalog.
+        """
+        course = self.get(course_id)
+        if course is not None:
+            return course
+        for equivalent in sorted(self.equivalents(course_id)):
+            course = self.get(equivalent)
+            if course is not None:
+                return course
+        return None
+
+
+def succ_with_atr(graph: CompactGraph, node, attr: {}):
+    return list(graph.successors(node, t=attr.get('t')))
+
+
+def pred_with_atr(graph: CompactGraph, node, attr):
+    return list(graph.predecessors(node, t=attr.get('t')))
 
 
 def custom_all_simple_paths(graph, src, dst):
+    """
+    Enumerate every simple path from src to dst. There can be exponentially many, use count_paths to only count them.
+    """
     paths = []
 
     stack = []
+    on_stack = set()
 
     def dfs(node):
         stack.append(node)
+        on_stack.add(node)
         if node == dst:
             paths.append(list(stack))
-
-        for s, d, data in graph.edges(node, data=True):
-            if len(stack) > 1 and stack[-2] == d:
-                continue
-            dfs(d)
+        else:
+            for s, d, data in graph.edges(node, data=True):
+                if d not in on_stack:
+                    dfs(d)
+        on_stack.remove(node)
         stack.pop()
 
     dfs(src)
@@ -69,6 +150,126 @@ def custom_all_simple_paths(graph, src, dst):
     return paths
 
 
+def get_strongly_connected_components(graph) -> List[List[str]]:
+    """
+    Find the strongly connected components of a graph (Tarjan's algorithm, without recursion so long prerequisite
+    chains can't overflow the stack).
+    :return: A list of components, each a list of nodes. A component comes after every component it has an edge to.
+    """
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+
+    for root in graph.nodes():
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(list(graph.successors(root))))]
+        while len(work) > 0:
+            node, children = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(list(graph.successors(child)))))
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+                continue
+
+            work.pop()
+            if len(work) > 0:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    x = stack.pop()
+                    on_stack.remove(x)
+                    component.append(x)
+                    if x == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+def find_prerequisite_cycles(graph) -> List[List[str]]:
+    """
+    Find the courses that require each other through prerequisites, possibly together with corequisites or through an
+    'or' branch. Cycles of corequisites only are not included: get_corequisite_groups makes them a single group that is
+    taken in one quarter.
+    :return: A sorted list of cycles, each a sorted list of the courses of a strongly connected component.
+    """
+    component_of = {}
+    components = get_strongly_connected_components(graph)
+    for i, component in enumerate(components):
+        for node in component:
+            component_of[node] = i
+
+    # The edges of an 'or' node to its branches are corequisites if the edge to the 'or' node is one (see create_graph)
+    edges = [(src, dst, data.get('t')) for src, dst, data in graph.edges(data=True)]
+    or_node_types = {dst: t for _, dst, t in edges if isinstance(dst, str) and dst.startswith('or')}
+
+    cyclic = set()
+    for src, dst, t in edges:
+        if component_of[src] == component_of[dst] and or_node_types.get(src, t) != 'b':
+            cyclic.add(component_of[src])
+
+    return sorted(sorted(x for x in components[i] if not x.startswith('or')) for i in cyclic)
+
+
+def count_paths(graph, src, dst) -> int:
+    """
+    Count the paths from src to dst in the graph with every strongly connected component contracted to one node. For
+    graphs without cycles, this is the number of simple paths (see custom_all_simple_paths). Linear in the size of the
+    graph however many paths there are.
+    """
+    if src not in graph or dst not in graph:
+        return 0
+
+    component_of = {}
+    components = get_strongly_connected_components(graph)
+    for i, component in enumerate(components):
+        for node in component:
+            component_of[node] = i
+
+    # Components come after the components they have edges to, so each count only needs counts that are already known
+    target = component_of[dst]
+    counts = [0] * len(components)
+    for i, component in enumerate(components):
+        if i == target:
+            counts[i] = 1
+            continue
+        children = set(component_of[x] for node in component for x in graph.successors(node))
+        counts[i] = sum(counts[x] for x in children if x != i)
+    return counts[component_of[src]]
+
+
+def has_path(graph, src, dst) -> bool:
+    """
+    :return: True if dst can be reached from src. Cycles are fine.
+    """
+    if src not in graph or dst not in graph:
+        return False
+    seen = {src}
+    stack = [src]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node == dst:
+            return True
+        for child in graph.successors(node):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return False
+
+
 def get_all_combinations(graph, node):
     def get_all_combos(node, combos, global_combos):
         children = [x for x in graph.successors(node)]
@@ -117,99 +318,720 @@ def get_all_combinations(graph, node):
     return global_combos
 
 
-def create_schedule(course_repo, required_courses: [str], max_courses_per_quarter: int = 4, completed_courses: Optional[List[str]] = None):
+class AndOrSolver:
+    """
+    Finds the smallest set of nodes in a course graph (see create_graph) that satisfies a list of required courses.
+
+    Course nodes need all of their successors, 'or' nodes need exactly one of them. Instead of enumerating every
+    combination of 'or' branches, this does a branch-and-bound search over the 'or' nodes: the nodes a course always
+    needs (its "forced" closure) are memoized per node and shared between branches, 'or' nodes that are already
+    satisfied by a selected child are never branched on, and branches that cannot beat the best set found so far are
+    pruned. Sets of nodes are kept as int bitsets, so unions and sizes don't build any Python sets.
+    """
+
+    def __init__(self, graph, count_or_nodes: bool = True):
+        """
+        :param graph:
+        :param count_or_nodes: If False, the size of a set is only the number of courses in it.
+        """
+        self._graph = graph
+        self._count_or_nodes = count_or_nodes
+        self._forced = {}
+        self.timed_out = False
+
+        # One bit per node, numbered as nodes are reached. Unions are | and sizes are popcounts.
+        self._bits = {}  # node -> bit
+        self._nodes = []  # bit number -> node
+        self._or_mask = 0  # Bits of the 'or' nodes
+        self._forced_masks = {}
+        self._forced_or_nodes = {}
+        self._children = {}  # 'or' node -> (children, mask of the children)
+
+    def _bit(self, node) -> int:
+        bit = self._bits.get(node)
+        if bit is None:
+            bit = 1 << len(self._nodes)
+            self._bits[node] = bit
+            self._nodes.append(node)
+            if node.startswith('or'):
+                self._or_mask |= bit
+        return bit
+
+    def _to_nodes(self, mask: int) -> Set[str]:
+        nodes = set()
+        while mask:
+            low = mask & -mask
+            nodes.add(self._nodes[low.bit_length() - 1])
+            mask ^= low
+        return nodes
+
+    def forced(self, node) -> List[str]:
+        """
+        Get the nodes that are needed whenever a node is needed: the node itself and everything reachable from it
+        without picking a branch of an 'or' node. 'or' nodes are included, their children are not.
+        :return: A list of nodes in the order they were found.
+        """
+        if node in self._forced:
+            return self._forced[node]
+
+        closure = {node: None}
+        stack = [node]
+        while len(stack) > 0:
+            n = stack.pop()
+            if n.startswith('or'):
+                continue
+            for child in self._graph.successors(n):
+                if child not in closure:
+                    closure[child] = None
+                    stack.append(child)
+
+        closure = list(closure)
+        self._forced[node] = closure
+        return closure
+
+    def _forced_mask(self, node) -> int:
+        mask = self._forced_masks.get(node)
+        if mask is None:
+            closure = self.forced(node)
+            mask = 0
+            for x in closure:
+                mask |= self._bit(x)
+            self._forced_masks[node] = mask
+            self._forced_or_nodes[node] = [x for x in closure if x.startswith('or')]
+        return mask
+
+    def _get_children(self, or_node):
+        children = self._children.get(or_node)
+        if children is None:
+            nodes = [x for x in self._graph.successors(or_node)]
+            mask = 0
+            for x in nodes:
+                mask |= self._bit(x)
+            children = self._children[or_node] = (nodes, mask)
+        return children
+
+    def _cost(self, mask: int) -> int:
+        if self._count_or_nodes:
+            return mask.bit_count()
+        return (mask & ~self._or_mask).bit_count()
+
+    def _start(self, roots: [str]):
+        selected = 0
+        or_nodes = []
+        for root in roots:
+            if root in self._graph:
+                added = self._forced_mask(root) & ~selected
+                selected |= added
+                or_nodes += [x for x in self._forced_or_nodes[root] if self._bits[x] & added]
+        return selected, or_nodes
+
+    def _branch(self, selected: int, or_nodes: List[str]):
+        """
+        Find the unsatisfied 'or' node whose cheapest branch is the most expensive. The cost of that branch is a lower
+        bound for the number of nodes that still have to be added to the selected ones.
+        :return: (The children of that 'or' node sorted by cost or None if all 'or' nodes are satisfied, the lower
+        bound, the 'or' nodes that are not satisfied yet)
+        """
+        choice = None
+        lower_bound = 0
+        open_or_nodes = []
+        for or_node in or_nodes:
+            children, children_mask = self._get_children(or_node)
+            if len(children) == 0 or children_mask & selected:
+                continue
+            open_or_nodes.append(or_node)
+            costs = [(self._cost(self._forced_mask(x) & ~selected), i) for i, x in enumerate(children)]
+            costs.sort()
+            if choice is None or costs[0][0] > lower_bound:
+                lower_bound = costs[0][0]
+                choice = [children[i] for _, i in costs]
+        return choice, lower_bound, open_or_nodes
+
+    def _select(self, selected: int, or_nodes: List[str], child):
+        """
+        :return: (The selected nodes after selecting a child of an 'or' node, the 'or' nodes that need a choice)
+        """
+        added = self._forced_mask(child) & ~selected
+        return selected | added, or_nodes + [x for x in self._forced_or_nodes[child] if self._bits[x] & added]
+
+    def solve(self, roots: [str], deadline: Optional[float] = None) -> Set[str]:
+        """
+        :param roots: Required course nodes. Nodes that are not in the graph are ignored.
+        :param deadline: A time.perf_counter() value. Once it has passed, the search stops at the next solution it
+        finds and timed_out is set. The first solution is usually found after a single descent.
+        :return: The smallest set of nodes that contains all roots and satisfies all of their requirements.
+        """
+        best = None
+        best_cost = None
+        self.timed_out = False
+
+        def search(selected: int, or_nodes: List[str]):
+            nonlocal best, best_cost
+
+            choice, lower_bound, open_or_nodes = self._branch(selected, or_nodes)
+            cost = self._cost(selected)
+
+            if best is not None and cost + lower_bound >= best_cost:
+                return
+
+            if choice is None:
+                best = selected
+                best_cost = cost
+                return
+
+            for child in choice:
+                if best is not None and deadline is not None and time.perf_counter() > deadline:
+                    self.timed_out = True
+                    return
+                added = self._cost(self._forced_mask(child) & ~selected)
+                if best is not None and cost + added >= best_cost:
+                    break  # Children are sorted by cost, the remaining ones can't be better
+                search(*self._select(selected, open_or_nodes, child))
+
+        search(*self._start(roots))
+
+        return self._to_nodes(best)
+
+    def iter_solutions(self, roots: [str], deadline: Optional[float] = None) -> Iterator[Set[str]]:
+        """
+        Best-first search over the 'or' choices. Partial choices are expanded in order of their lower bound, so
+        complete solutions come out in order of increasing size and the next one is only searched for when it is asked
+        for.
+        :param roots: Required course nodes. Nodes that are not in the graph are ignored.
+        :param deadline: A time.perf_counter() value. The generator stops once it has passed.
+        :return: A generator of node sets that satisfy all requirements of the roots, smallest first.
+        """
+        counter = itertools.count()
+
+        def push(selected, or_nodes, depth):
+            choice, lower_bound, open_or_nodes = self._branch(selected, or_nodes)
+            heapq.heappush(heap, (self._cost(selected) + lower_bound, depth, next(counter), selected, choice, open_or_nodes))
+
+        heap = []
+        push(*self._start(roots), 0)
+        expanded = set()
+        while len(heap) > 0:
+            if deadline is not None and time.perf_counter() > deadline:
+                return
+            _, depth, _, selected, choice, or_nodes = heapq.heappop(heap)
+
+            # Different choices can lead to the same nodes
+            if selected in expanded:
+                continue
+            expanded.add(selected)
+
+            if choice is None:
+                yield self._to_nodes(selected)
+                continue
+
+            for child in choice:
+                push(*self._select(selected, or_nodes, child), depth - 1)
+
+
+def create_schedule(course_repo: CourseIndex, required_courses: [str], max_courses_per_quarter: int = 4, completed_courses: Optional[List[str]] = None, closure_index=None, deadline_ms: Optional[float] = None, info: Optional[dict] = None, metrics: Optional[dict] = None):
     """
     ALGO:
     1) Create graph of all courses and their dependencies.
     2) Find all leaf nodes. (courses with no prerequisites)
     3) Find all root nodes. (courses with no incoming edges)
-    4) Find all paths from all root nodes to all leaf nodes.
-    5) Filter these paths so that only those that contain all required courses
-    remain.
-    6) Choose the shortest one of these paths
-    8) Remove all nodes from the graph that are not in the shortest path
+    4) Find the smallest set of nodes that contains all required courses and
+    satisfies all of their requirements, picking one branch of every 'or' node.
+    (See AndOrSolver)
+    8) Remove all nodes from the graph that are not in this set
     9) Remove all intermediate 'or' nodes so that we are left with a simple DAG
     of course nodes.
     10) Run a topological sort to create a schedule
+    :param course_repo: A CourseIndex (or a plain list of courses).
     :param required_courses:
     :param max_courses_per_quarter:
     :param completed_courses:
+    :param closure_index: Optional ClosureIndex of the catalog, passed on to create_graph.
+    :param deadline_ms: If given, spend up to this many milliseconds looking for the schedule with the fewest quarters
+    (see optimize_schedule) and return the best one found in that time.
+    :param info: If given, info['optimal'] is set to True if the schedule is known to have the fewest quarters possible,
+    and info['deadline_reached'] to True if the search was stopped by the deadline, so the schedule is only the best one
+    found in time.
+    :param metrics: If given, the wall time of each phase ('time_ms'), the size of the graph and search and the prerequisite
+    cycles of the graph ('cycles') are recorded in this dictionary. Nothing is measured otherwise.
     :return:
     """
+    deadline = None if deadline_ms is None else time.perf_counter() + deadline_ms / 1000
+
     if completed_courses is None:
         completed_courses = []
 
-    # Remove completed courses from the required courses
-    for course in completed_courses:
-        if course in required_courses:
-            required_courses.remove(course)
+    if isinstance(course_repo, list):
+        course_repo = CourseIndex(course_repo)
+
+    # Remove completed courses (and courses that are cross-listed with them) from the required courses
+    satisfied_courses = get_satisfied_courses(course_repo, completed_courses)
+    required_courses = [x for x in required_courses if x not in satisfied_courses]
+
+    if metrics is not None:
+        start = time.perf_counter()
 
     # Create a directed graph of all courses and their prerequisites,
     # corequisites, and prerequisite-or-corequisites
-    graph = create_graph(course_repo, required_courses)
-
-    def maybe_delete_node_and_children(node):
-        for child in [x for x in graph.successors(node)]:
-            maybe_delete_node_and_children(child)
-        if graph.in_degree(node) <= 1:
-            graph.remove_node(node)
+    cycles = [] if metrics is not None else None
+    graph = create_graph(course_repo, required_courses, closure_index=closure_index, cycles=cycles)
+    if metrics is not None:
+        start = _record_phase(metrics, 'graph', start)
+        metrics['graph_nodes'] = graph.number_of_nodes()
+        metrics['graph_edges'] = graph.number_of_edges()
+        metrics['cycles'] = cycles
+        start = time.perf_counter()
 
     # Remove completed courses from the graph
-    for course in completed_courses:
-        parents = [x for x in graph.predecessors(course)]
-        for parent in parents:
-            if parent.startswith('or'):
+    remove_completed_courses(graph, completed_courses, required_courses, course_repo)
+    if metrics is not None:
+        _record_phase(metrics, 'prune', start)
+        metrics['nodes'] = graph.number_of_nodes()
+        metrics['edges'] = graph.number_of_edges()
+        metrics['combinations'] = count_combinations(graph, required_courses)
+        metrics['product'] = 1
+        for count in metrics['combinations'].values():
+            metrics['product'] *= count
+        start = time.perf_counter()
+
+    best_path = AndOrSolver(graph).solve(required_courses, deadline)
+    if metrics is not None:
+        start = _record_phase(metrics, 'solve', start)
+        metrics['courses'] = sum(1 for x in best_path if not x.startswith('or'))
+
+    if deadline is not None:
+        schedule, optimal = optimize_schedule(graph, required_courses, best_path, max_courses_per_quarter, deadline)
+        if metrics is not None:
+            _record_phase(metrics, 'optimize', start)
+        if info is not None:
+            info['optimal'] = optimal
+            info['deadline_reached'] = not optimal  # The search only stops early at the deadline
+        return schedule
+
+    # Collapse the 'or' nodes and schedule the remaining courses
+    dag = get_course_set_dag(graph, best_path)
+    if metrics is not None:
+        start = _record_phase(metrics, 'collapse', start)
+    schedule = create_schedule_from_dag(dag, max_courses_per_quarter)
+    if metrics is not None:
+        _record_phase(metrics, 'schedule', start)
+
+    if info is not None:
+        info['optimal'] = len(schedule) <= get_min_quarters(graph, required_courses)
+        info['deadline_reached'] = False
+    return schedule
 
-                # Get children of this 'or' node
-                or_children = [x for x in graph.successors(parent)]
 
-                # Delete children if they have no other parents
-                for child in or_children:
-                    maybe_delete_node_and_children(child)
+def _record_phase(metrics: dict, phase: str, start: float) -> float:
+    """
+    Record the wall time of a phase of create_schedule in metrics['time_ms'].
+    :return: The current time.
+    """
+    now = time.perf_counter()
+    metrics.setdefault('time_ms', {})[phase] = (now - start) * 1000
+    return now
 
-                # Delete the 'or' node
-                graph.remove_node(parent)
-                #print('REMOVE:', parent)
 
-            else:
-                maybe_delete_node_and_children(course)
+def count_combinations(graph: CompactGraph, required_courses: [str]) -> dict:
+    """
+    Count the ways to satisfy each required course: the number of combinations of 'or' branches below it. Shared
+    requirements are counted once per path, like a full enumeration of the combinations would. Counts are computed
+    bottom-up with memoization, so this is linear in the size of the graph even when the counts are huge.
+    :return: A dictionary mapping each required course in the graph to its count.
+    """
+    memo = {}
 
-    all_combos = []
-    for course in required_courses:
-        all_combos.append(get_all_combinations(graph, course))
+    def count(node):
+        if node in memo:
+            return memo[node]
+        memo[node] = 1  # Don't follow cycles
 
-    actual_all_combos = []
-    import itertools
-    for x in itertools.product(*all_combos):
-        s = set()
-        for i in x:
-            s.update(i)
-        actual_all_combos.append(s)
+        children = [count(x) for x in graph.successors(node)]
+        if node.startswith('or'):
+            value = sum(children)
+        else:
+            value = 1
+            for x in children:
+                value *= x
+        memo[node] = value
+        return value
 
-    best_path = list(sorted(actual_all_combos, key=lambda x: len(x)))[0]
+    return {x: count(x) for x in required_courses if x in graph}
 
-    # remove nodes not in best path
-    nodes = [x for x in graph.nodes()]
-    for node in nodes:
-        if node not in best_path:
-            graph.remove_node(node)
 
-    # remove useless 'or' nodes
-    nodes = [x for x in graph.nodes()]
-    for node in nodes:
-        if node.startswith('or'):
-            child = next(graph.successors(node))
-            parent = next(graph.predecessors(node))
-            graph.add_edge(parent, child, t='a')
+def iter_schedules(course_repo: CourseIndex, required_courses: [str], max_courses_per_quarter: int = 4, completed_courses: Optional[List[str]] = None, k: Optional[int] = None, closure_index=None) -> Iterator[Tuple[Set[str], list]]:
+    """
+    Create the best schedule and then alternatives to it, lazily. Each alternative picks different branches of 'or'
+    requirements. Asking for the first few plans costs about as much as asking for the best one.
+    :param course_repo: A CourseIndex (or a plain list of courses).
+    :param required_courses:
+    :param max_courses_per_quarter:
+    :param completed_courses:
+    :param k: Stop after this many plans. None for all of them.
+    :param closure_index: Optional ClosureIndex of the catalog, passed on to create_graph.
+    :return: A generator of (course set, schedule) tuples, in order of increasing cost. The first schedule is as good
+    as the one create_schedule returns.
+    """
+    if completed_courses is None:
+        completed_courses = []
+
+    if isinstance(course_repo, list):
+        course_repo = CourseIndex(course_repo)
+
+    satisfied_courses = get_satisfied_courses(course_repo, completed_courses)
+    required_courses = [x for x in required_courses if x not in satisfied_courses]
+    graph = create_graph(course_repo, required_courses, closure_index=closure_index)
+    remove_completed_courses(graph, completed_courses, required_courses, course_repo)
+
+    seen = set()
+    for course_set in AndOrSolver(graph).iter_solutions(required_courses):
+        courses = frozenset(x for x in course_set if not x.startswith('or'))
+        if courses in seen:
+            continue  # Same courses, only through different 'or' nodes
+        seen.add(courses)
+
+        yield set(courses), schedule_course_set(graph, course_set, max_courses_per_quarter)
+
+        if k is not None and len(seen) >= k:
+            return
+
+
+def get_satisfied_courses(course_repo: CourseIndex, completed_courses: [str]) -> Set[str]:
+    """
+    :return: The completed courses and every course that is cross-listed with one of them ("Same as").
+    """
+    satisfied = set(completed_courses)
+    if isinstance(course_repo, CourseIndex):
+        for course_id in completed_courses:
+            satisfied.update(course_repo.equivalents(course_id))
+    return satisfied
+
+
+def get_needed_nodes(graph: CompactGraph, required_courses: [str], satisfied_courses: Set[str]) -> List[str]:
+    """
+    Find the part of a graph that is still needed once some courses are satisfied. Every node and edge is visited at
+    most twice, so this is O(V + E) no matter how many courses are satisfied.
+    :param graph:
+    :param required_courses: The root nodes.
+    :param satisfied_courses: Courses that don't have to be taken (see get_satisfied_courses).
+    :return: The nodes that are reachable from the required courses without going through a satisfied node, in the
+    order they were found.
+    """
+
+    # A satisfied course satisfies every 'or' node above it, and those satisfy the 'or' nodes above them
+    satisfied = set(x for x in satisfied_courses if x in graph)
+    stack = list(satisfied)
+    while len(stack) > 0:
+        node = stack.pop()
+        for parent in graph.predecessors(node):
+            if parent.startswith('or') and parent not in satisfied:
+                satisfied.add(parent)
+                stack.append(parent)
+
+    needed = dict.fromkeys(x for x in required_courses if x in graph and x not in satisfied)
+    stack = list(needed)
+    while len(stack) > 0:
+        node = stack.pop()
+        for child in graph.successors(node):
+            if child not in needed and child not in satisfied:
+                needed[child] = None
+                stack.append(child)
+
+    return list(needed)
+
+
+def remove_completed_courses(graph: CompactGraph, completed_courses: [str], required_courses: [str], course_repo: Optional[CourseIndex] = None):
+    """
+    Remove completed courses from a graph, along with the requirements that they satisfy and every course that is no
+    longer needed by the required courses. Completed courses that are not in the graph are ignored.
+    :param graph:
+    :param completed_courses:
+    :param required_courses:
+    :param course_repo: If given, courses that are cross-listed with a completed course are satisfied too.
+    """
+    needed = set(get_needed_nodes(graph, required_courses, get_satisfied_courses(course_repo, completed_courses)))
+    for node in graph.nodes():
+        if node not in needed:
             graph.remove_node(node)
 
-    # Create schedule from DAG
-    schedule = create_schedule_from_dag(graph.reverse(), max_courses_per_quarter)
 
-    return schedule
+def get_course_set_dag(graph: CompactGraph, course_set: Set[str]) -> CompactGraph:
+    """
+    Turn the nodes of a graph that were picked by AndOrSolver into a graph for create_schedule_from_dag.
+    :param graph: The graph that was solved. It is not modified.
+    :param course_set: The picked nodes.
+    :return: A graph of course nodes where prerequisite edges point from a course to the courses that require it.
+    """
+
+    # remove nodes not in best path
+    graph = graph.subgraph(course_set)
+
+    # Replace every chain of picked 'or' nodes with an edge from the course above it to the course it picked. The edges
+    # are collected first and the 'or' nodes are only tombstoned, so the index of the graph is built once.
+    or_nodes = [x for x in graph.nodes() if x.startswith('or')]
+    edges = []
+    for node in or_nodes:
+        parent = next(graph.predecessors(node))
+        if parent.startswith('or'):
+            continue  # Handled with the 'or' node above it
+        child = next(graph.successors(node))
+        while child.startswith('or'):
+            child = next(graph.successors(child))
+        edges.append((parent, child, graph.edge_type(parent, node)))
+
+    for node in or_nodes:
+        graph.remove_node(node)
+    for parent, child, t in edges:
+        graph.add_edge(parent, child, t=t)
+
+    return graph.reverse()
+
+
+def schedule_course_set(graph: CompactGraph, course_set: Set[str], max_courses_per_quarter: int = 4):
+    """
+    Create a schedule for the nodes of a graph that were picked by AndOrSolver.
+    :param graph: The graph that was solved. It is not modified.
+    :param course_set: The picked nodes.
+    :param max_courses_per_quarter:
+    :return: A list of quarters. Each quarter is a list of course IDs.
+    """
+    return create_schedule_from_dag(get_course_set_dag(graph, course_set), max_courses_per_quarter)
+
+
+def optimize_schedule(graph: CompactGraph, required_courses: [str], course_set: Set[str], max_courses_per_quarter: int = 4, deadline: Optional[float] = None) -> Tuple[list, bool]:
+    """
+    Search for the schedule with the fewest quarters over every way to satisfy the required courses. This is an anytime
+    search: it starts from the schedule of a course set (usually the one AndOrSolver.solve picked), looks for shorter
+    schedules of that set and then of the other course sets (see AndOrSolver.iter_solutions), and can be stopped at
+    any time with the best schedule found so far.
+    :param graph: A graph from create_graph with completed courses removed.
+    :param required_courses:
+    :param course_set: The course set to start from.
+    :param max_courses_per_quarter:
+    :param deadline: A time.perf_counter() value at which to stop.
+    :return: (The schedule, True if no schedule with fewer quarters exists)
+    """
+
+    def get_courses(nodes):
+        return frozenset(x for x in nodes if not x.startswith('or'))
+
+    best, optimal = optimize_schedule_from_dag(get_course_set_dag(graph, course_set), max_courses_per_quarter, deadline)
+    if not optimal:
+        return best, False
+
+    min_quarters = get_min_quarters(graph, required_courses)
+    seen = {get_courses(course_set)}
+    for nodes in AndOrSolver(graph, count_or_nodes=False).iter_solutions(required_courses, deadline):
+        courses = get_courses(nodes)
+
+        # Course sets come out smallest first, so none of the remaining ones can have a shorter schedule either
+        if max(min_quarters, -(-len(courses) // max_courses_per_quarter)) >= len(best):
+            return best, True
+
+        if courses in seen:
+            continue
+        seen.add(courses)
+
+        try:
+            schedule, optimal = optimize_schedule_from_dag(get_course_set_dag(graph, nodes), max_courses_per_quarter, deadline)
+        except ValueError:
+            continue  # The prerequisites of this course set contain a cycle
+        if len(schedule) < len(best):
+            best = schedule
+        if not optimal:
+            return best, False
+
+    # Either every course set was tried or the deadline has passed
+    return best, deadline is None or time.perf_counter() <= deadline
+
+
+class PlanState:
+    """
+    A schedule together with what it was made from, so it can be updated with update_plan as courses are completed.
+    """
+
+    def __init__(self, graph: CompactGraph, required_courses: [str], satisfied: Set[str], course_set: Set[str], max_courses_per_quarter: int, schedule: list):
+        """
+        :param graph: The graph of the required courses. Nodes in satisfied are ignored, so it only ever has to be built
+        once.
+        :param required_courses:
+        :param satisfied: Satisfied course and 'or' nodes of the graph, and the courses that are cross-listed with a
+        completed course.
+        :param course_set: The nodes picked by AndOrSolver.
+        :param max_courses_per_quarter:
+        :param schedule: The schedule of the course set.
+        """
+        self.graph = graph
+        self.required_courses = required_courses
+        self.satisfied = satisfied
+        self.course_set = course_set
+        self.max_courses_per_quarter = max_courses_per_quarter
+        self.schedule = schedule
+
+
+class _PlanGraph:
+    """
+    The part of the graph of a plan that AndOrSolver needs to update it. Satisfied nodes are left out, and 'or' nodes
+    that keep their choice only have the children that were picked before, so the solver never branches on them.
+    """
+
+    def __init__(self, plan: PlanState, satisfied: Set[str], changed_or_nodes: Set[str]):
+        self._plan = plan
+        self._satisfied = satisfied
+        self._changed_or_nodes = changed_or_nodes
+
+    def __contains__(self, node) -> bool:
+        return node in self._plan.graph and node not in self._satisfied
+
+    def successors(self, node, t: Optional[str] = None) -> Iterator[str]:
+        children = (x for x in self._plan.graph.successors(node, t) if x not in self._satisfied)
+        if node.startswith('or') and node in self._plan.course_set and node not in self._changed_or_nodes:
+            return (x for x in children if x in self._plan.course_set)
+        return children
+
+
+def create_plan(course_repo: CourseIndex, required_courses: [str], max_courses_per_quarter: int = 4, completed_courses: Optional[List[str]] = None, closure_index=None) -> PlanState:
+    """
+    Same as create_schedule, but return a PlanState that update_plan can update.
+    """
+    if isinstance(course_repo, list):
+        course_repo = CourseIndex(course_repo)
+
+    satisfied = get_satisfied_courses(course_repo, completed_courses or [])
+    required_courses = [x for x in required_courses if x not in satisfied]
+    graph = create_graph(course_repo, required_courses, closure_index=closure_index)
+    graph = graph.subgraph(get_needed_nodes(graph, required_courses, satisfied))
+
+    course_set = AndOrSolver(graph).solve(required_courses)
+    schedule = schedule_course_set(graph, course_set, max_courses_per_quarter)
+    return PlanState(graph, required_courses, satisfied, course_set, max_courses_per_quarter, schedule)
+
+
+def update_plan(course_repo: CourseIndex, plan: PlanState, completed_courses: [str]) -> PlanState:
+    """
+    Update a plan after more courses were completed (Ex. the first quarter of its schedule), without building the graph
+    again. Only the 'or' nodes of the course set that have a newly completed course somewhere below them are solved
+    again, every other 'or' node keeps the branch it had, so the search only grows with the part of the plan that the
+    completed courses affect.
+    :param course_repo: A CourseIndex.
+    :param plan: A plan from create_plan or update_plan. It is not modified.
+    :param completed_courses: The courses completed since the plan was made.
+    :return: The new plan.
+    """
+    graph = plan.graph
+    changed = [x for x in get_satisfied_courses(course_repo, completed_courses) if x in graph and x not in plan.satisfied]
+    satisfied = plan.satisfied | get_satisfied_courses(course_repo, completed_courses)
+
+    # Same as get_needed_nodes, but only above the completed courses
+    stack = list(changed)
+    while len(stack) > 0:
+        node = stack.pop()
+        for parent in graph.predecessors(node):
+            if parent.startswith('or') and parent not in satisfied:
+                satisfied.add(parent)
+                stack.append(parent)
+
+    # Every 'or' node above a completed course may have a cheaper branch now
+    above = set(changed)
+    stack = list(changed)
+    while len(stack) > 0:
+        node = stack.pop()
+        for parent in graph.predecessors(node):
+            if parent not in above:
+                above.add(parent)
+                stack.append(parent)
+    changed_or_nodes = set(x for x in above if x.startswith('or') and x in plan.course_set)
+
+    required_courses = [x for x in plan.required_courses if x not in satisfied]
+    if len(changed) == 0:
+        course_set = plan.course_set
+    else:
+        course_set = AndOrSolver(_PlanGraph(plan, satisfied, changed_or_nodes)).solve(required_courses)
+    schedule = schedule_course_set(graph, course_set, plan.max_courses_per_quarter)
+    return PlanState(graph, required_courses, satisfied, course_set, plan.max_courses_per_quarter, schedule)
+
+
+def _request_key(request: dict):
+    return (
+        tuple(request['required_courses']),
+        tuple(sorted(request.get('completed_courses') or [])),
+        request.get('max_courses_per_quarter', 4)
+    )
+
+
+def create_schedules_batch(course_repo: CourseIndex, requests: List[dict], processes: Optional[int] = None, closure_index=None) -> List[Union[list, dict]]:
+    """
+    Create schedules for many students at once. The results are the same as calling create_schedule once per request,
+    but the work for courses that requests have in common is only done once: one prerequisite graph is built for the
+    union of all required courses, solver results for shared parts of the graph are reused, and identical requests are
+    only solved once.
+    :param course_repo: A CourseIndex (or a plain list of courses).
+    :param requests: A list of dictionaries with the arguments of create_schedule: 'required_courses' and optionally
+    'max_courses_per_quarter' and 'completed_courses'.
+    :param processes: If more than 1, spread the requests over this many processes.
+    :param closure_index: Optional ClosureIndex of the catalog, passed on to create_graph.
+    :return: A list of schedules, one for each request. A request that create_schedule would fail on (Ex. its
+    prerequisites contain a cycle) gets {'error': str} instead, the other requests are still scheduled.
+    """
+    if isinstance(course_repo, list):
+        course_repo = CourseIndex(course_repo)
+
+    if processes is not None and processes > 1 and len(requests) > 1:
+        # Keep identical requests together so that they are still only solved once
+        order = sorted(range(len(requests)), key=lambda i: _request_key(requests[i]))
+        chunk_size = -(-len(requests) // processes)
+        chunks = [[requests[i] for i in order[j:j + chunk_size]] for j in range(0, len(order), chunk_size)]
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(processes) as executor:
+            results = executor.map(create_schedules_batch, [course_repo] * len(chunks), chunks, [None] * len(chunks), [closure_index] * len(chunks))
+            results = [schedule for chunk in results for schedule in chunk]
+
+        schedules = [None] * len(requests)
+        for i, schedule in zip(order, results):
+            schedules[i] = schedule
+        return schedules
+
+    # One graph for every required course. Each course's requirements are parsed once, so the part of this graph that
+    # is reachable from a request's required courses is the same graph create_schedule would build for it.
+    all_required = {}
+    satisfied = {}
+    for request in requests:
+        completed = tuple(sorted(request.get('completed_courses') or []))
+        if completed not in satisfied:
+            satisfied[completed] = get_satisfied_courses(course_repo, completed)
+        all_required.update(dict.fromkeys(x for x in request['required_courses'] if x not in satisfied[completed]))
+    shared_graph = create_graph(course_repo, list(all_required), closure_index=closure_index)
+    shared_solver = AndOrSolver(shared_graph)
+
+    schedules = []
+    cache = {}
+    for request in requests:
+        key = _request_key(request)
+        if key not in cache:
+            required_courses, completed_courses, max_courses_per_quarter = key
+            try:
+                if len(completed_courses) > 0:
+                    # Pruning completed courses gives the same graph as the one create_schedule would prune, but the
+                    # solver's results for the shared graph no longer apply to it
+                    satisfied_courses = satisfied[completed_courses]
+                    required_courses = [x for x in required_courses if x not in satisfied_courses]
+                    graph = shared_graph.subgraph(get_needed_nodes(shared_graph, required_courses, satisfied_courses))
+                    best_path = AndOrSolver(graph).solve(required_courses)
+                    cache[key] = schedule_course_set(graph, best_path, max_courses_per_quarter)
+                else:
+                    best_path = shared_solver.solve(list(required_courses))
+                    cache[key] = schedule_course_set(shared_graph, best_path, max_courses_per_quarter)
+            except Exception as error:
+                # One student's bad request must not cost everyone else their schedule
+                cache[key] = {'error': f'{type(error).__name__}: {error}'}
+        schedules.append(copy.deepcopy(cache[key]))
+
+    return schedules
 
 
 def get_course(course_id, courses):
+    if isinstance(courses, CourseIndex):
+        return courses.get(course_id)
     s = course_id.split()
     d = ' '.join(s[:-1])
     n = s[-1]
@@ -219,119 +1041,321 @@ def get_course(course_id, courses):
     return None
 
 
-def create_graph(course_repo, courses: [str]) -> nx.DiGraph:
+def create_graph(course_repo: CourseIndex, courses: [str], closure_index=None, cycles: Optional[list] = None) -> CompactGraph:
+    """
+    Create a directed graph of the given courses and all of their prerequisites and corequisites.
+    :param course_repo: A CourseIndex. A plain list of courses is also accepted but it will be indexed on every call.
+    :param courses: A list of course IDs.
+    :param closure_index: Optional ClosureIndex of the catalog. If given, every course that may be needed is known up
+    front and the graph is built without following prerequisites course by course.
+    :param cycles: If given, the prerequisite cycles of the graph (see find_prerequisite_cycles) are added to this list.
+    :return:
+    """
+    if isinstance(course_repo, list):
+        course_repo = CourseIndex(course_repo)
 
-    graph = nx.DiGraph()
+    graph = CompactGraph()
 
     or_index = 0
 
-    for course in courses:
-        if course in graph:
-            continue
-
-        c = get_course(course, course_repo)
+    def parse(p, parent, t='a'):
+        nonlocal or_index
+        if isinstance(p, str):
+            is_new = p not in graph
+            graph.add_edge(parent, p, t=t)
+            if is_new and closure_index is None:
+                add_requirements(p)
+        elif isinstance(p, list):
+            if p[0] == 'or':
+                oi = f'or-{or_index}'
+                or_index += 1
+                graph.add_edge(parent, oi, t=t)
+                for cc in p[1]:
+                    parse(cc, oi, t='a')
+            elif p[0] == 'and':
+                for cc in p[1]:
+                    parse(cc, parent, t=t)
+
+    def add_requirements(course):
+        c = course_repo.get(course)
         if c is None:
-            continue
-
-        def parse(p, parent, t='a'):
-            nonlocal or_index
-            if isinstance(p, str):
-                if p in graph:
-                    graph.add_edge(parent, p, t=t)
-                    return
-
-                graph.add_edge(parent, p, t=t)
-
-                cc = get_course(p, course_repo)
-                if cc is not None and 'prerequisite_courses' in cc:
-                    parse(cc['prerequisite_courses'], p, 'a')
-                if cc is not None and 'corequisite_courses' in cc:
-                    parse(cc['corequisite_courses'], p, 'b')
-            elif isinstance(p, list):
-                if p[0] == 'or':
-                    oi = f'or-{or_index}'
-                    or_index += 1
-                    graph.add_edge(parent, oi, t=t)
-                    for cc in p[1]:
-                        parse(cc, oi, t='a')
-                elif p[0] == 'and':
-                    for cc in p[1]:
-                        parse(cc, parent, t='a')
+            return
 
         # Prerequisites
         if 'prerequisite_courses' in c:
-            pc = c['prerequisite_courses']
-            parse(pc, course)
+            parse(c['prerequisite_courses'], course)
 
         # Corequisites
         if 'corequisite_courses' in c:
-            coro = c['corequisite_courses']
-            parse(coro, course, t='b')
+            parse(c['corequisite_courses'], course, t='b')
+
+    if closure_index is None:
+        for course in courses:
+            if course in graph:
+                continue
+            add_requirements(course)
+    else:
+        for course in closure_index.closure_of(courses):
+            add_requirements(course)
 
     for course in courses:
         if course not in graph:
             graph.add_node(course)
 
+    if cycles is not None:
+        cycles.extend(find_prerequisite_cycles(graph))
+
     return graph
 
 
-def create_schedule_from_dag(graph: nx.DiGraph, max_courses_per_quarter: int = 4):
+def get_corequisite_groups(graph) -> List[List[str]]:
+    """
+    Group nodes that are connected by corequisite ('b') edges. Courses in a group have to be taken in the same quarter.
+    :return: A list of groups sorted by their first node. Each group is a sorted list of nodes.
+    """
+    parent = {node: node for node in graph.nodes()}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for src, dst, t in graph.typed_edges():
+        if t == 'b':
+            parent[find(dst)] = find(src)
+
+    groups = {}
+    for node in sorted(graph.nodes()):
+        groups.setdefault(find(node), []).append(node)
+    return sorted(groups.values())
+
+
+def _get_group_dag(graph: CompactGraph, max_courses_per_quarter: int):
+    """
+    Contract the corequisite groups of a graph for create_schedule_from_dag.
+    :return: (groups, dependents of each group, number of prerequisites of each group, length of the longest chain of
+    groups that depend on each group)
+    """
+    groups = get_corequisite_groups(graph)
+    group_of = {}
+    for i, group in enumerate(groups):
+        if len(group) > max_courses_per_quarter:
+            raise ValueError(f'Cannot create a schedule: the corequisites {", ".join(group)} have to be taken in the same '
+                             f'quarter, but only {max_courses_per_quarter} courses fit in a quarter')
+        for node in group:
+            group_of[node] = i
+
+    # Count prerequisites of every group
+    in_degree = [0] * len(groups)
+    dependents = [[] for _ in groups]
+    for src, dst, t in graph.typed_edges():
+        if t == 'a' and group_of[src] != group_of[dst]:
+            in_degree[group_of[dst]] += 1
+            dependents[group_of[src]].append(group_of[dst])
+
+    # Find a topological order to compute the longest chain of groups that depend on each group
+    order = [i for i in range(len(groups)) if in_degree[i] == 0]
+    remaining = list(in_degree)
+    for i in order:
+        for d in dependents[i]:
+            remaining[d] -= 1
+            if remaining[d] == 0:
+                order.append(d)
+    if len(order) < len(groups):
+        # The cycle may only exist between groups (Ex. A before B before C, but A and C are corequisites), so look for
+        # it in the graph of groups and name the courses of its groups
+        group_graph = CompactGraph()
+        for i in range(len(groups)):
+            group_graph.add_node(i)
+        for i, group_dependents in enumerate(dependents):
+            for d in group_dependents:
+                group_graph.add_edge(i, d, t='a')
+        cycle = min(
+            sorted(course for i in component for course in groups[i])
+            for component in get_strongly_connected_components(group_graph) if len(component) > 1
+        )
+        raise ValueError(f'Cannot create a schedule: the prerequisites contain a cycle ({", ".join(cycle)})')
+
+    chain_length = [0] * len(groups)
+    for i in reversed(order):
+        for d in dependents[i]:
+            chain_length[i] = max(chain_length[i], chain_length[d] + 1)
+
+    return groups, dependents, in_degree, chain_length
+
+
+def create_schedule_from_dag(graph: CompactGraph, max_courses_per_quarter: int = 4):
+    """
+    Create a schedule from a graph where prerequisite ('a') edges point from a course to the courses that require it.
+    Courses connected by corequisite ('b') edges are taken in the same quarter.
+
+    Kahn's algorithm on the corequisite groups: a group becomes available once all of its prerequisites were taken in
+    an earlier quarter. Every quarter is filled greedily with the available groups that have the longest chain of
+    courses waiting on them, so that bottleneck courses are taken first. Ties are broken by course ID, so the result
+    does not depend on the order of nodes in the graph.
+    :param graph: The graph (a networkx.DiGraph works too). It is not modified.
+    :param max_courses_per_quarter:
+    :return: A list of quarters. Each quarter is a list of course IDs.
+    """
+    if not isinstance(graph, CompactGraph):
+        graph = CompactGraph.from_networkx(graph)
+
+    groups, dependents, in_degree, chain_length = _get_group_dag(graph, max_courses_per_quarter)
+
+    available = [(-chain_length[i], i) for i in range(len(groups)) if in_degree[i] == 0]
+    heapq.heapify(available)
+
     schedule = []
-    quarter_index = -1
-
-    available = []
-    while graph.number_of_nodes() > 0:
-
-        # Start a new quarter
-        schedule.append([])
-        quarter_index += 1
-
-        # Get available courses
-        for node in graph.nodes():
-            children = pred_with_atr(graph, node, {'t': 'a'})
-            if len(children) == 0:
-                available.append(node)
-
-        skip = []
-        while len(available) > 0 and not all([x in skip for x in available]):
-            if len(schedule[quarter_index]) < max_courses_per_quarter:
-                node = available.pop()
-                if node not in graph:
-                    continue
-
-                # Check if this course has prerequisites
-                children = succ_with_atr(graph, node, {'t': 'b'})
-
-                # Can we take all children?
-                should_skip = False
-                for child in children:
-                    if child not in available:
-                        should_skip = True
-                        break
-                if should_skip:
-                    skip.append(node)
-                    continue
-
-                # Can we fit all prerequisites in this quarter?
-                if len(schedule[quarter_index]) + 1 + len(children) > max_courses_per_quarter:
-                    # we need to start a new quarter
-                    schedule.append([])
-                    quarter_index += 1
-                    assert 1 + len(children) <= max_courses_per_quarter  # cant have more corequisites that fit in one quarter
-
-                for child in children:
-                    schedule[quarter_index].append(child)
-                    graph.remove_node(child)
-                schedule[quarter_index].append(node)
-                graph.remove_node(node)
-            else:
-                break
+    while len(available) > 0:
+        quarter = []
+        deferred = []
+        unlocked = []
+        while len(available) > 0 and len(quarter) < max_courses_per_quarter:
+            item = heapq.heappop(available)
+            group = groups[item[1]]
+
+            # Not enough room left in this quarter for all corequisites
+            if len(quarter) + len(group) > max_courses_per_quarter:
+                deferred.append(item)
+                continue
+
+            quarter.extend(group)
+            for d in dependents[item[1]]:
+                in_degree[d] -= 1
+                if in_degree[d] == 0:
+                    unlocked.append((-chain_length[d], d))
+
+        # Courses unlocked this quarter can be taken starting next quarter
+        for item in deferred + unlocked:
+            heapq.heappush(available, item)
+
+        schedule.append(quarter)
 
     return schedule
 
 
+def _fill_quarter(available: List[int], sizes: List[int], max_courses_per_quarter: int) -> Iterator[List[int]]:
+    """
+    Generate the ways to fill a quarter with available groups so that none of the other available groups would still
+    fit. Taking an available group later never makes a schedule shorter, so the other ways don't need to be tried.
+    :param available: Group indices, highest priority first.
+    :return: A generator of lists of group indices. Combinations with higher priority groups come first.
+    """
+
+    def extend(i, chosen, size):
+        if i == len(available):
+            if all(size + sizes[g] > max_courses_per_quarter for g in available if g not in chosen):
+                yield list(chosen)
+            return
+        g = available[i]
+        if size + sizes[g] <= max_courses_per_quarter:
+            chosen.append(g)
+            yield from extend(i + 1, chosen, size + sizes[g])
+            chosen.pop()
+        yield from extend(i + 1, chosen, size)
+
+    return extend(0, [], 0)
+
+
+def optimize_schedule_from_dag(graph: CompactGraph, max_courses_per_quarter: int = 4, deadline: Optional[float] = None) -> Tuple[list, bool]:
+    """
+    Search for the schedule with the fewest quarters. Starts from the schedule of create_schedule_from_dag and then
+    does a branch-and-bound search over which available groups are taken in each quarter. A branch is pruned when the
+    quarters so far plus the longest chain of courses left (or the courses left divided by max_courses_per_quarter)
+    can't beat the best schedule found so far.
+    :param graph: Same as for create_schedule_from_dag.
+    :param max_courses_per_quarter:
+    :param deadline: A time.perf_counter() value at which to stop and return the best schedule found so far.
+    :return: (The schedule, True if no schedule with fewer quarters exists)
+    """
+    if not isinstance(graph, CompactGraph):
+        graph = CompactGraph.from_networkx(graph)
+
+    best = create_schedule_from_dag(graph, max_courses_per_quarter)
+    groups, dependents, in_degree, chain_length = _get_group_dag(graph, max_courses_per_quarter)
+    sizes = [len(x) for x in groups]
+    reached = {}  # Bitset of taken groups -> fewest quarters it was reached in
+    timed_out = False
+
+    def search(taken: int, plan: List[List[int]], degree: List[int]):
+        nonlocal best, timed_out
+
+        left = [i for i in range(len(groups)) if not (taken >> i) & 1]
+        if len(left) == 0:
+            if len(plan) < len(best):
+                best = [[course for g in quarter for course in groups[g]] for quarter in plan]
+            return
+
+        if deadline is not None and time.perf_counter() > deadline:
+            timed_out = True
+            return
+
+        lower_bound = max(
+            max(chain_length[i] for i in left) + 1,
+            -(-sum(sizes[i] for i in left) // max_courses_per_quarter)
+        )
+        if len(plan) + lower_bound >= len(best) or reached.get(taken, len(plan) + 1) <= len(plan):
+            return
+        reached[taken] = len(plan)
+
+        available = sorted((i for i in left if degree[i] == 0), key=lambda i: (-chain_length[i], i))
+        for quarter in _fill_quarter(available, sizes, max_courses_per_quarter):
+            next_degree = list(degree)
+            next_taken = taken
+            for g in quarter:
+                next_taken |= 1 << g
+                for d in dependents[g]:
+                    next_degree[d] -= 1
+            search(next_taken, plan + [quarter], next_degree)
+            if timed_out:
+                return
+
+    search(0, [], in_degree)
+
+    return best, not timed_out
+
+
+def get_min_quarters(graph: CompactGraph, required_courses: [str]) -> int:
+    """
+    Get a lower bound for the number of quarters of any schedule for the required courses: the length of the longest
+    prerequisite chain, picking the shortest branch of every 'or' node.
+    """
+    group_of = {}
+    for i, group in enumerate(get_corequisite_groups(graph)):
+        for node in group:
+            group_of[node] = i
+
+    memo = {}
+
+    def length(node):
+        if node in memo:
+            return memo[node]
+        memo[node] = 0  # Cycles don't make the bound any longer
+
+        if node.startswith('or'):
+            value = min((length(x) for x in graph.successors(node)), default=0)
+        else:
+            value = 1
+            for child in graph.successors(node):
+                # 'or' nodes become edges of the type of the edge to them once they are collapsed (see
+                # get_course_set_dag). Prerequisites in the same corequisite group might end up in the same quarter.
+                t = graph.edge_type(node, child)
+                if t == 'a' and group_of.get(node, node) != group_of.get(child, child):
+                    value = max(value, length(child) + 1)
+                else:
+                    value = max(value, length(child))
+        memo[node] = value
+        return value
+
+    return max((length(x) for x in required_courses if x in graph), default=0)
+
+
 def show_graph(graph):
     import matplotlib.pyplot as plt
+    import networkx as nx
+    if isinstance(graph, CompactGraph):
+        graph = graph.to_networkx()
     pos = nx.spring_layout(graph, k=0.15, iterations=20)
     nx.draw_networkx_labels(graph, pos)
     color_map = {'a': 'red', 'b': 'blue'}
@@ -0,0 +1,249 @@
+"""
+Synthetic course catalogs for stress testing the scheduler.
+
+The courses have the same format as the output of CatalogParser.get_courses: prerequisite and corequisite trees of
+course IDs, ['or', [...]] and ['and', [...]] lists, and 'equivalent' lists for cross-listed courses. Every course is
+given a level and only requires courses of lower levels, so the prerequisites form a DAG, except for the cycles that
+are planted on purpose. The same arguments and seed always give the same catalog.
+
+Write one from the scheduler directory:
+
+    python synthetic_catalog.py --courses 100000 --seed 1 synthetic_catalog.json
+"""
+import argparse
+import copy
+import json
+import random
+from typing import List
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def generate_department_code(index: int) -> str:
+    """
+    :return: The code of the department with this index (Ex. "SYN A", "SYN B", ..., "SYN AA").
+    """
+    code = ''
+    while True:
+        code = LETTERS[index % len(LETTERS)] + code
+        index = index // len(LETTERS) - 1
+        if index < 0:
+            return 'SYN ' + code
+
+
+def generate_catalog(
+        course_count: int = 5000,
+        department_size: int = 40,
+        depth: int = 6,
+        prerequisite_probability: float = 0.5,
+        max_prerequisites: int = 3,
+        or_probability: float = 0.4,
+        or_fan_out: int = 3,
+        and_in_or_probability: float = 0.1,
+        corequisite_density: float = 0.03,
+        equivalent_density: float = 0.1,
+        corequisite_cycles: int = 0,
+        prerequisite_cycles: int = 0,
+        seed: int = 0) -> List[dict]:
+    """
+    Generate a catalog.
+    :param course_count: Number of courses, including cross-listed copies.
+    :param department_size: Average number of courses per department.
+    :param depth: Length of the longest possible prerequisite chain.
+    :param prerequisite_probability: Chance that a course above the lowest level has prerequisites.
+    :param max_prerequisites: Most requirements in the top-level 'and' of a prerequisite tree.
+    :param or_probability: Chance that a requirement is an 'or' of several courses instead of a single course.
+    :param or_fan_out: Most branches of an 'or'.
+    :param and_in_or_probability: Chance that a branch of an 'or' is an 'and' of two courses.
+    :param corequisite_density: Fraction of courses with a corequisite. Each corequisite is a different course without
+    prerequisites of its own at the same level, so corequisite groups always fit in a quarter.
+    :param equivalent_density: Fraction of courses that get a cross-listed copy in another department.
+    :param corequisite_cycles: Number of pairs of courses that are corequisites of each other (see
+    test_scheduler_cycle).
+    :param prerequisite_cycles: Number of courses that get one of the courses that require them as an alternative
+    prerequisite ('or' branch), creating a prerequisite cycle. Requests that end up picking that branch can't be
+    scheduled.
+    :param seed:
+    :return: A list of courses.
+    """
+    rng = random.Random(seed)
+
+    originals = max(1, round(course_count / (1 + equivalent_density)))
+    department_count = max(1, originals // department_size)
+    departments = [generate_department_code(i) for i in range(department_count)]
+
+    # Lay out the courses
+    courses = []
+    levels = {}
+    by_level = [[] for _ in range(depth + 1)]
+    by_department_level = {}
+
+    def add_course(course, level):
+        course_id = f'{course["department_code"]} {course["number"]}'
+        levels[course_id] = level
+        by_department_level.setdefault((course['department_code'], level), []).append(course_id)
+        return course_id
+
+    def number(department, level):
+        # Unique within the department: the level, then a letter and a counter (Ex. "3B0")
+        index = len(by_department_level.get((department, level), []))
+        return f'{level}{LETTERS[index % len(LETTERS)]}{index // len(LETTERS)}'
+
+    for i in range(originals):
+        department = departments[rng.randrange(department_count)]
+        level = rng.randint(0, depth)
+        course = {
+            'department_code': department,
+            'department_name': f'Synthetic {department[4:]}',
+            'number': number(department, level),
+            'title': f'Synthetic Course {i}',
+            'units': str(rng.choice([2, 4, 4, 4, 5])),
+            'description': 'Generated.',
+        }
+        courses.append(course)
+        by_level[level].append(add_course(course, level))
+
+    def pick(department, level):
+        # Mostly courses of the same department, like real prerequisite chains
+        candidates = by_department_level.get((department, level))
+        if candidates is None or rng.random() < 0.2:
+            candidates = by_level[level]
+        if len(candidates) == 0:
+            return None
+        return rng.choice(candidates)
+
+    def pick_below(department, level):
+        lower = [x for x in range(level) if len(by_level[x]) > 0]
+        return pick(department, rng.choice(lower)) if len(lower) > 0 else None
+
+    def make_requirement(department, level, first):
+        # The first requirement comes from the level right below, so that chains reach the full depth
+        choose = (lambda: pick(department, level - 1)) if first else (lambda: pick_below(department, level))
+        if rng.random() >= or_probability:
+            return choose()
+
+        branches = []
+        for _ in range(rng.randint(2, max(2, or_fan_out))):
+            if rng.random() < and_in_or_probability:
+                branch = ['and', list(dict.fromkeys(x for x in [choose(), pick_below(department, level)] if x is not None))]
+                if len(branch[1]) == 1:
+                    branch = branch[1][0]
+            else:
+                branch = choose()
+            if branch is not None and branch not in branches:
+                branches.append(branch)
+        if len(branches) == 1:
+            return branches[0]
+        return ['or', branches] if len(branches) > 1 else None
+
+    for course in courses:
+        department = course['department_code']
+        level = levels[f'{department} {course["number"]}']
+        if level == 0 or rng.random() >= prerequisite_probability:
+            continue
+
+        requirements = []
+        for j in range(rng.randint(1, max(1, max_prerequisites))):
+            requirement = make_requirement(department, level, j == 0)
+            if requirement is not None and requirement not in requirements:
+                requirements.append(requirement)
+        if len(requirements) == 1:
+            course['prerequisite_courses'] = requirements[0]
+        elif len(requirements) > 1:
+            course['prerequisite_courses'] = ['and', requirements]
+
+    course_by_id = {f'{c["department_code"]} {c["number"]}': c for c in courses}
+
+    # Corequisites pair a course with a different course that has no requirements of its own
+    used = set()
+    for course_id in list(course_by_id):
+        course = course_by_id[course_id]
+        if course_id in used or rng.random() >= corequisite_density:
+            continue
+        candidates = by_department_level.get((course['department_code'], levels[course_id]), [])
+        candidates = [
+            x for x in candidates
+            if x != course_id and x not in used and 'prerequisite_courses' not in course_by_id[x]
+        ]
+        if len(candidates) == 0:
+            continue
+        partner = rng.choice(candidates)
+        course['corequisite_courses'] = partner
+        used.update([course_id, partner])
+
+    for _ in range(corequisite_cycles):
+        candidates = [x for x in course_by_id if x not in used and 'corequisite_courses' not in course_by_id[x]]
+        if len(candidates) < 2:
+            break
+        a, b = rng.sample(candidates, 2)
+        course_by_id[a]['corequisite_courses'] = b
+        course_by_id[b]['corequisite_courses'] = a
+        used.update([a, b])
+
+    # A course that is required by another course accepts that course as a prerequisite instead
+    required_by = {}
+    for course_id, course in course_by_id.items():
+        tree = course.get('prerequisite_courses')
+        for child in ([tree] if isinstance(tree, str) else []):
+            required_by.setdefault(child, []).append(course_id)
+    candidates = sorted(x for x in required_by if x in course_by_id)
+    for course_id in rng.sample(candidates, min(prerequisite_cycles, len(candidates))):
+        dependent = rng.choice(required_by[course_id])
+        course = course_by_id[course_id]
+        alternatives = [dependent]
+        if 'prerequisite_courses' in course:
+            alternatives.insert(0, course['prerequisite_courses'])
+        course['prerequisite_courses'] = ['or', alternatives] if len(alternatives) > 1 else dependent
+
+    # Cross-listed copies in another department, with the same requirements
+    copies = []
+    for course in courses:
+        if len(courses) + len(copies) >= course_count or rng.random() >= equivalent_density:
+            continue
+        course_id = f'{course["department_code"]} {course["number"]}'
+        department = departments[rng.randrange(department_count)]
+        twin = copy.deepcopy(course)
+        twin['department_code'] = department
+        twin['department_name'] = f'Synthetic {department[4:]}'
+        twin['number'] = number(department, levels[course_id])
+        twin_id = add_course(twin, levels[course_id])
+
+        twin['equivalent'] = [course_id] + [x for x in course.get('equivalent', [])]
+        course.setdefault('equivalent', []).append(twin_id)
+        copies.append(twin)
+
+    return courses + copies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic course catalog.')
+    parser.add_argument('output', help='Path of the catalog JSON file to write.')
+    parser.add_argument('--courses', type=int, default=5000)
+    parser.add_argument('--department-size', type=int, default=40)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--or-fan-out', type=int, default=3)
+    parser.add_argument('--corequisite-density', type=float, default=0.03)
+    parser.add_argument('--equivalent-density', type=float, default=0.1)
+    parser.add_argument('--corequisite-cycles', type=int, default=0)
+    parser.add_argument('--prerequisite-cycles', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    catalog = generate_catalog(
+        course_count=args.courses,
+        department_size=args.department_size,
+        depth=args.depth,
+        or_fan_out=args.or_fan_out,
+        corequisite_density=args.corequisite_density,
+        equivalent_density=args.equivalent_density,
+        corequisite_cycles=args.corequisite_cycles,
+        prerequisite_cycles=args.prerequisite_cycles,
+        seed=args.seed
+    )
+    with open(args.output, 'w') as file:
+        json.dump(catalog, file, indent=4)
+    print(f'Saved {len(catalog)} courses to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,24 @@
+import hashlib
+import io
+import itertools
 import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
 import networkx as nx
 
+import benchmark
+import binary_catalog
+import closure_index as closure_index_module
+from compact_graph import CompactGraph
+import create_schedule
 import scheduler
+import synthetic_catalog
 
 
 class TestScheduler(unittest.TestCase):
@@ -30,9 +45,121 @@ class TestScheduler(unittest.TestCase):
                 return
         self.assertFalse(True, f'Expected equality of\nEXPECTED:\n{expected_schedules}\nACTUAL:\n{actual}')
 
+    _course_repo = None
+
     def load_course_repo(self):
-        with open('../catalog_parser/catalog.json') as file:
-            return json.load(file)
+        # Only read the catalog once. The scheduler never modifies it.
+        if TestScheduler._course_repo is None:
+            with open('../catalog_parser/catalog.json') as file:
+                TestScheduler._course_repo = scheduler.CourseIndex(json.load(file))
+        return TestScheduler._course_repo
+
+    def test_course_index(self):
+        course_repo = [
+            {'department_code': 'COMPSCI', 'number': '111', 'title': 'A'},
+            {'department_code': 'I&C SCI', 'number': '46', 'title': 'B', 'equivalent': ['CSE 46']},
+            {'department_code': 'CSE', 'number': '46', 'title': 'C'},
+            {'department_code': 'COMPSCI', 'number': '111', 'title': 'Duplicate'},
+        ]
+        course_index = scheduler.CourseIndex(course_repo)
+
+        self.assertEqual(3, len(course_index))
+        self.assertEqual('A', course_index.get('COMPSCI 111')['title'])
+        self.assertEqual('A', course_index.get(' COMPSCI  111')['title'])
+        self.assertIsNone(course_index.get('COMPSCI 112'))
+        self.assertIs(scheduler.get_course('I&C SCI 46', course_repo), course_index.get('I&C SCI 46'))
+
+        self.assertEqual({'CSE 46'}, course_index.equivalents('I&C SCI 46'))
+        self.assertEqual({'I&C SCI 46'}, course_index.equivalents('CSE 46'))
+        self.assertEqual(set(), course_index.equivalents('COMPSCI 111'))
+
+        course_index = scheduler.CourseIndex(course_repo[:2])
+        self.assertIsNone(course_index.get('CSE 46'))
+        self.assertEqual('B', course_index.resolve('CSE 46')['title'])
+
+    def test_binary_catalog(self):
+        course_repo = [
+            {'department_code': 'COMPSCI', 'number': '111', 'title': 'A', 'prerequisite_courses': ['and', ['I&C SCI 46', ['or', ['MATH 3A', 'CSE 46']]]]},
+            {'department_code': 'I&C SCI', 'number': '46', 'title': 'B', 'equivalent': ['CSE 46'], 'corequisite_courses': 'MATH 3A'},
+            {'department_code': 'MATH', 'number': '3A', 'description': 'Not kept'},
+            {'department_code': 'COMPSCI', 'number': '111', 'title': 'Duplicate'},
+        ]
+        course_index = scheduler.CourseIndex(course_repo)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.bin')
+            binary_catalog.write_binary_catalog(course_repo, path)
+            with create_schedule.load_course_index(path) as catalog:
+                self.assertIsInstance(catalog, binary_catalog.BinaryCatalog)
+                self.assertEqual(3, len(catalog))
+                for course in course_index:
+                    course_id = f'{course["department_code"]} {course["number"]}'
+                    self.assertEqual({k: v for k, v in course.items() if k in ['department_code', 'number', 'prerequisite_courses', 'corequisite_courses']}, catalog.get(course_id))
+                    self.assertEqual(course_index.equivalents(course_id), catalog.equivalents(course_id))
+                self.assertEqual({'I&C SCI 46'}, catalog.equivalents('CSE 46'))
+                self.assertEqual('46', catalog.get(' I&C SCI  46')['number'])
+                self.assertIsNone(catalog.get('CSE 46'))
+                self.assertEqual('46', catalog.resolve('CSE 46')['number'])
+                self.assertEqual(scheduler.create_schedule(course_index, ['COMPSCI 111']), scheduler.create_schedule(catalog, ['COMPSCI 111']))
+
+    def test_binary_catalog_rewrite(self):
+        course_repo = [
+            {'department_code': 'COMPSCI', 'number': '111', 'prerequisite_courses': 'I&C SCI 46'},
+            {'department_code': 'I&C SCI', 'number': '46'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.bin')
+            binary_catalog.write_binary_catalog(course_repo, path)
+            with binary_catalog.BinaryCatalog(path) as catalog:
+                # Rewriting the catalog while it is mapped must not pull the pages out from under the open catalog
+                binary_catalog.write_binary_catalog(course_repo + [{'department_code': 'MATH', 'number': '2A'}], path)
+                self.assertEqual('I&C SCI 46', catalog.get('COMPSCI 111')['prerequisite_courses'])
+                self.assertIsNone(catalog.get('MATH 2A'))
+                self.assertEqual(2, len(catalog))
+            with binary_catalog.BinaryCatalog(path) as catalog:
+                self.assertEqual('2A', catalog.get('MATH 2A')['number'])
+            self.assertEqual(['catalog.bin'], os.listdir(directory))
+
+    def test_compact_graph(self):
+        graph = CompactGraph()
+        graph.add_edge('A', 'B', t='a')
+        graph.add_edge('A', 'C', t='b')
+        graph.add_edge('A', 'D', t='a')
+        graph.add_edge('B', 'D', t='a')
+        graph.add_edge('A', 'B', t='b')  # Replaces the edge type
+        graph.add_node('E')
+
+        self.assertEqual(['A', 'B', 'C', 'D', 'E'], graph.nodes())
+        self.assertEqual(4, graph.number_of_edges())
+        self.assertEqual(['B', 'C', 'D'], list(graph.successors('A')))
+        self.assertEqual(['B', 'C'], list(graph.successors('A', t='b')))
+        self.assertEqual(['A', 'B'], list(graph.predecessors('D', t='a')))
+        self.assertEqual('b', graph.edge_type('A', 'B'))
+
+        reverse = graph.reverse()
+        self.assertEqual(['A'], list(reverse.successors('C')))
+
+        subgraph = graph.subgraph(['A', 'B', 'E'])
+        self.assertEqual(['A', 'B', 'E'], subgraph.nodes())
+        self.assertEqual(1, subgraph.number_of_edges())
+
+        graph.remove_node('B')
+        self.assertNotIn('B', graph)
+        self.assertEqual(4, graph.number_of_nodes())
+        self.assertEqual(2, graph.number_of_edges())
+        self.assertEqual(['C', 'D'], list(graph.successors('A')))
+        self.assertEqual(1, graph.in_degree('D'))
+        with self.assertRaises(KeyError):
+            list(graph.successors('B'))
+
+        # Adding edges after removing nodes
+        graph.add_edge('B', 'C', t='a')
+        self.assertEqual(['D'], list(graph.successors('A', t='a')))
+        self.assertEqual(['A', 'B'], list(graph.predecessors('C')))
+
+        nx_graph = graph.to_networkx()
+        self.assertCountEqual(graph.edges(data=True), nx_graph.edges(data=True))
+        self.assertCountEqual(graph.edges(data=True), CompactGraph.from_networkx(nx_graph).edges(data=True))
 
     def test_all_paths_simple(self):
         graph = nx.DiGraph()
@@ -47,7 +174,7 @@ class TestScheduler(unittest.TestCase):
         self.assertCountEqual(a, b)
 
     def test_all_paths_complex(self):
-        graph = scheduler.create_graph(self.load_course_repo(), ['COMPSCI 111', 'COMPSCI 112'])
+        graph = scheduler.create_graph(self.load_course_repo(), ['COMPSCI 111', 'COMPSCI 112']).to_networkx()
 
         src, dst = 'COMPSCI 111', 'EECS 10'
         a = list(nx.all_simple_paths(graph, src, dst))
@@ -71,6 +198,58 @@ class TestScheduler(unittest.TestCase):
         b = scheduler.custom_all_simple_paths(graph, src, dst)
         self.assertCountEqual(a, b)
 
+    def test_prerequisite_cycles(self):
+        graph = CompactGraph()
+        for src, dst, t in [('A', 'B', 'a'), ('B', 'C', 'a'), ('C', 'A', 'a'), ('A', 'D', 'a'), ('D', 'E', 'a'),
+                            ('E', 'F', 'b'), ('F', 'E', 'b'), ('C', 'F', 'a'), ('B', 'F', 'a')]:
+            graph.add_edge(src, dst, t=t)
+
+        # Longer cycles used to recurse forever
+        self.assertCountEqual(nx.all_simple_paths(graph.to_networkx(), 'A', 'F'), scheduler.custom_all_simple_paths(graph, 'A', 'F'))
+        self.assertEqual(2, scheduler.count_paths(graph, 'A', 'F'))  # Through D or not, cycles count as one node
+        self.assertEqual(0, scheduler.count_paths(graph, 'F', 'A'))
+        self.assertTrue(scheduler.has_path(graph, 'C', 'B'))
+        self.assertFalse(scheduler.has_path(graph, 'E', 'A'))
+
+        # E and F are only corequisites of each other, so they can be taken together
+        self.assertEqual([['A', 'B', 'C']], scheduler.find_prerequisite_cycles(graph))
+        with self.assertRaisesRegex(ValueError, 'A, B, C'):
+            scheduler.create_schedule_from_dag(graph)
+
+        course_repo = scheduler.CourseIndex([
+            {'department_code': 'A', 'number': '1', 'prerequisite_courses': ['or', ['B 1', 'C 1']]},
+            {'department_code': 'B', 'number': '1', 'prerequisite_courses': 'A 1'},
+        ])
+        cycles = []
+        scheduler.create_graph(course_repo, ['A 1'], cycles=cycles)
+        self.assertEqual([['A 1', 'B 1']], cycles)
+
+        # A cycle that only exists once corequisites are merged: A before B before C, but A and C together
+        graph = CompactGraph()
+        for src, dst, t in [('A', 'B', 'a'), ('B', 'C', 'a'), ('A', 'C', 'b')]:
+            graph.add_edge(src, dst, t=t)
+        self.assertEqual([], scheduler.find_prerequisite_cycles(graph))
+        with self.assertRaisesRegex(ValueError, r'\(A, B, C\)'):
+            scheduler.create_schedule_from_dag(graph)
+
+        # ENGRMAE 60 is a corequisite of ENGRMAE 172 and a prerequisite of its prerequisites
+        with self.assertRaisesRegex(ValueError, r'\(ENGRMAE 106, ENGRMAE 170, ENGRMAE 172, ENGRMAE 60, MATH 3D\)'):
+            scheduler.create_schedule(self.load_course_repo(), ['ENGRMAE 172'])
+
+        # Corequisites that list each other are not a cycle, also when there are several of them
+        graph = scheduler.create_graph(self.load_course_repo(), ['NUR SCI 110W'])
+        self.assertEqual('b', graph.edge_type('NUR SCI 110W', 'NUR SCI 112LA'))
+        self.assertEqual([], scheduler.find_prerequisite_cycles(graph))
+        schedule = scheduler.create_schedule(self.load_course_repo(), ['NUR SCI 110W'])
+        self.assertEqual(['NUR SCI 110W', 'NUR SCI 112LA', 'NUR SCI 114A', 'NUR SCI 118A'], sorted(schedule[-1]))
+
+        # Paths are counted without listing them
+        graph = CompactGraph()
+        for i in range(40):
+            for x, y in itertools.product(['a', 'b'], repeat=2):
+                graph.add_edge(f'{x}{i}', f'{y}{i + 1}', t='a')
+        self.assertEqual(2 ** 39, scheduler.count_paths(graph, 'a0', 'a40'))
+
     def test_scheduler_simple(self):
         graph = nx.DiGraph()
         graph.add_edge('A', 'B', t='a')
@@ -112,6 +291,32 @@ class TestScheduler(unittest.TestCase):
             ]
         )
 
+    def test_scheduler_corequisites(self):
+        graph = nx.DiGraph()
+        graph.add_edge('A', 'B', t='a')
+        graph.add_edge('B', 'C', t='a')
+        graph.add_edge('C', 'D', t='a')
+        graph.add_edge('E', 'F', t='b')
+        graph.add_edge('E', 'G', t='b')
+        graph.add_edge('H', 'I', t='a')
+        graph = graph.reverse()
+
+        # E, F and G don't fit next to D and I, so they wait for a quarter with enough room
+        schedule = scheduler.create_schedule_from_dag(graph, max_courses_per_quarter=4)
+        self.assert_schedule_one_of(
+            schedule,
+            [
+                [['D', 'I'], ['C', 'H'], ['B', 'E', 'F', 'G'], ['A']],
+                [['D', 'I'], ['C', 'E', 'F', 'G'], ['B', 'H'], ['A']]
+            ]
+        )
+
+        # A group that doesn't fit in any quarter is named
+        with self.assertRaisesRegex(ValueError, 'the corequisites E, F, G have to be taken in the same quarter'):
+            scheduler.create_schedule_from_dag(graph, max_courses_per_quarter=2)
+        with self.assertRaisesRegex(ValueError, 'the corequisites NUR SCI 112LB, NUR SCI 114B, .* same quarter'):
+            scheduler.create_schedule(self.load_course_repo(), ['NUR SCI 112LB'])
+
     def test_scheduler_complex(self):
         schedule = scheduler.create_schedule(
             self.load_course_repo(),
@@ -136,18 +341,19 @@ class TestScheduler(unittest.TestCase):
                 [['MATH 3A', 'I&C SCI 6D', 'CSE 46', 'CSE 42'], ['I&C SCI 33', 'CSE 45C', 'COMPSCI 111'], ['COMPSCI 112']]
             ]
         )
-    #
-    # def test_scheduler_corequisite_cycle(self):
-    #     schedule = scheduler.create_schedule(
-    #         ['MATH 105A']
-    #     )
-    #     self.assert_schedule_one_of(
-    #         schedule,
-    #         [
-    #             [['MATH 3A'], ['MATH 105A', 'MATH 105LA']]
-    #         ]
-    #     )
-    #
+
+    def test_scheduler_corequisite_cycle(self):
+        schedule = scheduler.create_schedule(
+            self.load_course_repo(),
+            ['MATH 105A']
+        )
+        self.assert_schedule_one_of(
+            schedule,
+            [
+                [['MATH 3A'], ['MATH 105A', 'MATH 105LA']]
+            ]
+        )
+
     # def test_scheduler_eecs163(self):
     #     schedule = scheduler.create_schedule(
     #         ['EECS 163']
@@ -159,6 +365,100 @@ class TestScheduler(unittest.TestCase):
     #         ]
     #     )
 
+    def test_optimize_schedule(self):
+        graph = CompactGraph()
+        for src, dst in [('A', 'D'), ('A', 'H'), ('B', 'F'), ('B', 'G'), ('B', 'H'), ('C', 'G'), ('C', 'H'), ('D', 'F'),
+                         ('D', 'G'), ('E', 'F'), ('E', 'G'), ('E', 'H')]:
+            graph.add_edge(src, dst, t='a')
+
+        # Taking the longest chains first wastes a slot in the third quarter
+        self.assertEqual(5, len(scheduler.create_schedule_from_dag(graph, 2)))
+        schedule, optimal = scheduler.optimize_schedule_from_dag(graph, 2)
+        self.assertEqual([['A', 'B'], ['C', 'E'], ['D', 'H'], ['F', 'G']], schedule)
+        self.assertTrue(optimal)
+
+        course_repo = self.load_course_repo()
+        required = ['CHINESE 101B', 'COMPSCI 111', 'COMPSCI 113', 'COMPSCI 171']
+        info = {}
+        schedule = scheduler.create_schedule(course_repo, required, deadline_ms=2000, info=info)
+        self.assertEqual(5, len(schedule))
+        self.assertTrue(info['optimal'])
+
+        # Out of time right away: still a schedule, no worse than without a deadline
+        schedule = scheduler.create_schedule(course_repo, required, deadline_ms=0, info=info)
+        self.assertEqual(5, len(schedule))
+        self.assertFalse(info['optimal'])
+
+    def test_closure_index(self):
+        course_repo = self.load_course_repo()
+        closure_index = closure_index_module.ClosureIndex.build(course_repo)
+
+        self.assertTrue(closure_index.is_upstream('I&C SCI 31', 'COMPSCI 161'))
+        self.assertFalse(closure_index.is_upstream('COMPSCI 161', 'I&C SCI 31'))
+        self.assertIn('COMPSCI 161', closure_index.unlocks('I&C SCI 31'))
+        self.assertEqual(len(closure_index.unlocks('MATH 2A')), closure_index.unlock_count('MATH 2A'))
+
+        # Saving and loading gives the same closures
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'closure.json')
+            closure_index.save(path)
+            loaded = closure_index_module.ClosureIndex.load(path)
+        self.assertEqual(closure_index.requires('COMPSCI 161'), loaded.requires('COMPSCI 161'))
+        self.assertEqual(closure_index.unlocks('MATH 2A'), loaded.unlocks('MATH 2A'))
+
+        # The graph only contains courses from the closure, and is the same with or without it
+        for required in [['COMPSCI 161'], ['CHINESE 101B', 'COMPSCI 111', 'COMPSCI 113']]:
+            graph = scheduler.create_graph(course_repo, required)
+            courses = {x for x in graph.nodes() if not x.startswith('or')}
+            self.assertEqual(courses, set(closure_index.closure_of(required)))
+
+            graph_from_closure = scheduler.create_graph(course_repo, required, closure_index=closure_index)
+            self.assertEqual(graph.number_of_nodes(), graph_from_closure.number_of_nodes())
+            self.assertEqual(graph.number_of_edges(), graph_from_closure.number_of_edges())
+            self.assertEqual(
+                scheduler.create_schedule(course_repo, required),
+                scheduler.create_schedule(course_repo, required, closure_index=closure_index)
+            )
+
+        # Workers load the closures next to the catalog, but only for the catalog files they were built from
+        for catalog_path in ['../catalog_parser/catalog.json', '../catalog_parser/catalog.bin']:
+            _, _, loaded = create_schedule.CatalogCache().load(catalog_path)
+            self.assertIsNotNone(loaded)
+            self.assertEqual(closure_index.requires('COMPSCI 161'), loaded.requires('COMPSCI 161'))
+        with tempfile.TemporaryDirectory() as directory:
+            catalog_path = os.path.join(directory, 'catalog.json')
+            with open(catalog_path, 'w') as file:
+                json.dump([{'department_code': 'A', 'number': '1'}], file)
+            self.assertIsNone(create_schedule.CatalogCache().load(catalog_path)[2])
+            closure_index.save(create_schedule.get_closure_path(catalog_path))
+            self.assertIsNone(create_schedule.CatalogCache().load(catalog_path)[2])
+            closure_index.catalog_hashes = [closure_index_module.get_file_hash(catalog_path)]
+            closure_index.save(create_schedule.get_closure_path(catalog_path))
+            self.assertIsNotNone(create_schedule.CatalogCache().load(catalog_path)[2])
+
+    def test_and_or_solver(self):
+        course_repo = self.load_course_repo()
+        for required in [
+            ['COMPSCI 111', 'COMPSCI 112'],
+            ['COMPSCI 111', 'COMPSCI 112', 'I&C SCI 33'],
+            ['CHINESE 101B', 'COMPSCI 111', 'COMPSCI 113']
+        ]:
+            graph = scheduler.create_graph(course_repo, required)
+
+            # Smallest union of all combinations, the exhaustive way
+            expected = None
+            for combination in itertools.product(*[scheduler.get_all_combinations(graph, x) for x in required]):
+                s = set()
+                for c in combination:
+                    s.update(c)
+                if expected is None or len(s) < len(expected):
+                    expected = s
+
+            actual = scheduler.AndOrSolver(graph).solve(required)
+            self.assertEqual(len(expected), len(actual))
+            for course in required:
+                self.assertIn(course, actual)
+
     def test_scheduler_hang(self):
         schedule = scheduler.create_schedule(
             self.load_course_repo(),
@@ -168,10 +468,364 @@ class TestScheduler(unittest.TestCase):
         self.assert_schedule_one_of(
             schedule,
             [
-                [['COMPSCI 171', 'MATH 3A', 'I&C SCI 6D', 'CSE 46'], ['COMPSCI 113', 'COMPSCI 111', 'CHINESE 2DC'], ['CHINESE 3A'], ['CHINESE 3B'], ['CHINESE 3C'], ['CHINESE 101B']]
+                # The CHINESE chain is the bottleneck, so it is started in the first quarter
+                [['CHINESE 2DC', 'MATH 3A', 'I&C SCI 6D', 'CSE 46'], ['CHINESE 3A', 'COMPSCI 171', 'COMPSCI 111'], ['CHINESE 3B', 'COMPSCI 113'], ['CHINESE 3C'], ['CHINESE 101B']],
+                [['CHINESE 2DC', 'COMPSCI 171', 'CSE 46', 'I&C SCI 6D'], ['CHINESE 3A', 'MATH 3A', 'COMPSCI 113'], ['CHINESE 3B', 'COMPSCI 111'], ['CHINESE 3C'], ['CHINESE 101B']]
             ]
         )
 
+    def test_iter_schedules(self):
+        course_repo = self.load_course_repo()
+        required = ['COMPSCI 111', 'COMPSCI 112']
+
+        plans = list(scheduler.iter_schedules(course_repo, required, k=5))
+        self.assertEqual(5, len(plans))
+        self.assertEqual(scheduler.create_schedule(course_repo, required), plans[0][1])
+
+        course_sets = [x for x, _ in plans]
+        self.assertEqual(len(course_sets), len({frozenset(x) for x in course_sets}))
+        for course_set, schedule in plans:
+            self.assertTrue(set(required) <= course_set)
+            self.assertEqual(course_set, {x for quarter in schedule for x in quarter})
+
+        # Plans come out cheapest first
+        graph = scheduler.create_graph(course_repo, required)
+        sizes = [len(x) for x in itertools.islice(scheduler.AndOrSolver(graph).iter_solutions(required), 20)]
+        self.assertEqual(sorted(sizes), sizes)
+        self.assertEqual(len(scheduler.AndOrSolver(graph).solve(required)), sizes[0])
+
+    def test_remove_completed_courses(self):
+        course_repo = scheduler.CourseIndex([
+            {'department_code': 'A', 'number': '1', 'prerequisite_courses': ['and', ['B 1', ['or', ['C 1', 'D 1']]]]},
+            {'department_code': 'B', 'number': '1', 'prerequisite_courses': 'E 1'},
+            {'department_code': 'C', 'number': '1', 'prerequisite_courses': 'E 1'},
+            {'department_code': 'D', 'number': '1', 'prerequisite_courses': 'F 1'},
+            {'department_code': 'E', 'number': '1', 'equivalent': ['G 1']},
+            {'department_code': 'F', 'number': '1'},
+            {'department_code': 'H', 'number': '1', 'equivalent': ['A 1']},
+        ])
+
+        # D 1 satisfies the 'or', so C 1 is no longer needed. E 1 is still needed by B 1.
+        graph = scheduler.create_graph(course_repo, ['A 1'])
+        scheduler.remove_completed_courses(graph, ['D 1', 'Z 9'], ['A 1'], course_repo)
+        self.assertEqual({'A 1', 'B 1', 'E 1'}, set(graph.nodes()))
+
+        # G 1 is the same course as E 1
+        self.assertEqual([['B 1', 'C 1'], ['A 1']], scheduler.create_schedule(course_repo, ['A 1'], completed_courses=['G 1', 'F 1']))
+        self.assertEqual([], scheduler.create_schedule(course_repo, ['A 1'], completed_courses=['H 1']))
+
+    def test_update_plan(self):
+        course_repo = scheduler.CourseIndex([
+            {'department_code': 'A', 'number': '1', 'prerequisite_courses': ['and', ['B 1', ['or', ['C 1', 'D 1']]]]},
+            {'department_code': 'B', 'number': '1', 'prerequisite_courses': 'E 1'},
+            {'department_code': 'C', 'number': '1', 'prerequisite_courses': 'E 1'},
+            {'department_code': 'D', 'number': '1', 'prerequisite_courses': 'F 1'},
+            {'department_code': 'E', 'number': '1', 'equivalent': ['G 1']},
+            {'department_code': 'F', 'number': '1'},
+        ])
+        plan = scheduler.create_plan(course_repo, ['A 1'])
+        self.assertEqual([['E 1'], ['B 1', 'C 1'], ['A 1']], plan.schedule)
+
+        # D 1 satisfies the 'or', so the branch that was picked is dropped
+        self.assertEqual([['E 1'], ['B 1'], ['A 1']], scheduler.update_plan(course_repo, plan, ['D 1']).schedule)
+
+        plan = scheduler.update_plan(course_repo, plan, ['G 1'])
+        self.assertEqual([['B 1', 'C 1'], ['A 1']], plan.schedule)
+        plan = scheduler.update_plan(course_repo, plan, plan.schedule[0])
+        self.assertEqual([['A 1']], plan.schedule)
+        self.assertEqual([], scheduler.update_plan(course_repo, plan, ['A 1']).schedule)
+
+        # Completing the plan one quarter at a time leaves as many quarters as scheduling from scratch
+        course_repo = self.load_course_repo()
+        required_courses = ['COMPSCI 111', 'COMPSCI 112', 'I&C SCI 33']
+        plan = scheduler.create_plan(course_repo, required_courses)
+        completed_courses = []
+        while len(plan.schedule) > 0:
+            completed_courses += plan.schedule[0]
+            plan = scheduler.update_plan(course_repo, plan, plan.schedule[0])
+            schedule = scheduler.create_schedule(course_repo, required_courses, completed_courses=completed_courses)
+            self.assertEqual(len(schedule), len(plan.schedule))
+
+    def test_create_schedules_batch(self):
+        course_repo = self.load_course_repo()
+        requests = [
+            {'required_courses': ['COMPSCI 111', 'COMPSCI 112']},
+            {'required_courses': ['COMPSCI 112', 'I&C SCI 33'], 'max_courses_per_quarter': 2},
+            {'required_courses': ['CHINESE 101B', 'COMPSCI 111', 'COMPSCI 113']},
+            {'required_courses': ['COMPSCI 111', 'COMPSCI 161'], 'completed_courses': ['I&C SCI 46']},
+            {'required_courses': ['COMPSCI 111', 'COMPSCI 112']},
+            {'required_courses': ['COMPSCI 112', 'I&C SCI 33'], 'completed_courses': ['I&C SCI 32', 'MATH 2A', 'XYZ 1']},
+        ]
+        expected = [
+            scheduler.create_schedule(
+                course_repo,
+                x['required_courses'],
+                x.get('max_courses_per_quarter', 4),
+                x.get('completed_courses')
+            )
+            for x in requests
+        ]
+        self.assertEqual(expected, scheduler.create_schedules_batch(course_repo, requests))
+        self.assertEqual(expected, scheduler.create_schedules_batch(course_repo, requests, processes=2))
+
+        # A request that can't be scheduled only fails itself
+        requests.insert(1, {'required_courses': ['COMPSCI 111', 'ENGRMAE 172']})
+        with self.assertRaises(ValueError):
+            scheduler.create_schedule(course_repo, requests[1]['required_courses'])
+        for processes in [None, 2]:
+            schedules = scheduler.create_schedules_batch(course_repo, requests, processes=processes)
+            self.assertIn('cycle', schedules[1]['error'])
+            self.assertEqual(expected, schedules[:1] + schedules[2:])
+
+    def test_metrics(self):
+        course_repo = self.load_course_repo()
+        required = ['COMPSCI 111', 'COMPSCI 112']
+
+        metrics = {}
+        schedule = scheduler.create_schedule(course_repo, required, metrics=metrics)
+        self.assertEqual(schedule, scheduler.create_schedule(course_repo, required))
+        self.assertCountEqual(['graph', 'prune', 'solve', 'collapse', 'schedule'], metrics['time_ms'].keys())
+        self.assertEqual(sum(len(x) for x in schedule), metrics['courses'])
+        self.assertEqual(metrics['combinations']['COMPSCI 111'] * metrics['combinations']['COMPSCI 112'], metrics['product'])
+
+        # The counts match a full enumeration of the combinations
+        graph = scheduler.create_graph(course_repo, required)
+        self.assertEqual(len(scheduler.get_all_combinations(graph, 'COMPSCI 111')), metrics['combinations']['COMPSCI 111'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            old_profile, old_profile_dir = create_schedule.PROFILE, create_schedule.PROFILE_DIR
+            create_schedule.PROFILE_DIR = directory
+            try:
+                for profile in ['cprofile', 'tracemalloc']:
+                    create_schedule.PROFILE = profile
+                    response = create_schedule._respond({'id': 1, 'required_courses': required, 'metrics': True}, course_repo)
+                    self.assertIn('_metrics', response)
+                self.assertEqual(2, len(os.listdir(directory)))
+            finally:
+                create_schedule.PROFILE, create_schedule.PROFILE_DIR = old_profile, old_profile_dir
+
+    def test_synthetic_catalog(self):
+        catalog = synthetic_catalog.generate_catalog(2000, corequisite_cycles=2, seed=3)
+        self.assertEqual(catalog, synthetic_catalog.generate_catalog(2000, corequisite_cycles=2, seed=3))
+        self.assertNotEqual(catalog, synthetic_catalog.generate_catalog(2000, corequisite_cycles=2, seed=4))
+
+        course_index = scheduler.CourseIndex(catalog)
+        self.assertEqual(len(catalog), len(course_index))
+        for course in catalog:
+            for course_id in closure_index_module.get_requirement_edges(course) + course.get('equivalent', []):
+                self.assertIn(course_id, course_index)
+        self.assertTrue(any(isinstance(x.get('prerequisite_courses'), list) for x in catalog))
+        self.assertTrue(any('equivalent' in x for x in catalog))
+
+        # Courses that are corequisites of each other are taken together
+        course_ids = [f'{x["department_code"]} {x["number"]}' for x in catalog]
+        cycle = [x for x in course_ids if course_index.get(course_index.get(x).get('corequisite_courses', '')) is not None
+                 and course_index.get(course_index.get(x)['corequisite_courses']).get('corequisite_courses') == x]
+        self.assertEqual(4, len(cycle))
+        schedule = scheduler.create_schedule(course_index, cycle[:1])
+        self.assertIn(sorted(cycle[:1] + [course_index.get(cycle[0])['corequisite_courses']]), [sorted(x) for x in schedule])
+
+    def test_benchmark_baseline(self):
+        course_repo = self.load_course_repo()
+        cases = {'COMPSCI/2': ['COMPSCI 111', 'COMPSCI 112']}
+        results = benchmark.run_suite(course_repo, cases, repeat=2)
+        baseline = benchmark.make_baseline(cases, results)
+        self.assertEqual([], benchmark.check_baseline(baseline, results))
+
+        results['COMPSCI/2']['create_graph']['peak_kib'] *= 2
+        self.assertEqual(1, len(benchmark.check_baseline(baseline, results)))
+
+        # Cases missing from the baseline or the results fail unless they are allowed
+        results['COMPSCI/3'] = results.pop('COMPSCI/2')
+        failures = benchmark.check_baseline(baseline, results)
+        self.assertIn('COMPSCI/3 create_graph p50_ms: missing from the baseline', failures)
+        self.assertIn('COMPSCI/2 create_graph p50_ms: missing from the results', failures)
+        self.assertEqual([], benchmark.check_baseline(baseline, results, allow_missing=True))
+
+        cases = {'COMPSCI/3': cases['COMPSCI/2']}
+        updated = benchmark.update_baseline(baseline, cases, results)
+        self.assertEqual(cases, updated['cases'])
+        self.assertEqual([], benchmark.get_missing(updated, results))
+
+        # The committed baseline covers every case of the suite
+        with open(benchmark.DEFAULT_BASELINE) as file:
+            baseline = json.load(file)
+        self.assertEqual(benchmark.BASELINE_VERSION, baseline['version'])
+        self.assertEqual(sorted(benchmark.get_suite_cases(course_repo)), sorted(baseline['thresholds']))
+
+    def test_startup_imports(self):
+        # Timing is left to benchmark.py --startup-budget-ms, which is too noisy for a test
+        import_times = benchmark.get_import_times('create_schedule')
+        self.assertIn('scheduler', import_times)
+        for module in benchmark.STARTUP_EXCLUDED_MODULES:
+            self.assertNotIn(module, import_times)
+
+    def test_catalog_ref(self):
+        course_repo = [
+            {'department_code': 'A', 'number': '2', 'prerequisite_courses': 'A 1'},
+            {'department_code': 'A', 'number': '1'},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.json')
+            with open(path, 'w') as file:
+                json.dump(course_repo, file)
+            with open(path, 'rb') as file:
+                catalog_ref = {'path': path, 'hash': hashlib.sha256(file.read()).hexdigest()}
+
+            request = {'id': 1, 'catalog_ref': catalog_ref, 'required_courses': ['A 2']}
+            self.assertEqual({'q1': ['A 1'], 'q2': ['A 2']}, create_schedule._respond(request, None)['schedule'])
+            catalog = create_schedule.get_request_catalog(request)
+            self.assertIs(catalog, create_schedule.get_request_catalog(request))
+
+            # A new version of the file only counts once it is referenced by its hash
+            with open(path, 'w') as file:
+                json.dump(course_repo[1:], file)
+            self.assertIs(catalog, create_schedule.get_request_catalog(request))
+            self.assertIn('error', create_schedule._respond({**request, 'catalog_ref': {'path': path, 'hash': 'abc'}}, None))
+
+            with open(path, 'rb') as file:
+                request['catalog_ref'] = {'path': path, 'hash': hashlib.sha256(file.read()).hexdigest()}
+            self.assertEqual({'q1': ['A 2']}, create_schedule._respond(request, None)['schedule'])
+
+            # Inline catalogs still work
+            catalog = create_schedule.get_request_catalog({'catalog': course_repo})
+            self.assertEqual({'q1': ['A 1'], 'q2': ['A 2']}, create_schedule.handle_request(catalog, request))
+
+    def test_one_shot(self):
+        with open('../catalog_parser/catalog.json', 'rb') as file:
+            catalog_ref = {'path': '../catalog_parser/catalog.json', 'hash': hashlib.sha256(file.read()).hexdigest()}
+        for deadline_ms in [None, 1000]:
+            payload = {'catalog_ref': catalog_ref, 'required_courses': ['I&C SCI 33'], 'deadline_ms': deadline_ms}
+            output = subprocess.run([sys.executable, 'create_schedule.py'], input=json.dumps(payload),
+                                    stdout=subprocess.PIPE, check=True, text=True).stdout
+            self.assertEqual({'q1': ['CSE 42'], 'q2': ['I&C SCI 33'], '_optimal': True,
+                              '_deadline_reached': False}, json.loads(output))
+
+    def test_worker(self):
+        requests = [
+            {'id': 1, 'required_courses': ['COMPSCI 111', 'COMPSCI 112']},
+            {'id': 'b', 'required_courses': ['I&C SCI 33'], 'completed_courses': ['I&C SCI 32'], 'deadline_ms': 1000},
+            {'id': 3},
+            {'id': 4, 'requests': [
+                {'required_courses': ['I&C SCI 33'], 'completed_courses': ['I&C SCI 32']},
+                {'required_courses': ['ENGRMAE 172']},  # Prerequisite cycle
+            ]},
+        ]
+        input_file = io.StringIO('\n'.join(json.dumps(x) for x in requests) + '\nnot json\n')
+
+        for processes in [0, 2]:
+            input_file.seek(0)
+            output_file = io.StringIO()
+            pool = create_schedule.WorkerPool('../catalog_parser/catalog.json', processes=processes, max_requests=1)
+            create_schedule.serve_stdio(pool, input_file, output_file)
+
+            responses = {}
+            for line in output_file.getvalue().splitlines():
+                response = json.loads(line)
+                responses[response['id']] = response
+
+            self.assertCountEqual([1, 'b', 3, 4, None], responses.keys())
+            self.assert_schedule_one_of(
+                list(responses[1]['schedule'].values()),
+                [
+                    [['MATH 3A', 'I&C SCI 6D', 'CSE 46', 'CSE 45C'], ['COMPSCI 111', 'COMPSCI 112']],
+                    [['MATH 3A', 'I&C SCI 6D', 'CSE 45C'], ['COMPSCI 112', 'I&C SCI 46'], ['COMPSCI 111']]
+                ]
+            )
+            self.assertEqual({'q1': ['I&C SCI 33']}, responses['b']['schedule'])
+            self.assertTrue(responses['b']['optimal'])
+            self.assertEqual({'q1': ['I&C SCI 33']}, responses[4]['schedules'][0])
+            self.assertIn('error', responses[4]['schedules'][1])
+            self.assertIn('error', responses[3])
+            self.assertIn('error', responses[None])
+
+    def test_worker_crash(self):
+        respond = create_schedule._respond
+
+        def crash_or_respond(request, *args, **kwargs):
+            if request.get('crash'):
+                os._exit(3)
+            return respond(request, *args, **kwargs)
+
+        # Workers are forked, so they crash on the marked request
+        create_schedule._respond = crash_or_respond
+        try:
+            pool = create_schedule.WorkerPool('../catalog_parser/catalog.json', processes=2)
+        finally:
+            create_schedule._respond = respond
+
+        responses = queue.Queue()
+        start = time.perf_counter()
+        pool.submit({'id': 'crash', 'crash': True}, responses.put)
+        for i in range(20):
+            pool.submit({'id': i, 'required_courses': ['I&C SCI 33'], 'completed_courses': ['I&C SCI 32']}, responses.put)
+        received = {}
+        for _ in range(21):
+            response = responses.get(timeout=10)
+            received[response['id']] = (response, time.perf_counter() - start)
+        pool.close()
+
+        self.assertEqual('Worker exited with code 3', received['crash'][0]['error'])
+        self.assertLess(received['crash'][1], 0.9)  # Noticed without waiting for the results to go quiet
+        self.assertEqual({'q1': ['I&C SCI 33']}, received[19][0]['schedule'])
+
+    def test_schedule_cache(self):
+        cache = create_schedule.ScheduleCache(max_entries=2, max_bytes=150)
+        responses = []
+        pending = []
+        cache.submit('a', responses.append, pending.append)
+        cache.submit('a', responses.append, pending.append)
+        self.assertEqual(1, len(pending))  # The second request waits for the first one
+        pending[0]({'schedule': {'q1': ['A 1']}, 'optimal': True, 'deadline_reached': False})
+        cache.submit('a', responses.append, pending.append)
+        self.assertEqual([{'schedule': {'q1': ['A 1']}, 'optimal': True, 'deadline_reached': False}] * 3, responses)
+        self.assertEqual({'hits': 1, 'misses': 1, 'coalesced': 1, 'entries': 1, 'bytes': 73}, cache.stats())
+
+        # Errors and schedules that ran out of time aren't cached, entries are dropped by count and by size
+        cache.submit('b', responses.append, lambda done: done({'error': 'x'}))
+        cache.submit('b', responses.append, lambda done: done({'schedule': {}, 'optimal': False, 'deadline_reached': True}))
+        self.assertEqual(1, cache.stats()['entries'])
+        cache.submit('b', responses.append, lambda done: done({'schedule': {}, 'optimal': False, 'deadline_reached': False}))
+        cache.submit('c', responses.append, lambda done: done({'schedule': {}, 'optimal': True, 'deadline_reached': False}))
+        self.assertEqual(2, cache.stats()['entries'])
+        cache.submit('d', responses.append, lambda done: done({'schedule': {'q1': ['A' * 80]}, 'deadline_reached': False}))
+        self.assertEqual(1, cache.stats()['entries'])
+        self.assertEqual(6, cache.misses)
+
+        # Requests that only differ in order and spacing share a response, whether or not the schedule is known to be
+        # optimal. Requests with a deadline search for a shorter schedule, so they don't share it with the others.
+        with open('../catalog_parser/catalog.json', 'rb') as file:
+            catalog_ref = {'path': '../catalog_parser/catalog.json', 'hash': hashlib.sha256(file.read()).hexdigest()}
+        required_courses = ['COMPSCI 112', 'COMPSCI  111', 'I&C SCI 33']
+        requests = [
+            {'id': 1, 'catalog_ref': catalog_ref, 'required_courses': required_courses},
+            {'id': 2, 'catalog_ref': catalog_ref, 'required_courses': ['I&C SCI 33', 'COMPSCI 111', ' COMPSCI 112']},
+            {'id': 3, 'catalog_ref': catalog_ref, 'required_courses': required_courses, 'deadline_ms': 500},
+            {'id': 4, 'catalog_ref': catalog_ref, 'required_courses': required_courses, 'deadline_ms': 1000},
+            {'id': 5, 'stats': True},
+        ]
+        pool = create_schedule.WorkerPool('../catalog_parser/catalog.json', processes=0, cache=create_schedule.ScheduleCache())
+        responses = []
+        for request in requests:
+            pool.submit(request, responses.append)
+        self.assertEqual([1, 2, 3, 4, 5], [x['id'] for x in responses])
+        self.assertEqual(responses[0]['schedule'], responses[1]['schedule'])
+        self.assertFalse(responses[0]['deadline_reached'])
+        self.assertFalse(responses[2]['deadline_reached'])
+        self.assertEqual(responses[2]['schedule'], responses[3]['schedule'])
+        self.assertEqual(2, responses[4]['stats']['hits'])
+        self.assertEqual(2, responses[4]['stats']['misses'])
+        self.assertEqual(['COMPSCI 112', 'COMPSCI  111', 'I&C SCI 33'], required_courses)
+
+    def test_create_schedule_arguments(self):
+        course_repo = self.load_course_repo()
+        required_courses = ['COMPSCI 112', 'COMPSCI 111', 'I&C SCI 33']
+        completed_courses = ['I&C SCI 31']
+        for deadline_ms in [None, 100]:
+            scheduler.create_schedule(course_repo, required_courses, completed_courses=completed_courses, deadline_ms=deadline_ms)
+        self.assertEqual(['COMPSCI 112', 'COMPSCI 111', 'I&C SCI 33'], required_courses)
+        self.assertEqual(['I&C SCI 31'], completed_courses)
+
 
 if __name__ == '__main__':
     unittest.main()